@@ -1,747 +1,841 @@
-class MaganteOTC {
-    constructor() {
-        this.apiBase = 'https://magnate-otc-2.onrender.com';
-        this.currentUser = null;
-        this.token = localStorage.getItem('magante_token');
-        
-        console.log('🚀 Magante OTC инициализирован');
-        
-        this.init();
-    }
-
-    async init() {
-        if (this.token) {
-            console.log('🔄 Попытка автоматического входа...');
-            const success = await this.validateToken();
-            if (!success) {
-                this.showLoginForm();
-            }
-        } else {
-            this.showLoginForm();
-        }
-        
-        this.setupEventListeners();
-    }
-
-    setupEventListeners() {
-        console.log('🔧 Настройка обработчиков событий...');
-        
-        // Логин форма
-        const loginForm = document.getElementById('loginForm');
-        if (loginForm) {
-            loginForm.addEventListener('submit', (e) => {
-                e.preventDefault();
-                const login = document.getElementById('login').value;
-                const password = document.getElementById('password').value;
-                this.login(login, password);
-            });
-        }
-
-        // Создание сделки
-        const dealForm = document.getElementById('createDealForm');
-        if (dealForm) {
-            dealForm.addEventListener('submit', (e) => {
-                e.preventDefault();
-                const amount = document.getElementById('dealAmount').value;
-                const description = document.getElementById('dealDescription').value;
-                const paymentMethod = document.getElementById('dealPaymentMethod').value;
-                this.createDeal(amount, description, paymentMethod);
-            });
-        }
-
-        // Создание тикета
-        const ticketForm = document.getElementById('newTicketForm');
-        if (ticketForm) {
-            ticketForm.addEventListener('submit', (e) => {
-                e.preventDefault();
-                const subject = document.getElementById('ticketSubject').value;
-                const message = document.getElementById('ticketMessage').value;
-                this.createTicket(subject, message);
-            });
-        }
-    }
-
-    async validateToken() {
-        try {
-            console.log('🔐 Проверка токена...');
-            const response = await fetch(`${this.apiBase}/api/profile`, {
-                headers: {
-                    'Authorization': `Bearer ${this.token}`,
-                    'Accept': 'application/json'
-                }
-            });
-
-            if (response.ok) {
-                const profile = await response.json();
-                this.currentUser = profile;
-                this.showDashboard();
-                console.log('✅ Автоматический вход выполнен:', profile.username);
-                return true;
-            } else {
-                console.log('❌ Токен невалиден');
-                localStorage.removeItem('magante_token');
-                this.token = null;
-                return false;
-            }
-        } catch (error) {
-            console.error('❌ Ошибка проверки токена:', error);
-            return false;
-        }
-    }
-
-    async login(login, password) {
-        try {
-            this.showLoading(true);
-            console.log('🔐 Отправка запроса на вход...');
-
-            const response = await fetch(`${this.apiBase}/api/login`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Accept': 'application/json'
-                },
-                body: JSON.stringify({ 
-                    login: login.trim(),
-                    password: password.trim()
-                })
-            });
-
-            console.log('📡 Ответ сервера:', response.status);
-
-            if (!response.ok) {
-                const errorData = await response.json().catch(() => ({}));
-                throw new Error(errorData.error || `Ошибка сервера: ${response.status}`);
-            }
-
-            const data = await response.json();
-            console.log('📦 Данные ответа:', data);
-
-            this.currentUser = data.user;
-            this.token = data.token;
-            localStorage.setItem('magante_token', this.token);
-            this.showDashboard();
-            this.showToast('✅ Успешный вход!', 'success');
-            return true;
-            
-        } catch (error) {
-            console.error('❌ Ошибка входа:', error);
-            this.showToast(error.message, 'error');
-            return false;
-        } finally {
-            this.showLoading(false);
-        }
-    }
-
-    async createDeal(amount, description, paymentMethod) {
-        try {
-            this.showLoading(true);
-            console.log('💼 Создание сделки...');
-
-            const response = await fetch(`${this.apiBase}/api/deals`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Authorization': `Bearer ${this.token}`,
-                    'Accept': 'application/json'
-                },
-                body: JSON.stringify({
-                    amount: parseFloat(amount),
-                    description: description.trim(),
-                    payment_method: paymentMethod
-                })
-            });
-
-            console.log('📡 Ответ создания сделки:', response.status);
-
-            if (!response.ok) {
-                const errorData = await response.json().catch(() => ({}));
-                throw new Error(errorData.error || `Ошибка сервера: ${response.status}`);
-            }
-
-            const data = await response.json();
-            console.log('📦 Данные сделки:', data);
-
-            this.showToast('✅ Сделка создана! Ссылка отправлена в Telegram бот.', 'success');
-            document.getElementById('createDealForm').reset();
-            
-            // Переключаемся на список сделок и обновляем
-            this.showSection('dealsSection');
-            return data;
-            
-        } catch (error) {
-            console.error('❌ Ошибка создания сделки:', error);
-            this.showToast(error.message, 'error');
-            return null;
-        } finally {
-            this.showLoading(false);
-        }
-    }
-
-    async loadUserDeals() {
-        try {
-            console.log('📊 Загрузка сделок...');
-            const response = await fetch(`${this.apiBase}/api/deals/my`, {
-                headers: {
-                    'Authorization': `Bearer ${this.token}`,
-                    'Accept': 'application/json'
-                }
-            });
-
-            console.log('📡 Ответ загрузки сделок:', response.status);
-
-            if (response.ok) {
-                const deals = await response.json();
-                this.displayDeals(deals);
-                console.log('✅ Сделки загружены:', deals.length);
-            } else {
-                throw new Error('Ошибка загрузки сделок');
-            }
-        } catch (error) {
-            console.error('❌ Ошибка загрузки сделок:', error);
-            this.showToast('Ошибка загрузки сделок', 'error');
-            this.displayDeals([]);
-        }
-    }
-
-    async loadProfile() {
-        try {
-            console.log('👤 Загрузка профиля...');
-            const response = await fetch(`${this.apiBase}/api/profile`, {
-                headers: {
-                    'Authorization': `Bearer ${this.token}`,
-                    'Accept': 'application/json'
-                }
-            });
-
-            if (response.ok) {
-                const profile = await response.json();
-                this.displayProfile(profile);
-                this.updateUserBalance(profile.balance);
-                console.log('✅ Профиль загружен');
-            } else {
-                console.log('❌ Ошибка загрузки профиля');
-            }
-        } catch (error) {
-            console.error('❌ Ошибка загрузки профиля:', error);
-        }
-    }
-
-    async createTicket(subject, message) {
-        try {
-            this.showLoading(true);
-            console.log('🎫 Создание тикета...');
-
-            const response = await fetch(`${this.apiBase}/api/tickets`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Authorization': `Bearer ${this.token}`,
-                    'Accept': 'application/json'
-                },
-                body: JSON.stringify({
-                    subject: subject.trim(),
-                    message: message.trim()
-                })
-            });
-
-            console.log('📡 Ответ создания тикета:', response.status);
-
-            if (!response.ok) {
-                const errorData = await response.json().catch(() => ({}));
-                throw new Error(errorData.error || `Ошибка сервера: ${response.status}`);
-            }
-
-            const data = await response.json();
-
-            this.showToast('✅ Тикет создан! Администраторы уведомлены.', 'success');
-            document.getElementById('newTicketForm').reset();
-            this.hideCreateTicket();
-            
-            // Обновляем список тикетов
-            this.loadUserTickets();
-            return data;
-            
-        } catch (error) {
-            console.error('❌ Ошибка создания тикета:', error);
-            this.showToast(error.message, 'error');
-            return false;
-        } finally {
-            this.showLoading(false);
-        }
-    }
-
-    async loadUserTickets() {
-        try {
-            console.log('🎫 Загрузка тикетов...');
-            const response = await fetch(`${this.apiBase}/api/tickets/my`, {
-                headers: {
-                    'Authorization': `Bearer ${this.token}`,
-                    'Accept': 'application/json'
-                }
-            });
-
-            console.log('📡 Ответ загрузки тикетов:', response.status);
-
-            if (response.ok) {
-                const tickets = await response.json();
-                this.displayTickets(tickets);
-                console.log('✅ Тикеты загружены:', tickets.length);
-            } else {
-                throw new Error('Ошибка загрузки тикетов');
-            }
-        } catch (error) {
-            console.error('❌ Ошибка загрузки тикетов:', error);
-            this.showToast('Ошибка загрузки тикетов', 'error');
-            this.displayTickets([]);
-        }
-    }
-
-    displayDeals(deals) {
-        const container = document.getElementById('dealsList');
-        if (!container) {
-            console.error('❌ Контейнер dealsList не найден!');
-            return;
-        }
-
-        if (!deals || deals.length === 0) {
-            container.innerHTML = `
-                <div class="col-12">
-                    <div class="alert alert-info text-center py-4">
-                        <i class="fas fa-info-circle fa-2x mb-3"></i>
-                        <h5>У вас пока нет сделок</h5>
-                        <p class="text-muted mb-0">Создайте первую сделку во вкладке "Создать сделку"</p>
-                    </div>
-                </div>
-            `;
-            return;
-        }
-
-        container.innerHTML = deals.map(deal => {
-            const dealLink = `https://t.me/magnate_otc_bot?start=${deal.id}`;
-            return `
-                <div class="col-md-6 mb-4">
-                    <div class="card feature-card h-100">
-                        <div class="card-body">
-                            <div class="d-flex justify-content-between align-items-start mb-3">
-                                <h5 class="card-title mb-0">
-                                    <i class="fas fa-exchange-alt me-2"></i>
-                                    Сделка #${deal.id?.slice(-8) || 'N/A'}
-                                </h5>
-                                <span class="badge bg-${this.getStatusColor(deal.status)}">
-                                    ${this.getStatusText(deal.status)}
-                                </span>
-                            </div>
-                            <p class="card-text">${deal.description || 'Описание отсутствует'}</p>
-                            <div class="deal-info">
-                                <div class="row small">
-                                    <div class="col-6">
-                                        <strong>Сумма:</strong><br>
-                                        <span class="fw-bold">${deal.amount} ${this.getPaymentMethodText(deal.payment_method)}</span>
-                                    </div>
-                                    <div class="col-6">
-                                        <strong>Статус:</strong><br>
-                                        <span class="badge bg-${this.getStatusColor(deal.status)}">${this.getStatusText(deal.status)}</span>
-                                    </div>
-                                </div>
-                                <div class="row small mt-2">
-                                    <div class="col-6">
-                                        <strong>Создана:</strong><br>
-                                        ${new Date(deal.created_at).toLocaleDateString('ru-RU')}
-                                    </div>
-                                    <div class="col-6">
-                                        <strong>ID:</strong><br>
-                                        <code class="small">${deal.id?.slice(-12) || 'N/A'}</code>
-                                    </div>
-                                </div>
-                                ${deal.status === 'active' ? `
-                                    <div class="mt-3">
-                                        <strong>🔗 Ссылка для покупателя:</strong>
-                                        <div class="input-group input-group-sm mt-1">
-                                            <input type="text" class="form-control" value="${dealLink}" readonly>
-                                            <button class="btn btn-outline-secondary" type="button" onclick="copyToClipboard('${dealLink}')">
-                                                <i class="fas fa-copy"></i>
-                                            </button>
-                                        </div>
-                                        <small class="text-muted">Отправьте эту ссылку покупателю</small>
-                                    </div>
-                                ` : ''}
-                            </div>
-                        </div>
-                    </div>
-                </div>
-            `;
-        }).join('');
-    }
-
-    displayTickets(tickets) {
-        const container = document.getElementById('ticketsList');
-        if (!container) {
-            console.error('❌ Контейнер ticketsList не найден!');
-            return;
-        }
-
-        if (!tickets || tickets.length === 0) {
-            container.innerHTML = `
-                <div class="alert alert-info text-center py-4">
-                    <i class="fas fa-ticket-alt fa-2x mb-3"></i>
-                    <h5>У вас пока нет тикетов</h5>
-                    <p class="text-muted mb-0">Создайте первый тикет для обращения в поддержку</p>
-                </div>
-            `;
-            return;
-        }
-
-        container.innerHTML = tickets.map(ticket => `
-            <div class="card mb-3">
-                <div class="card-body">
-                    <div class="d-flex justify-content-between align-items-start mb-3">
-                        <h5 class="card-title mb-0">
-                            <i class="fas fa-ticket-alt me-2"></i>
-                            ${ticket.subject}
-                        </h5>
-                        <span class="badge bg-${this.getTicketStatusColor(ticket.status)}">
-                            ${this.getTicketStatusText(ticket.status)}
-                        </span>
-                    </div>
-                    <p class="card-text">${ticket.message}</p>
-                    <small class="text-muted">
-                        <i class="fas fa-calendar me-1"></i>
-                        Создан: ${new Date(ticket.created_at).toLocaleDateString('ru-RU')}
-                    </small>
-                </div>
-            </div>
-        `).join('');
-    }
-
-    displayProfile(profile) {
-        const container = document.getElementById('profileInfo');
-        if (!container) {
-            console.error('❌ Контейнер profileInfo не найден!');
-            return;
-        }
-
-        container.innerHTML = `
-            <div class="card">
-                <div class="card-header bg-primary text-white">
-                    <h5 class="card-title mb-0">
-                        <i class="fas fa-user me-2"></i>
-                        Профиль
-                    </h5>
-                </div>
-                <div class="card-body">
-                    <div class="row">
-                        <div class="col-md-6">
-                            <p><strong>ID:</strong> ${profile.user_id}</p>
-                            <p><strong>Имя:</strong> ${profile.username}</p>
-                            <p><strong>Баланс:</strong> <span class="text-success">${profile.balance} RUB</span></p>
-                            <p><strong>Сделки:</strong> ${profile.successful_deals}</p>
-                        </div>
-                        <div class="col-md-6">
-                            <p><strong>Статус:</strong> ${profile.is_admin ? '<span class="badge bg-danger">Администратор</span>' : '<span class="badge bg-secondary">Пользователь</span>'}</p>
-                            <p><strong>TON кошелек:</strong> ${profile.ton_wallet || 'Не указан'}</p>
-                            <p><strong>Карта:</strong> ${profile.card_details || 'Не указана'}</p>
-                        </div>
-                    </div>
-                </div>
-            </div>
-        `;
-    }
-
-    updateUserBalance(balance) {
-        const balanceElement = document.getElementById('userBalance');
-        if (balanceElement) {
-            balanceElement.textContent = `Баланс: ${balance} RUB`;
-        }
-    }
-
-    showDashboard() {
-        console.log('🏠 Показ дашборда...');
-        
-        // Скрываем все секции
-        document.querySelector('.hero-section').style.display = 'none';
-        document.getElementById('loginSection').style.display = 'none';
-        
-        // Показываем дашборд
-        document.getElementById('dashboard').style.display = 'block';
-        
-        // Обновляем навигацию
-        document.getElementById('loginNav').style.display = 'none';
-        document.getElementById('logoutNav').style.display = 'block';
-        
-        // Показываем админ-панель если пользователь админ
-        if (this.currentUser && this.currentUser.is_admin) {
-            const adminLink = document.getElementById('adminLink');
-            if (adminLink) adminLink.style.display = 'block';
-        }
-        
-        // Загружаем начальные данные
-        this.loadUserDeals();
-        this.loadProfile();
-        
-        console.log('✅ Дашборд показан');
-    }
-
-    showLoginForm() {
-        console.log('🔐 Показ формы входа...');
-        document.querySelector('.hero-section').style.display = 'block';
-        document.getElementById('loginSection').style.display = 'none';
-        document.getElementById('dashboard').style.display = 'none';
-        document.getElementById('loginNav').style.display = 'block';
-        document.getElementById('logoutNav').style.display = 'none';
-    }
-
-    showSection(sectionName) {
-        console.log('📁 Переключение на раздел:', sectionName);
-        
-        // Скрываем все основные разделы (с суффиксом Section)
-        const sections = ['dealsSection', 'createDealSection', 'ticketsSection', 'profileSection', 'adminSection'];
-        sections.forEach(section => {
-            const element = document.getElementById(section);
-            if (element) {
-                element.style.display = 'none';
-                console.log('✅ Скрыт раздел:', section);
-            }
-        });
-
-        // Скрываем форму создания тикета если она открыта
-        const createTicketForm = document.getElementById('createTicketForm');
-        if (createTicketForm) createTicketForm.style.display = 'none';
-        
-        // Показываем список тикетов по умолчанию
-        const ticketsList = document.getElementById('ticketsList');
-        if (ticketsList) {
-            ticketsList.style.display = 'block';
-        }
-
-        // Показываем выбранный раздел
-        const targetSection = document.getElementById(sectionName);
-        if (targetSection) {
-            targetSection.style.display = 'block';
-            console.log('✅ Показан раздел:', sectionName);
-        } else {
-            console.log('❌ Целевой раздел не найден:', sectionName);
-        }
-
-        // Обновляем активные кнопки в навигации
-        const navLinks = document.querySelectorAll('.list-group-item');
-        navLinks.forEach(link => {
-            link.classList.remove('active');
-            // Сравниваем без учета регистра и суффиксов
-            const linkOnClick = link.getAttribute('onclick') || '';
-            if (linkOnClick.includes(sectionName.replace('Section', ''))) {
-                link.classList.add('active');
-            }
-        });
-
-        // Загружаем данные при переключении
-        switch(sectionName) {
-            case 'dealsSection':
-                this.loadUserDeals();
-                break;
-            case 'ticketsSection':
-                this.loadUserTickets();
-                break;
-            case 'profileSection':
-                this.loadProfile();
-                break;
-        }
-    }
-
-    showCreateTicket() {
-        console.log('📝 Показ формы создания тикета');
-        // Скрываем список тикетов
-        const ticketsList = document.getElementById('ticketsList');
-        if (ticketsList) ticketsList.style.display = 'none';
-        
-        // Показываем форму создания тикета
-        const createTicketForm = document.getElementById('createTicketForm');
-        if (createTicketForm) createTicketForm.style.display = 'block';
-    }
-
-    hideCreateTicket() {
-        console.log('📝 Скрытие формы создания тикета');
-        // Показываем список тикетов
-        const ticketsList = document.getElementById('ticketsList');
-        if (ticketsList) ticketsList.style.display = 'block';
-        
-        // Скрываем форму создания тикета
-        const createTicketForm = document.getElementById('createTicketForm');
-        if (createTicketForm) createTicketForm.style.display = 'none';
-    }
-
-    showLoading(show) {
-        const loader = document.getElementById('loadingOverlay');
-        if (loader) {
-            loader.style.display = show ? 'flex' : 'none';
-            console.log(show ? '🔄 Показать загрузку' : '✅ Скрыть загрузку');
-        }
-    }
-
-    showToast(message, type = 'info') {
-        // Простой toast без Bootstrap
-        const toast = document.createElement('div');
-        toast.style.cssText = `
-            position: fixed;
-            top: 20px;
-            right: 20px;
-            padding: 15px 20px;
-            border-radius: 5px;
-            color: white;
-            z-index: 10000;
-            max-width: 300px;
-            word-wrap: break-word;
-            font-family: Arial, sans-serif;
-            box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-        `;
-        
-        const bgColors = {
-            'success': '#28a745',
-            'error': '#dc3545', 
-            'warning': '#ffc107',
-            'info': '#17a2b8'
-        };
-        
-        toast.style.backgroundColor = bgColors[type] || bgColors.info;
-        toast.textContent = message;
-        
-        document.body.appendChild(toast);
-        
-        // Автоматическое удаление через 5 секунд
-        setTimeout(() => {
-            if (toast.parentNode) {
-                toast.parentNode.removeChild(toast);
-            }
-        }, 5000);
-    }
-
-    logout() {
-        console.log('🚪 Выход...');
-        this.currentUser = null;
-        this.token = null;
-        localStorage.removeItem('magante_token');
-        this.showLoginForm();
-        this.showToast('Вы вышли из системы', 'info');
-    }
-
-    // Вспомогательные методы
-    getStatusText(status) {
-        const texts = {
-            'active': 'Активна',
-            'confirmed': 'Подтверждена',
-            'completed': 'Завершена',
-            'cancelled': 'Отменена'
-        };
-        return texts[status] || status;
-    }
-
-    getTicketStatusText(status) {
-        const texts = {
-            'open': 'Открыт',
-            'in_progress': 'В работе',
-            'closed': 'Закрыт'
-        };
-        return texts[status] || status;
-    }
-
-    getPaymentMethodText(method) {
-        const texts = {
-            'ton': 'TON',
-            'sbp': 'RUB',
-            'stars': 'XTR'
-        };
-        return texts[method] || method;
-    }
-
-    getStatusColor(status) {
-        const colors = {
-            'active': 'primary',
-            'confirmed': 'success',
-            'completed': 'success',
-            'cancelled': 'danger'
-        };
-        return colors[status] || 'secondary';
-    }
-
-    getTicketStatusColor(status) {
-        const colors = {
-            'open': 'warning',
-            'in_progress': 'info',
-            'closed': 'success'
-        };
-        return colors[status] || 'secondary';
-    }
-}
-
-// Глобальные функции
-function showSection(sectionName) {
-    let actualSectionName = sectionName;
-    if (!sectionName.endsWith('Section')) {
-        actualSectionName = sectionName + 'Section';
-    }
-    
-    if (window.maganteOTC) {
-        window.maganteOTC.showSection(actualSectionName);
-    } else {
-        console.error('MaganteOTC не инициализирован');
-    }
-}
-
-function showLogin() {
-    document.querySelector('.hero-section').style.display = 'none';
-    document.getElementById('loginSection').style.display = 'block';
-}
-
-function logout() {
-    if (window.maganteOTC) {
-        window.maganteOTC.logout();
-    }
-}
-
-function showCreateTicket() {
-    if (window.maganteOTC) {
-        window.maganteOTC.showCreateTicket();
-    }
-}
-
-function hideCreateTicket() {
-    if (window.maganteOTC) {
-        window.maganteOTC.hideCreateTicket();
-    }
-}
-
-function loadUserDeals() {
-    if (window.maganteOTC) {
-        window.maganteOTC.loadUserDeals();
-    }
-}
-
-// Функция для копирования ссылки сделки
-function copyToClipboard(text) {
-    navigator.clipboard.writeText(text).then(() => {
-        if (window.maganteOTC) {
-            window.maganteOTC.showToast('Ссылка скопирована в буфер обмена!', 'success');
-        }
-    }).catch(err => {
-        console.error('Ошибка копирования: ', err);
-        // Fallback для старых браузеров
-        const textArea = document.createElement('textarea');
-        textArea.value = text;
-        document.body.appendChild(textArea);
-        textArea.select();
-        try {
-            document.execCommand('copy');
-            if (window.maganteOTC) {
-                window.maganteOTC.showToast('Ссылка скопирована!', 'success');
-            }
-        } catch (err) {
-            console.error('Fallback copy failed: ', err);
-        }
-        document.body.removeChild(textArea);
-    });
-}
-
-// Инициализация
-document.addEventListener('DOMContentLoaded', function() {
-    console.log('🚀 DOM загружен, запуск MaganteOTC...');
-    window.maganteOTC = new MaganteOTC();
-});
+"""HTTP API Magante OTC.
+
+Запуск: ``gunicorn api:app``.
+"""
+
+import itertools
+import json
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+import jwt
+from flask import Flask, Response, g, jsonify, request
+from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import assets
+import events
+import export
+import hashing
+from archive import (
+    CURSOR_PREFIX as ARCHIVE_CURSOR, Archive, DealArchiver, is_cursor as is_archive_cursor,
+)
+from auth import KeyRing, TokenAuthority
+from fragments import FragmentCache
+from idempotency import IdempotencyCache, SqliteIdempotencyStore, idempotent
+from lifecycle import DealExpiry
+from metrics import Metrics
+from ledger import Ledger, SqliteLedger, account_key, from_minor, to_minor
+from notifier import TELEGRAM_API_URL, Dispatcher, Outbox, TelegramClient
+from ratelimit import DEFAULT_LIMITS, RateLimiter, SharedBuckets, parse_limits
+from rates import COINGECKO_URL, CoinGeckoSource, RateCache, StaticRateSource
+from revisions import Revisions, SqliteRevisions
+from search import SearchIndex
+from stats import SqliteStats, Stats
+from store import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, PAYMENT_METHODS, SHORT_ID_LENGTH, InvalidTransition,
+    normalize_ref, open_stores, project,
+)
+from workqueue import TicketQueue
+
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+logger = logging.getLogger('magante')
+
+TOKEN_TTL = int(os.environ.get('TOKEN_TTL', 7 * 24 * 3600))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10_000))
+LEDGER_SNAPSHOT_INTERVAL = int(os.environ.get('LEDGER_SNAPSHOT_INTERVAL', 60))
+# Через сколько секунд активная сделка отменяется сама; 0 — не отменять
+DEAL_TTL = int(os.environ.get('DEAL_TTL', 24 * 3600))
+# Каталог архива завершённых сделок; без него архивации нет
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR')
+ARCHIVE_AFTER_DAYS = float(os.environ.get('ARCHIVE_AFTER_DAYS', 30))
+BALANCE_CURRENCY = 'sbp'
+BOT_URL = 'https://t.me/magnate_otc_bot'
+ADMIN_CHAT_ID = os.environ.get('ADMIN_CHAT_ID')
+STORAGE_URL = os.environ.get('STORAGE_URL', 'memory://')
+# Общее хранилище видят все воркеры; в memory:// у каждого воркера свои данные
+SHARED_STORAGE = not STORAGE_URL.startswith('memory://')
+# Поисковый индекс и очередь тикетов по умолчанию лежат рядом с данными:
+# в той же SQLite-базе или в памяти процесса
+STORAGE_PATH = STORAGE_URL[len('sqlite:///'):] if STORAGE_URL.startswith('sqlite:///') else ':memory:'
+SEARCH_PATH = os.environ.get('SEARCH_PATH') or STORAGE_PATH
+TICKET_QUEUE_PATH = os.environ.get('TICKET_QUEUE_PATH') or STORAGE_PATH
+
+app = Flask(__name__)
+app.json.ensure_ascii = False
+CORS(app, expose_headers=['X-Next-Cursor', 'Idempotent-Replayed', 'Retry-After', 'ETag'])
+if os.environ.get('TRUSTED_PROXY_COUNT'):
+    # За балансировщиком адрес клиента приходит в X-Forwarded-For
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ['TRUSTED_PROXY_COUNT']))
+# METRICS_PROFILE_MS=500 — писать в лог горячие стеки запросов дольше 500 мс
+metrics = Metrics(os.environ.get('METRICS_PATH'),
+                  profile_ms=int(os.environ.get('METRICS_PROFILE_MS', 0)))
+metrics.init_app(app)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# STATIC_DIR=dist — отдавать собранный клиент (python assets.py --out dist) из этого же процесса
+STATIC_DIR = os.environ.get('STATIC_DIR')
+if STATIC_DIR:
+    assets.init_app(app, STATIC_DIR)
+
+tokens = TokenAuthority(KeyRing.from_env(), TOKEN_TTL, TOKEN_CACHE_SIZE)
+limiter = None
+if os.environ.get('RATELIMIT_ENABLED', '1') == '1':
+    limiter = RateLimiter(SharedBuckets(os.environ.get('RATELIMIT_PATH')),
+                          parse_limits(os.environ.get('RATE_LIMITS', DEFAULT_LIMITS)))
+users, deals, tickets = open_stores(STORAGE_URL)
+deal_archive = Archive(ARCHIVE_DIR) if ARCHIVE_DIR else None
+# HASHING_WORKERS=0 — проверять пароль прямо в воркере, без пула
+password_hasher = hashing.HashingPool(
+    workers=int(os.environ.get('HASHING_WORKERS', 2)),
+    max_pending=int(os.environ.get('HASHING_MAX_PENDING', 64)),
+)
+bus = events.EventBus()
+if SHARED_STORAGE:
+    # Повтор после обрыва связи может прийти в другой воркер — резервы в общей базе
+    idempotency_cache = SqliteIdempotencyStore(
+        deals.pool, ttl=int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600)))
+else:
+    idempotency_cache = IdempotencyCache(
+        maxsize=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 50_000)),
+        ttl=int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600)),
+    )
+fragments = FragmentCache(maxsize=int(os.environ.get('FRAGMENT_CACHE_SIZE', 50_000)))
+# Части /api/bootstrap читаются параллельно; под gevent потоки пула — гринлеты
+bootstrap_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('BOOTSTRAP_WORKERS', 4)),
+                                    thread_name_prefix='bootstrap')
+# RATES=ton=250,stars=1.5 — фиксированные курсы вместо CoinGecko (локально и в тестах)
+if os.environ.get('RATES'):
+    rate_source = StaticRateSource.from_spec(os.environ['RATES'])
+else:
+    rate_source = CoinGeckoSource(float(os.environ.get('STARS_RUB_RATE', 1.5)),
+                                  os.environ.get('COINGECKO_URL', COINGECKO_URL))
+rates = RateCache(rate_source, ttl=int(os.environ.get('RATES_TTL', 60)),
+                  max_age=int(os.environ.get('RATES_MAX_AGE', 3600)))
+rates.refresh_async()
+if SHARED_STORAGE:
+    ledger = SqliteLedger(deals.pool)
+else:
+    ledger = Ledger(directory=os.environ.get('LEDGER_DIR'))
+    ledger.start_snapshots(LEDGER_SNAPSHOT_INTERVAL)
+# Без бота уведомления некому отправлять — outbox не ведётся вовсе
+outbox = dispatcher = None
+if os.environ.get('TELEGRAM_BOT_TOKEN'):
+    outbox = Outbox(os.environ.get('OUTBOX_PATH', 'outbox.sqlite3'))
+    dispatcher = Dispatcher(
+        outbox,
+        TelegramClient(os.environ['TELEGRAM_BOT_TOKEN'],
+                       os.environ.get('TELEGRAM_API_URL', TELEGRAM_API_URL)),
+        rate=float(os.environ.get('TELEGRAM_RATE_LIMIT', 25)),
+        retention=int(os.environ.get('OUTBOX_RETENTION', 7 * 24 * 3600)),
+    )
+    dispatcher.start()
+
+
+def ensure_user(login, password, **kwargs):
+    """Создаёт пользователя, если его ещё нет (постоянное хранилище переживает рестарт)."""
+    try:
+        return users.create(login, password, **kwargs)
+    except ValueError:
+        return users.get_by_login(login)
+
+
+if os.environ.get('SEED_TEST_USER', '1') == '1':
+    test_user = ensure_user('testuser', 'testpass123', username='Test User')
+    ledger.deposit(account_key(test_user['user_id'], BALANCE_CURRENCY), to_minor(1000),
+                   f"seed:{test_user['user_id']}")
+if os.environ.get('ADMIN_LOGIN') and os.environ.get('ADMIN_PASSWORD'):
+    ensure_user(os.environ['ADMIN_LOGIN'], os.environ['ADMIN_PASSWORD'], is_admin=True)
+
+
+def status_event(record):
+    return {'id': record['id'], 'status': record['status'], 'updated_at': record['updated_at']}
+
+
+def status_publisher(name):
+    def publish(record, old_status):
+        if old_status is not None:
+            bus.publish(record['user_id'], name, status_event(record))
+    return publish
+
+
+def shared_status_publisher(name):
+    def publish(conn, record, old_status):
+        if old_status is not None:
+            event_relay.publish(conn, record['user_id'], name, status_event(record))
+    return publish
+
+
+def all_deals(**scan):
+    """Все сделки, включая архивные, — для пересчётов и выгрузок."""
+    if deal_archive is None:
+        return deals.iter_all(**scan)
+    return itertools.chain(deals.iter_all(**scan), deal_archive.iter_all())
+
+
+def scan_records(conn):
+    """Сделки и тикеты для ``stats.rebuild``; с ``conn`` — в его снимке базы."""
+    scan = {'conn': conn} if conn is not None else {}
+    return all_deals(**scan), tickets.iter_all(**scan)
+
+
+def archived_count():
+    return len(deal_archive) if deal_archive is not None else 0
+
+
+if SHARED_STORAGE:
+    # Счётчики в общей базе, меняются в транзакции записи — одни на все воркеры
+    stats = SqliteStats(deals.pool)
+    deals.transaction_hooks.append(stats.on_deal_in_transaction)
+    tickets.transaction_hooks.append(stats.on_ticket_in_transaction)
+    if stats.is_empty() and (len(deals) or len(tickets) or archived_count()):
+        # База из версии без таблиц счётчиков: посчитать один раз, не блокируя запись
+        stats.rebuild(scan_records)
+else:
+    stats = Stats()
+    deals.listeners.append(stats.on_deal)
+    tickets.listeners.append(stats.on_ticket)
+
+
+def settle_completed(deal, old_status):
+    if deal['status'] == 'completed' and ledger.settle_deal(deal):
+        users.record_successful_deal(deal['user_id'])
+        logger.info('💰 Расчёт по сделке %s', deal['id'])
+
+
+def settle_in_transaction(conn, deal, old_status):
+    """Расчёт в транзакции смены статуса: баланс и статус фиксируются вместе."""
+    if deal['status'] == 'completed' and ledger.settle_deal(deal, conn):
+        users.record_successful_deal(deal['user_id'], conn)
+        logger.info('💰 Расчёт по сделке %s', deal['id'])
+
+
+if SHARED_STORAGE:
+    deals.transaction_hooks.append(settle_in_transaction)
+else:
+    deals.listeners.append(settle_completed)
+if SHARED_STORAGE:
+    # SSE-события через общую базу: смену статуса в любом воркере видят все
+    event_relay = events.EventRelay(deals.pool, bus)
+    event_relay.start()
+    deals.transaction_hooks.append(shared_status_publisher('deal'))
+    tickets.transaction_hooks.append(shared_status_publisher('ticket'))
+else:
+    deals.listeners.append(status_publisher('deal'))
+    tickets.listeners.append(status_publisher('ticket'))
+# После расчёта: завершённая сделка меняет баланс и счётчик в профиле
+if SHARED_STORAGE:
+    # Ревизии в общей базе и в той же транзакции, что и запись: ни один
+    # воркер не ответит 304 на тег, выданный до изменения
+    revisions = SqliteRevisions(deals.pool)
+    deals.transaction_hooks.append(
+        lambda conn, deal, old_status: revisions.bump(deal['user_id'], 'deals', 'profile', conn=conn))
+    tickets.transaction_hooks.append(
+        lambda conn, ticket, old_status: revisions.bump(ticket['user_id'], 'tickets', conn=conn))
+else:
+    revisions = Revisions()
+    deals.listeners.append(lambda deal, old_status: revisions.bump(deal['user_id'], 'deals', 'profile'))
+    tickets.listeners.append(lambda ticket, old_status: revisions.bump(ticket['user_id'], 'tickets'))
+
+search_index = SearchIndex(SEARCH_PATH)
+# Архивные сделки остаются в поиске: архивация индекс не трогает
+if len(search_index) != len(deals) + archived_count() + len(tickets):
+    search_index.rebuild(deals.iter_all(), tickets.iter_all(),
+                         deal_archive.iter_all() if deal_archive is not None else ())
+deals.listeners.append(search_index.listener('deal'))
+tickets.listeners.append(search_index.listener('ticket'))
+
+ticket_queue = TicketQueue(TICKET_QUEUE_PATH, tickets,
+                           lease=int(os.environ.get('TICKET_LEASE_TTL', 600)))
+if SHARED_STORAGE:
+    # Тикеты могли создать или закрыть, пока очередь не слушала
+    ticket_queue.load()
+
+expiry = None
+if DEAL_TTL:
+    expiry = DealExpiry(deals, DEAL_TTL)
+    expiry.load()
+    expiry.start()
+
+archiver = None
+if deal_archive is not None:
+    archiver = DealArchiver(deals, deal_archive, ARCHIVE_AFTER_DAYS * 24 * 3600,
+                            interval=int(os.environ.get('ARCHIVE_INTERVAL', 3600)))
+    archiver.start()
+
+
+def error(message, status):
+    return jsonify({'error': message}), status
+
+
+def page_params(store, extra_fields=()):
+    """Разбирает ``limit``, ``cursor`` и ``fields`` из query string."""
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('Некорректный limit') from None
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+
+    fields = None
+    if request.args.get('fields'):
+        fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+        unknown = set(fields) - set(store.fields) - set(extra_fields)
+        if unknown:
+            raise ValueError(f'Неизвестные поля: {", ".join(sorted(unknown))}')
+    return limit, request.args.get('cursor') or None, fields
+
+
+def paginated(store, user_id, enrich=None, extra_fields=(), pager=None):
+    """Страница записей; ``enrich(records)`` дописывает вычисляемые поля до проекции.
+
+    Тело склеивается из закэшированных фрагментов; ``extra_fields`` — как раз
+    вычисляемые поля, их кэш не хранит. ``pager`` заменяет ``store.list_by_owner``.
+    """
+    try:
+        limit, cursor, fields = page_params(store, extra_fields)
+        records, next_cursor = (pager or store.list_by_owner)(user_id, limit, cursor)
+    except ValueError as exc:
+        return error(str(exc), 400)
+    if enrich is not None:
+        enrich(records)
+    response = app.response_class(fragments.encode(records, fields, extra_fields),
+                                  mimetype='application/json')
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+def deals_page(user_id, limit, cursor=None):
+    """Страница сделок: сначала горячее хранилище, когда оно кончится — архив.
+
+    Курсор архива отличается префиксом, так что клиент листает оба уровня
+    одним ``X-Next-Cursor``, не зная о границе.
+    """
+    if deal_archive is None:
+        return deals.list_by_owner(user_id, limit, cursor)
+    records = []
+    if not is_archive_cursor(cursor):
+        records, next_cursor = deals.list_by_owner(user_id, limit, cursor)
+        if next_cursor:
+            return records, next_cursor
+        cursor = None
+    if len(records) == limit:
+        # Горячие сделки кончились ровно на границе страницы
+        return records, ARCHIVE_CURSOR if deal_archive.count_by_owner(user_id) else None
+    archived, next_cursor = deal_archive.list_by_owner(user_id, limit - len(records), cursor)
+    return records + archived, next_cursor
+
+
+def deals_version():
+    """Версия данных страницы сделок помимо ревизии: курсы и номер последнего переноса."""
+    if deal_archive is None:
+        return rates.version
+    return f'{rates.version}.{deal_archive.version()}'
+
+
+def add_amount_rub(records):
+    """Рублёвый эквивалент сделок одним пересчётом по текущему снимку курсов."""
+    converted = rates.convert([(r['amount'], r['payment_method']) for r in records])
+    for record, amount_rub in zip(records, converted):
+        record['amount_rub'] = amount_rub
+
+
+def add_volume_rub(snapshot):
+    """Рублёвые объёмы в статистике: по методам, по статусам и итого."""
+    deals_stats = snapshot['deals']
+    methods = deals_stats['by_payment_method']
+    statuses = deals_stats['by_status']
+    items = [(item['volume'], method) for method, item in methods.items()]
+    for item in statuses.values():
+        items += [(volume, method) for method, volume in item['volume'].items()]
+    converted = iter(rates.convert(items))
+    for item in methods.values():
+        item['volume_rub'] = next(converted)
+    for item in statuses.values():
+        values = [next(converted) for _ in item['volume']]
+        item['volume_rub'] = None if None in values else round(sum(values), 2)
+    totals = [item['volume_rub'] for item in methods.values()]
+    deals_stats['volume_rub'] = None if None in totals else round(sum(totals), 2)
+    return snapshot
+
+
+def notify(chat_id, text):
+    """Пишет уведомление в outbox; отправит его фоновый диспетчер."""
+    if not chat_id or outbox is None:
+        return
+    outbox.enqueue(chat_id, text)
+    dispatcher.wake()
+
+
+def public_profile(user):
+    return {
+        'user_id': user['user_id'],
+        'username': user['username'],
+        'balance': from_minor(ledger.balance(account_key(user['user_id'], BALANCE_CURRENCY))),
+        'successful_deals': user['successful_deals'],
+        'is_admin': user['is_admin'],
+        'ton_wallet': user['ton_wallet'],
+        'card_details': user['card_details'],
+    }
+
+
+def login_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        header = request.headers.get('Authorization', '')
+        if not header.startswith('Bearer '):
+            return error('Требуется авторизация', 401)
+        try:
+            claims = tokens.verify(header[7:])
+        except jwt.PyJWTError:
+            return error('Недействительный токен', 401)
+        user = users.get(claims['sub'])
+        if user is None:
+            return error('Пользователь не найден', 401)
+        g.user = user
+        g.claims = claims
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def conditional(resource, version=None):
+    """ETag по ревизии ресурса текущего пользователя; 304 без вызова view.
+
+    Тег считается до вызова view: если ресурс поменяется во время ответа,
+    клиент получит более старый тег и при следующем запросе — полный ответ.
+    ``version()`` — версия прочих данных в ответе (например, курсов).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            variant = request.query_string.decode()
+            if version is not None:
+                variant += f'#{version()}'
+            etag = revisions.etag(g.user['user_id'], resource, variant)
+            if etag in request.if_none_match:
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def admin_required(view):
+    @wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if not g.user['is_admin']:
+            return error('Доступ запрещён', 403)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def find_record(store, ref):
+    """Запись по полному id или его хвосту (номер на карточке); ``(record, error_response)``."""
+    ref = normalize_ref(ref)
+    record = store.get(ref)
+    if record is not None:
+        return record, None
+    if len(ref) < SHORT_ID_LENGTH:
+        return None, error(f'Укажите не меньше {SHORT_ID_LENGTH} последних символов номера', 404)
+    matches = store.find_by_short_id(ref)
+    if not matches:
+        return None, error('Запись не найдена', 404)
+    if len(matches) > 1:
+        return None, error('Номер неоднозначен, укажите больше символов', 409)
+    return matches[0], None
+
+
+def change_status(store, ref):
+    data = request.get_json(silent=True) or {}
+    found, failure = find_record(store, ref)
+    if failure:
+        return failure
+    try:
+        record = store.set_status(found['id'], data.get('status'))
+    except InvalidTransition as exc:
+        return error(str(exc), 409)
+    except ValueError as exc:
+        return error(str(exc), 400)
+    return jsonify(record)
+
+
+# Ручки со своим классом лимита; остальные — read для GET и write для прочих
+ROUTE_CLASSES = {'login': 'auth'}
+
+
+@app.before_request
+def rate_limit():
+    if limiter is None or request.method == 'OPTIONS' or request.endpoint in (None, 'health', 'prometheus_metrics', 'static_asset'):
+        return None
+    route_class = ROUTE_CLASSES.get(request.endpoint) or (
+        'read' if request.method == 'GET' else 'write')
+
+    keys = [f'ip:{request.remote_addr}']
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        try:
+            keys.append(f"user:{tokens.verify(header[7:])['sub']}")
+        except jwt.PyJWTError:
+            pass
+    if route_class == 'auth':
+        # Подбор пароля к одному логину. Ключ — пара (адрес, логин): корзина
+        # только по логину позволила бы кому угодно запереть чужой аккаунт
+        login_ = (request.get_json(silent=True) or {}).get('login')
+        if isinstance(login_, str) and login_:
+            keys.append(f'login:{request.remote_addr}:{login_.strip().lower()}')
+
+    wait = limiter.check(route_class, *keys)
+    if wait:
+        response = jsonify({'error': 'Слишком много запросов, попробуйте позже'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+        return response
+    return None
+
+
+@app.get('/')
+def health():
+    # Браузер получает клиент, балансировщик и curl — JSON
+    if STATIC_DIR and request.accept_mimetypes.best_match(
+            ['application/json', 'text/html']) == 'text/html':
+        return assets.send_index(STATIC_DIR)
+    return jsonify({'status': 'ok', 'service': 'magante-otc'})
+
+
+@app.get('/metrics')
+def prometheus_metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return error('Требуется авторизация', 401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def hashing_unavailable():
+    response = jsonify({'error': 'Сервер перегружен, попробуйте позже'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(hashing.RETRY_AFTER)
+    return response
+
+
+@app.post('/api/login')
+def login():
+    data = request.get_json(silent=True) or {}
+    login_ = (data.get('login') or '').strip()
+    password = (data.get('password') or '').strip()
+    if not login_ or not password:
+        return error('Укажите логин и пароль', 400)
+
+    user = users.get_by_login(login_)
+    try:
+        ok, new_hash = password_hasher.verify(password, user and user['password_hash'])
+    except hashing.Overloaded:
+        logger.warning('⚠️ Очередь проверки паролей переполнена, вход отклонён')
+        return hashing_unavailable()
+    except hashing.Unavailable as exc:
+        logger.error('❌ %s, вход отклонён', exc)
+        return hashing_unavailable()
+    if not ok:
+        return error('Неверный логин или пароль', 401)
+    if new_hash:
+        # Параметры хеширования поменялись — пароль известен только сейчас
+        users.set_password_hash(user['user_id'], new_hash)
+
+    logger.info('🔐 Вход пользователя %s', user['login'])
+    return jsonify({'token': tokens.issue(user['user_id']), 'user': public_profile(user)})
+
+
+@app.get('/api/session')
+@login_required
+def session():
+    """Дешёвая проверка токена: без баланса и прочих полей профиля."""
+    return jsonify({
+        'user_id': g.user['user_id'],
+        'username': g.user['username'],
+        'is_admin': g.user['is_admin'],
+        'expires_at': g.claims['exp'],
+    })
+
+
+@app.get('/api/bootstrap')
+@login_required
+def bootstrap():
+    """Первый экран дашборда одним ответом: сессия, профиль, первая страница сделок
+    (``limit``/``fields`` как у ``/api/deals/my``) и счётчики тикетов по статусам."""
+    user = g.user
+    try:
+        limit, _, fields = page_params(deals, ('amount_rub',))
+    except ValueError as exc:
+        return error(str(exc), 400)
+
+    def first_page():
+        records, next_cursor = deals_page(user['user_id'], limit)
+        add_amount_rub(records)
+        return [project(r, fields) for r in records], next_cursor
+
+    profile_ = bootstrap_pool.submit(public_profile, user)
+    page = bootstrap_pool.submit(first_page)
+    ticket_counts = bootstrap_pool.submit(tickets.count_by_owner_status, user['user_id'])
+    records, next_cursor = page.result()
+    return jsonify({
+        'session': {
+            'user_id': user['user_id'],
+            'username': user['username'],
+            'is_admin': user['is_admin'],
+            'expires_at': g.claims['exp'],
+        },
+        'profile': profile_.result(),
+        'deals': records,
+        'deals_cursor': next_cursor,
+        'ticket_counts': ticket_counts.result(),
+    })
+
+
+@app.get('/api/profile')
+@login_required
+@conditional('profile')
+def profile():
+    return jsonify(public_profile(g.user))
+
+
+@app.post('/api/deals')
+@login_required
+@idempotent(idempotency_cache)
+def create_deal():
+    data = request.get_json(silent=True) or {}
+    try:
+        amount = float(data.get('amount'))
+    except (TypeError, ValueError):
+        return error('Некорректная сумма', 400)
+    if amount < 0.01:
+        return error('Минимальная сумма: 0.01', 400)
+
+    description = (data.get('description') or '').strip()
+    if not description:
+        return error('Укажите описание сделки', 400)
+
+    payment_method = data.get('payment_method')
+    if payment_method not in PAYMENT_METHODS:
+        return error('Неизвестный метод оплаты', 400)
+
+    deal = deals.create(g.user['user_id'], amount, description, payment_method)
+    notify(g.user['telegram_chat_id'],
+           f"💼 Сделка создана: {amount} {payment_method.upper()}\n"
+           f"Ссылка для покупателя: {BOT_URL}?start={deal['id']}")
+    logger.info('💼 Создана сделка %s', deal['id'])
+    return jsonify(deal), 201
+
+
+@app.get('/api/deals/my')
+@login_required
+@conditional('deals', deals_version)
+def my_deals():
+    return paginated(deals, g.user['user_id'], add_amount_rub, ('amount_rub',), deals_page)
+
+
+@app.post('/api/tickets')
+@login_required
+@idempotent(idempotency_cache)
+def create_ticket():
+    data = request.get_json(silent=True) or {}
+    subject = (data.get('subject') or '').strip()
+    message = (data.get('message') or '').strip()
+    if not subject or not message:
+        return error('Укажите тему и сообщение', 400)
+
+    ticket = tickets.create(g.user['user_id'], subject, message)
+    notify(ADMIN_CHAT_ID, f"🎫 Новый тикет от {g.user['username']}: {subject}\n\n{message}")
+    logger.info('🎫 Создан тикет %s', ticket['id'])
+    return jsonify(ticket), 201
+
+
+@app.get('/api/tickets/my')
+@login_required
+@conditional('tickets')
+def my_tickets():
+    return paginated(tickets, g.user['user_id'])
+
+
+@app.get('/api/events')
+@login_required
+def event_stream():
+    """SSE-поток изменений статусов сделок и тикетов текущего пользователя."""
+    subscription = bus.subscribe(g.user['user_id'])
+    return Response(events.stream(subscription), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+@app.get('/api/admin/stats')
+@admin_required
+def admin_stats():
+    return jsonify(add_volume_rub(stats.snapshot(len(users))))
+
+
+@app.post('/api/admin/stats/rebuild')
+@admin_required
+def admin_stats_rebuild():
+    drift = stats.rebuild(scan_records)
+    return jsonify({'drift': drift, 'stats': add_volume_rub(stats.snapshot(len(users)))})
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Сверяет счётчики статистики с сырыми данными."""
+    drift = stats.rebuild(scan_records)
+    print(json.dumps(drift, ensure_ascii=False, indent=2) if drift else 'Расхождений нет')
+
+
+@app.get('/api/admin/search')
+@admin_required
+def admin_search():
+    """Поиск по описаниям сделок и темам/текстам тикетов: q, kind, status, limit, cursor."""
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return error('Укажите запрос', 400)
+    kind = request.args.get('kind') or None
+    if kind not in (None, 'deal', 'ticket'):
+        return error('kind должен быть deal или ticket', 400)
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return error('Некорректный limit', 400)
+    try:
+        results, next_cursor = search_index.search(
+            query, kind, request.args.get('status') or None, limit, request.args.get('cursor'))
+    except ValueError as exc:
+        return error(str(exc), 400)
+    response = jsonify(results)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+@app.get('/api/admin/export/<kind>')
+@admin_required
+def admin_export(kind):
+    """Выгрузка NDJSON/CSV с фильтрами status, payment_method, from, to."""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in export.CONTENT_TYPES:
+        return error('Формат должен быть ndjson или csv', 400)
+
+    if kind == 'deals':
+        source, fields = all_deals(), deals.fields
+    elif kind == 'tickets':
+        source, fields = tickets.iter_all(), tickets.fields
+    elif kind == 'users':
+        source, fields = users.iter_all(), export.USER_FIELDS
+    else:
+        return error('Неизвестный тип выгрузки', 404)
+
+    filters = {
+        'status': request.args.get('status'),
+        'payment_method': request.args.get('payment_method'),
+        'date_from': request.args.get('from'),
+        'date_to': request.args.get('to'),
+    }
+    records = (r for r in source if export.matches(r, **filters))
+    gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+
+    response = Response(export.stream(records, fields, fmt, gzip),
+                        content_type=export.CONTENT_TYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.{fmt}'
+    response.headers['X-Accel-Buffering'] = 'no'
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@app.post('/api/admin/deals/<deal_id>/status')
+@admin_required
+def admin_deal_status(deal_id):
+    return change_status(deals, deal_id)
+
+
+@app.get('/api/admin/deals/<deal_id>/history')
+@admin_required
+def admin_deal_history(deal_id):
+    # Архивная сделка находится только по полному id
+    history = deal_archive.history(normalize_ref(deal_id)) if deal_archive is not None else None
+    if history is not None:
+        return jsonify(history)
+    deal, failure = find_record(deals, deal_id)
+    if failure:
+        return failure
+    return jsonify(deals.history(deal['id']))
+
+
+@app.get('/api/admin/deals/lookup')
+@admin_required
+def admin_deal_lookup():
+    """Сделки по номеру из поддержки или бота: полный id или хвост от 8 символов."""
+    ref = normalize_ref(request.args.get('ref', ''))
+    if len(ref) < SHORT_ID_LENGTH:
+        return error(f'Укажите не меньше {SHORT_ID_LENGTH} последних символов номера', 400)
+    deal = deals.get(ref)
+    if deal is None and deal_archive is not None:
+        deal = deal_archive.get(ref)
+    return jsonify([deal] if deal is not None else deals.find_by_short_id(ref))
+
+
+@app.post('/api/admin/tickets/<ticket_id>/status')
+@admin_required
+def admin_ticket_status(ticket_id):
+    return change_status(tickets, ticket_id)
+
+
+@app.get('/api/admin/tickets/queue')
+@admin_required
+def admin_ticket_queue():
+    return jsonify(ticket_queue.counts())
+
+
+@app.post('/api/admin/tickets/next')
+@admin_required
+def admin_next_ticket():
+    """Арендует агенту следующий тикет; ``ticket: null``, если очередь пуста."""
+    claimed = ticket_queue.next_ticket(g.user['user_id'])
+    ticket, lease_until = claimed or (None, None)
+    # Размер очереди — отдельной ручкой: подсчёт читает всю таблицу
+    return jsonify({'ticket': ticket, 'lease_until': lease_until})
+
+
+@app.post('/api/admin/tickets/<ticket_id>/lease')
+@admin_required
+def admin_renew_lease(ticket_id):
+    lease_until = ticket_queue.renew(ticket_id, g.user['user_id'])
+    if lease_until is None:
+        return error('Аренда тикета истекла или принадлежит другому агенту', 409)
+    return jsonify({'lease_until': lease_until})
+
+
+@app.delete('/api/admin/tickets/<ticket_id>/lease')
+@admin_required
+def admin_release_lease(ticket_id):
+    if not ticket_queue.release(ticket_id, g.user['user_id']):
+        return error('Аренда тикета истекла или принадлежит другому агенту', 409)
+    return '', 204
+
+
+@app.post('/api/admin/tickets/<ticket_id>/priority')
+@admin_required
+def admin_ticket_priority(ticket_id):
+    data = request.get_json(silent=True) or {}
+    priority = data.get('priority')
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        return error('Приоритет должен быть целым числом', 400)
+    if not ticket_queue.set_priority(ticket_id, priority):
+        return error('Тикета нет в очереди', 404)
+    return jsonify({'id': ticket_id, 'priority': priority})
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -1,8 +1,217 @@
+// Поля, которые реально нужны карточкам — сервер не шлёт остальное
+const DEAL_FIELDS = 'id,amount,amount_rub,description,payment_method,status,created_at';
+const TICKET_FIELDS = 'id,subject,message,status,created_at';
+// Тикеты в этих статусах считаются на значке «Тикеты»
+const OPEN_TICKET_STATUSES = ['open', 'in_progress'];
+
+// Сколько строк выгрузки показывать в админке; остальные только считаем
+const ADMIN_RENDER_LIMIT = 2000;
+const EXPORT_COLUMNS = {
+    deals: ['id', 'user_id', 'amount', 'payment_method', 'status', 'created_at'],
+    tickets: ['id', 'user_id', 'subject', 'status', 'created_at'],
+    users: ['user_id', 'username', 'is_admin', 'successful_deals', 'created_at']
+};
+// Аренда тикета из очереди живёт минуты; продлеваем заметно чаще
+const LEASE_RENEW_INTERVAL = 60000;
+
+const REQUEST_TIMEOUT = 15000;
+const RETRY_ATTEMPTS = 2;
+const RETRY_BASE_DELAY = 500;
+const RETRY_MAX_DELAY = 5000;
+// Столько GET-ответ считается свежим и отдаётся без запроса; дальше — ревалидация по ETag
+const CACHE_TTL = 5000;
+const RETRY_STATUSES = new Set([429, 502, 503, 504]);
+const IDEMPOTENT_METHODS = new Set(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS']);
+
+function isAbort(error) {
+    return error?.name === 'AbortError';
+}
+
+// Пользовательский текст в разметке — только через escapeHtml
+const HTML_ESCAPES = { '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' };
+
+function escapeHtml(value) {
+    return String(value ?? '').replace(/[&<>"']/g, ch => HTML_ESCAPES[ch]);
+}
+
+// Все запросы к API: таймауты, повторы идемпотентных вызовов, склейка одинаковых GET и короткий кэш
+class ApiClient {
+    constructor(base, getToken) {
+        this.base = base;
+        this.getToken = getToken;
+        // url -> { etag, data, headers, at }
+        this.cache = new Map();
+        // url -> { promise, controller, waiters }: один сетевой запрос на всех ждущих
+        this.inflight = new Map();
+    }
+
+    headers(extra = {}) {
+        const headers = { 'Accept': 'application/json', ...extra };
+        const token = this.getToken();
+        if (token) headers['Authorization'] = `Bearer ${token}`;
+        return headers;
+    }
+
+    async get(path, { signal } = {}) {
+        const url = `${this.base}${path}`;
+        const cached = this.cache.get(url);
+        if (cached && Date.now() - cached.at < CACHE_TTL) {
+            return { ok: true, status: 200, data: cached.data, headers: cached.headers };
+        }
+        let entry = this.inflight.get(url);
+        if (!entry || entry.controller.signal.aborted) {
+            const controller = new AbortController();
+            entry = { controller, waiters: 0 };
+            entry.promise = this.revalidate(url, controller.signal).finally(() => {
+                if (this.inflight.get(url) === entry) this.inflight.delete(url);
+            });
+            this.inflight.set(url, entry);
+        }
+        return this.join(entry, signal);
+    }
+
+    // Отмена одного ждущего не рвёт запрос остальным; запрос обрывается, когда отменили все
+    join(entry, signal) {
+        entry.waiters++;
+        if (!signal) return entry.promise;
+        return new Promise((resolve, reject) => {
+            const onAbort = () => {
+                if (--entry.waiters === 0) entry.controller.abort();
+                reject(signal.reason);
+            };
+            if (signal.aborted) return onAbort();
+            signal.addEventListener('abort', onAbort, { once: true });
+            entry.promise.then(resolve, reject)
+                .finally(() => signal.removeEventListener('abort', onAbort));
+        });
+    }
+
+    // GET с If-None-Match: на 304 возвращает тело прошлого ответа
+    async revalidate(url, signal) {
+        const cached = this.cache.get(url);
+        const headers = this.headers();
+        if (cached?.etag) headers['If-None-Match'] = cached.etag;
+
+        // no-store: ревалидацией управляем сами, HTTP-кэш браузера не вмешивается
+        const response = await this.send(url, { headers, cache: 'no-store' }, signal, true);
+        if (response.status === 304 && cached) {
+            cached.at = Date.now();
+            return { ok: true, status: 304, data: cached.data, headers: cached.headers };
+        }
+        if (response.ok) {
+            this.cache.set(url, {
+                etag: response.headers.get('ETag'),
+                data: response.data,
+                headers: response.headers,
+                at: Date.now()
+            });
+        }
+        return response;
+    }
+
+    async request(method, path, { body, headers = {}, signal } = {}) {
+        const init = { method, headers: this.headers(headers) };
+        if (body !== undefined) {
+            init.headers['Content-Type'] = 'application/json';
+            init.body = JSON.stringify(body);
+        }
+        // POST повторяем только с Idempotency-Key: сервер вернёт сохранённый ответ, а не создаст дубль
+        const retry = IDEMPOTENT_METHODS.has(method) || 'Idempotency-Key' in headers;
+        return this.send(`${this.base}${path}`, init, signal, retry);
+    }
+
+    // Один вызов fetch с таймаутом на весь ответ, включая тело; при сбое — повтор с джиттером
+    async send(url, init, signal, retry) {
+        for (let attempt = 0; ; attempt++) {
+            const controller = new AbortController();
+            const timer = setTimeout(() => controller.abort(
+                new DOMException('Сервер не ответил вовремя', 'TimeoutError')), REQUEST_TIMEOUT);
+            const onAbort = () => controller.abort(signal.reason);
+            signal?.addEventListener('abort', onAbort, { once: true });
+            let result = null;
+            let failure = null;
+            try {
+                const response = await fetch(url, { ...init, signal: controller.signal });
+                const isJson = (response.headers.get('Content-Type') || '').includes('json');
+                result = {
+                    ok: response.ok,
+                    status: response.status,
+                    data: isJson && response.status !== 304 ? await response.json() : null,
+                    headers: response.headers
+                };
+            } catch (error) {
+                failure = controller.signal.aborted ? controller.signal.reason : error;
+            } finally {
+                clearTimeout(timer);
+                signal?.removeEventListener('abort', onAbort);
+            }
+            if (signal?.aborted) throw signal.reason;
+
+            const retriable = failure ? true : RETRY_STATUSES.has(result.status);
+            if (!retry || !retriable || attempt >= RETRY_ATTEMPTS) {
+                if (failure) throw failure;
+                return result;
+            }
+            const delay = this.retryDelay(attempt, result);
+            console.log(`🔁 Повтор запроса через ${Math.round(delay)} мс:`, url);
+            await this.sleep(delay, signal);
+        }
+    }
+
+    retryDelay(attempt, result) {
+        const retryAfter = Number(result?.headers.get('Retry-After'));
+        if (retryAfter > 0) return Math.min(retryAfter * 1000, RETRY_MAX_DELAY);
+        // Полный джиттер: клиенты после общего сбоя не приходят одной волной
+        return Math.random() * Math.min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt);
+    }
+
+    sleep(ms, signal) {
+        return new Promise((resolve, reject) => {
+            const timer = setTimeout(resolve, ms);
+            signal?.addEventListener('abort', () => {
+                clearTimeout(timer);
+                reject(signal.reason);
+            }, { once: true });
+        });
+    }
+
+    invalidate(...prefixes) {
+        for (const url of this.cache.keys()) {
+            if (prefixes.some(prefix => url.startsWith(`${this.base}${prefix}`))) {
+                this.cache.delete(url);
+            }
+        }
+    }
+
+    clearCache() {
+        this.cache.clear();
+    }
+}
+
 class MaganteOTC {
     constructor() {
         this.apiBase = 'https://magnate-otc-2.onrender.com';
+        this.api = new ApiClient(this.apiBase, () => this.token);
         this.currentUser = null;
         this.token = localStorage.getItem('magante_token');
+        this.pageSize = 20;
+        this.dealsCursor = null;
+        this.ticketsCursor = null;
+        // Загруженные записи — чтобы перерисовать одну карточку по событию
+        this.dealsById = new Map();
+        this.ticketsById = new Map();
+        this.eventsAbort = null;
+        this.exportAbort = null;
+        this.searchCursor = null;
+        // Тикет, арендованный из очереди поддержки, и таймер продления аренды
+        this.claimedTicket = null;
+        this.leaseTimer = null;
+        // Тикеты пользователя по статусам — из /api/bootstrap, дальше правим локально
+        this.ticketCounts = {};
+        // Один Idempotency-Key на заполненную форму: повторные нажатия его переиспользуют
+        this.idempotencyKeys = {};
+        // Загрузки текущего раздела: при переключении раздела отменяются
+        this.sectionAbort = null;
         
         console.log('🚀 Magante OTC инициализирован');
         
@@ -25,6 +234,9 @@ class MaganteOTC {
 
     setupEventListeners() {
         console.log('🔧 Настройка обработчиков событий...');
+
+        // Закрытая вкладка не должна держать тикет до истечения аренды
+        window.addEventListener('beforeunload', () => this.abandonClaimedTicket());
         
         // Логин форма
         const loginForm = document.getElementById('loginForm');
@@ -40,6 +252,7 @@ class MaganteOTC {
         // Создание сделки
         const dealForm = document.getElementById('createDealForm');
         if (dealForm) {
+            dealForm.addEventListener('input', () => this.resetIdempotencyKey('deal'));
             dealForm.addEventListener('submit', (e) => {
                 e.preventDefault();
                 const amount = document.getElementById('dealAmount').value;
@@ -52,6 +265,7 @@ class MaganteOTC {
         // Создание тикета
         const ticketForm = document.getElementById('newTicketForm');
         if (ticketForm) {
+            ticketForm.addEventListener('input', () => this.resetIdempotencyKey('ticket'));
             ticketForm.addEventListener('submit', (e) => {
                 e.preventDefault();
                 const subject = document.getElementById('ticketSubject').value;
@@ -59,23 +273,45 @@ class MaganteOTC {
                 this.createTicket(subject, message);
             });
         }
+
+        // Поиск в админке
+        const searchForm = document.getElementById('adminSearchForm');
+        if (searchForm) {
+            searchForm.addEventListener('submit', (e) => {
+                e.preventDefault();
+                this.searchAdmin();
+            });
+        }
+    }
+
+    getIdempotencyKey(form) {
+        if (!this.idempotencyKeys[form]) {
+            this.idempotencyKeys[form] = crypto.randomUUID();
+        }
+        return this.idempotencyKeys[form];
+    }
+
+    resetIdempotencyKey(form) {
+        delete this.idempotencyKeys[form];
+    }
+
+    // Весь первый экран одним запросом: сессия, профиль, первая страница сделок, счётчики тикетов
+    fetchBootstrap() {
+        const params = new URLSearchParams({ limit: this.pageSize, fields: DEAL_FIELDS });
+        return this.api.request('GET', `/api/bootstrap?${params}`);
     }
 
     async validateToken() {
         try {
             console.log('🔐 Проверка токена...');
-            const response = await fetch(`${this.apiBase}/api/profile`, {
-                headers: {
-                    'Authorization': `Bearer ${this.token}`,
-                    'Accept': 'application/json'
-                }
-            });
+            // Проверка токена и данные дашборда — один и тот же запрос
+            const response = await this.fetchBootstrap();
 
             if (response.ok) {
-                const profile = await response.json();
-                this.currentUser = profile;
-                this.showDashboard();
-                console.log('✅ Автоматический вход выполнен:', profile.username);
+                const session = response.data.session;
+                this.currentUser = session;
+                this.showDashboard(response.data);
+                console.log('✅ Автоматический вход выполнен:', session.username);
                 return true;
             } else {
                 console.log('❌ Токен невалиден');
@@ -94,28 +330,24 @@ class MaganteOTC {
             this.showLoading(true);
             console.log('🔐 Отправка запроса на вход...');
 
-            const response = await fetch(`${this.apiBase}/api/login`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Accept': 'application/json'
-                },
-                body: JSON.stringify({ 
+            const response = await this.api.request('POST', '/api/login', {
+                body: {
                     login: login.trim(),
                     password: password.trim()
-                })
+                }
             });
 
             console.log('📡 Ответ сервера:', response.status);
 
-            const data = await response.json();
-            console.log('📦 Данные ответа:', data);
+            const data = response.data || {};
 
             if (response.ok) {
                 this.currentUser = data.user;
                 this.token = data.token;
+                this.api.clearCache();
                 localStorage.setItem('magante_token', this.token);
-                this.showDashboard();
+                const bootstrap = await this.fetchBootstrap();
+                this.showDashboard(bootstrap.ok ? bootstrap.data : null);
                 this.showToast('✅ Успешный вход!', 'success');
                 return true;
             } else {
@@ -135,28 +367,25 @@ class MaganteOTC {
             this.showLoading(true);
             console.log('💼 Создание сделки...');
 
-            const response = await fetch(`${this.apiBase}/api/deals`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Authorization': `Bearer ${this.token}`,
-                    'Accept': 'application/json'
-                },
-                body: JSON.stringify({
+            const response = await this.api.request('POST', '/api/deals', {
+                headers: { 'Idempotency-Key': this.getIdempotencyKey('deal') },
+                body: {
                     amount: parseFloat(amount),
                     description: description.trim(),
                     payment_method: paymentMethod
-                })
+                }
             });
 
             console.log('📡 Ответ создания сделки:', response.status);
 
-            const data = await response.json();
+            const data = response.data || {};
             console.log('📦 Данные сделки:', data);
 
             if (response.ok) {
+                this.api.invalidate('/api/deals/my');
                 this.showToast('✅ Сделка создана! Ссылка отправлена в Telegram бот.', 'success');
                 document.getElementById('createDealForm').reset();
+                this.resetIdempotencyKey('deal');
                 // Переключаемся на список сделок и обновляем
                 this.showSection('dealsSection');
                 return data;
@@ -172,78 +401,310 @@ class MaganteOTC {
         }
     }
 
-    async loadUserDeals() {
+    // Сигнал загрузок текущего раздела; новый раздел отменяет загрузки прежнего
+    startSection() {
+        if (this.sectionAbort) this.sectionAbort.abort();
+        this.sectionAbort = new AbortController();
+        return this.sectionAbort.signal;
+    }
+
+    async loadUserDeals(append = false) {
         try {
             console.log('📊 Загрузка сделок...');
-            const response = await fetch(`${this.apiBase}/api/deals/my`, {
-                headers: {
-                    'Authorization': `Bearer ${this.token}`,
-                    'Accept': 'application/json'
-                }
-            });
+            const params = new URLSearchParams({ limit: this.pageSize, fields: DEAL_FIELDS });
+            if (append && this.dealsCursor) params.set('cursor', this.dealsCursor);
+            const response = await this.api.get(`/api/deals/my?${params}`,
+                { signal: this.sectionAbort?.signal });
 
             console.log('📡 Ответ загрузки сделок:', response.status);
 
             if (response.ok) {
-                const deals = await response.json();
-                this.displayDeals(deals);
+                const deals = response.data;
+                this.dealsCursor = response.headers.get('X-Next-Cursor');
+                this.displayDeals(deals, append);
                 console.log('✅ Сделки загружены:', deals.length);
             } else {
                 throw new Error('Ошибка загрузки сделок');
             }
         } catch (error) {
+            if (isAbort(error)) return;
             console.error('❌ Ошибка загрузки сделок:', error);
             this.showToast('Ошибка загрузки сделок', 'error');
-            this.displayDeals([]);
+            if (!append) this.displayDeals([]);
         }
     }
 
     async loadProfile() {
         try {
             console.log('👤 Загрузка профиля...');
-            const response = await fetch(`${this.apiBase}/api/profile`, {
-                headers: {
-                    'Authorization': `Bearer ${this.token}`,
-                    'Accept': 'application/json'
-                }
-            });
+            const response = await this.api.get('/api/profile', { signal: this.sectionAbort?.signal });
 
             if (response.ok) {
-                const profile = await response.json();
+                const profile = response.data;
                 this.displayProfile(profile);
                 this.updateUserBalance(profile.balance);
                 console.log('✅ Профиль загружен');
             }
         } catch (error) {
+            if (isAbort(error)) return;
             console.error('❌ Ошибка загрузки профиля:', error);
         }
     }
 
+    async loadAdminStats() {
+        try {
+            console.log('📈 Загрузка статистики...');
+            const response = await this.api.get('/api/admin/stats', { signal: this.sectionAbort?.signal });
+
+            if (response.ok) {
+                const stats = response.data;
+                this.displayAdminStats(stats);
+                console.log('✅ Статистика загружена');
+            } else {
+                throw new Error('Ошибка загрузки статистики');
+            }
+        } catch (error) {
+            if (isAbort(error)) return;
+            console.error('❌ Ошибка загрузки статистики:', error);
+        }
+    }
+
+    async searchAdmin(append = false) {
+        const container = document.getElementById('adminContent');
+        const query = document.getElementById('adminSearchQuery')?.value.trim();
+        if (!container || !query) return;
+
+        try {
+            console.log('🔍 Поиск:', query);
+            const params = new URLSearchParams({ q: query, limit: this.pageSize });
+            const kind = document.getElementById('adminSearchKind')?.value;
+            if (kind) params.set('kind', kind);
+            if (append && this.searchCursor) params.set('cursor', this.searchCursor);
+            const response = await this.api.get(`/api/admin/search?${params}`,
+                { signal: this.sectionAbort?.signal });
+            if (!response.ok) throw new Error(`Ошибка сервера: ${response.status}`);
+
+            const results = response.data;
+            this.searchCursor = response.headers.get('X-Next-Cursor');
+            const html = results.length || append ? results.map(item => `
+                <div class="card mb-2 search-result">
+                    <div class="card-body py-2">
+                        <div class="d-flex justify-content-between">
+                            <strong>${item.kind === 'deal' ? '💼 Сделка' : '🎫 Тикет'}${item.title ? `: ${escapeHtml(item.title)}` : ''}</strong>
+                            <span class="badge bg-${this.getStatusColor(item.status)}">${this.getStatusText(item.status)}</span>
+                        </div>
+                        <p class="mb-1 small">${escapeHtml(item.snippet)}</p>
+                        <small class="text-muted">${item.id} · ${new Date(item.created_at).toLocaleDateString('ru-RU')}</small>
+                    </div>
+                </div>
+            `).join('') : '<p class="text-muted">Ничего не найдено</p>';
+            this.renderPage(container, html, append, this.searchCursor,
+                'loadMoreSearch()', 'search-more');
+            console.log('✅ Найдено:', results.length);
+        } catch (error) {
+            if (isAbort(error)) return;
+            console.error('❌ Ошибка поиска:', error);
+            this.showToast('Ошибка поиска', 'error');
+        }
+    }
+
+    // Читает NDJSON-выгрузку потоком и дописывает строки в таблицу по мере прихода
+    async streamExport(kind, filters = {}) {
+        const container = document.getElementById('adminContent');
+        if (!container) return;
+
+        if (this.exportAbort) this.exportAbort.abort();
+        const controller = new AbortController();
+        this.exportAbort = controller;
+
+        const columns = EXPORT_COLUMNS[kind];
+        container.innerHTML = `
+            <p class="small text-muted">Получено строк: <span id="exportCount">0</span></p>
+            <div class="table-responsive">
+                <table class="table table-sm table-striped small">
+                    <thead><tr>${columns.map(c => `<th>${c}</th>`).join('')}</tr></thead>
+                    <tbody id="exportRows"></tbody>
+                </table>
+            </div>
+        `;
+        const tbody = document.getElementById('exportRows');
+        const counter = document.getElementById('exportCount');
+
+        try {
+            console.log('📤 Выгрузка:', kind);
+            const params = new URLSearchParams({ format: 'ndjson', ...filters });
+            const response = await fetch(`${this.apiBase}/api/admin/export/${kind}?${params}`, {
+                headers: this.api.headers({ 'Accept': 'application/x-ndjson' }),
+                signal: controller.signal
+            });
+            if (!response.ok) throw new Error(`Ошибка сервера: ${response.status}`);
+
+            const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+            let buffer = '';
+            let count = 0;
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += value;
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+
+                let html = '';
+                for (const line of lines) {
+                    if (!line) continue;
+                    count++;
+                    if (count > ADMIN_RENDER_LIMIT) continue;
+                    const row = JSON.parse(line);
+                    html += `<tr>${columns.map(c => `<td>${escapeHtml(row[c])}</td>`).join('')}</tr>`;
+                }
+                if (html) tbody.insertAdjacentHTML('beforeend', html);
+                counter.textContent = count;
+            }
+            console.log('✅ Выгрузка завершена:', count);
+        } catch (error) {
+            if (controller.signal.aborted) return;
+            console.error('❌ Ошибка выгрузки:', error);
+            this.showToast('Ошибка выгрузки', 'error');
+        }
+    }
+
+    // Очередь поддержки: сервер выдаёт каждому агенту свой тикет в аренду
+    async takeNextTicket() {
+        const container = document.getElementById('adminContent');
+        if (!container) return;
+
+        try {
+            await this.releaseClaimedTicket(false);
+            console.log('🎫 Следующий тикет из очереди...');
+            const response = await this.api.request('POST', '/api/admin/tickets/next');
+            if (!response.ok) throw new Error(response.data?.error || 'Ошибка очереди тикетов');
+
+            const { ticket } = response.data;
+            if (!ticket) {
+                container.innerHTML = '<p class="text-muted">Свободных тикетов нет</p>';
+                return;
+            }
+            this.claimedTicket = ticket;
+            container.innerHTML = `
+                <div class="card" id="claimedTicket">
+                    <div class="card-body">
+                        <div class="d-flex justify-content-between">
+                            <h6 class="card-title">${escapeHtml(ticket.subject)}</h6>
+                            <span class="badge bg-${this.getTicketStatusColor(ticket.status)}">${this.getTicketStatusText(ticket.status)}</span>
+                        </div>
+                        <p class="card-text">${escapeHtml(ticket.message)}</p>
+                        <small class="text-muted">${ticket.id} · ${new Date(ticket.created_at).toLocaleString('ru-RU')}</small>
+                        <div class="d-flex gap-2 mt-3">
+                            <button class="btn btn-success btn-sm" onclick="closeClaimedTicket()">
+                                <i class="fas fa-check me-1"></i>Закрыть
+                            </button>
+                            <button class="btn btn-outline-secondary btn-sm" onclick="releaseClaimedTicket()">
+                                <i class="fas fa-undo me-1"></i>Вернуть в очередь
+                            </button>
+                        </div>
+                    </div>
+                </div>
+            `;
+            this.leaseTimer = setInterval(() => this.renewLease(), LEASE_RENEW_INTERVAL);
+            console.log('✅ Тикет взят в работу:', ticket.id);
+        } catch (error) {
+            console.error('❌ Ошибка очереди тикетов:', error);
+            this.showToast(error.message, 'error');
+        }
+    }
+
+    async renewLease() {
+        const ticket = this.claimedTicket;
+        if (!ticket) return;
+        // Карточку заменили выгрузкой или поиском — тикет больше никто не ведёт
+        if (!document.getElementById('claimedTicket')) {
+            await this.releaseClaimedTicket(false);
+            return;
+        }
+        try {
+            const response = await this.api.request('POST', `/api/admin/tickets/${ticket.id}/lease`);
+            if (response.status === 409) {
+                this.stopLease();
+                this.showToast('Аренда тикета истекла — он вернулся в очередь', 'error');
+            }
+        } catch (error) {
+            console.error('❌ Ошибка продления аренды:', error);
+        }
+    }
+
+    stopLease() {
+        clearInterval(this.leaseTimer);
+        this.leaseTimer = null;
+        this.claimedTicket = null;
+    }
+
+    async releaseClaimedTicket(notify = true) {
+        const ticket = this.claimedTicket;
+        if (!ticket) return;
+        this.stopLease();
+        try {
+            await this.api.request('DELETE', `/api/admin/tickets/${ticket.id}/lease`);
+            if (notify) {
+                document.getElementById('claimedTicket')?.remove();
+                this.showToast('Тикет возвращён в очередь', 'success');
+            }
+        } catch (error) {
+            console.error('❌ Ошибка возврата тикета:', error);
+        }
+    }
+
+    // Синхронно, без ожидания ответа: keepalive доносит запрос и после закрытия вкладки
+    abandonClaimedTicket() {
+        const ticket = this.claimedTicket;
+        if (!ticket) return;
+        this.stopLease();
+        fetch(`${this.apiBase}/api/admin/tickets/${ticket.id}/lease`, {
+            method: 'DELETE',
+            headers: this.api.headers(),
+            keepalive: true
+        }).catch(error => console.error('❌ Ошибка возврата тикета:', error));
+    }
+
+    async closeClaimedTicket() {
+        const ticket = this.claimedTicket;
+        if (!ticket) return;
+        try {
+            const response = await this.api.request('POST', `/api/admin/tickets/${ticket.id}/status`, {
+                body: { status: 'closed' }
+            });
+            if (!response.ok) throw new Error(response.data?.error || 'Ошибка закрытия тикета');
+            this.stopLease();
+            this.showToast('✅ Тикет закрыт', 'success');
+            await this.takeNextTicket();
+        } catch (error) {
+            console.error('❌ Ошибка закрытия тикета:', error);
+            this.showToast(error.message, 'error');
+        }
+    }
+
     async createTicket(subject, message) {
         try {
             this.showLoading(true);
             console.log('🎫 Создание тикета...');
 
-            const response = await fetch(`${this.apiBase}/api/tickets`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Authorization': `Bearer ${this.token}`,
-                    'Accept': 'application/json'
-                },
-                body: JSON.stringify({
+            const response = await this.api.request('POST', '/api/tickets', {
+                headers: { 'Idempotency-Key': this.getIdempotencyKey('ticket') },
+                body: {
                     subject: subject.trim(),
                     message: message.trim()
-                })
+                }
             });
 
             console.log('📡 Ответ создания тикета:', response.status);
 
-            const data = await response.json();
+            const data = response.data || {};
 
             if (response.ok) {
+                this.api.invalidate('/api/tickets/my');
+                this.adjustTicketCount(null, data.status);
                 this.showToast('✅ Тикет создан!', 'success');
                 document.getElementById('newTicketForm').reset();
+                this.resetIdempotencyKey('ticket');
                 this.hideCreateTicket();
                 // Обновляем список тикетов
                 this.loadUserTickets();
@@ -260,40 +721,40 @@ class MaganteOTC {
         }
     }
 
-    async loadUserTickets() {
+    async loadUserTickets(append = false) {
         try {
             console.log('🎫 Загрузка тикетов...');
-            const response = await fetch(`${this.apiBase}/api/tickets/my`, {
-                headers: {
-                    'Authorization': `Bearer ${this.token}`,
-                    'Accept': 'application/json'
-                }
-            });
+            const params = new URLSearchParams({ limit: this.pageSize, fields: TICKET_FIELDS });
+            if (append && this.ticketsCursor) params.set('cursor', this.ticketsCursor);
+            const response = await this.api.get(`/api/tickets/my?${params}`,
+                { signal: this.sectionAbort?.signal });
 
             console.log('📡 Ответ загрузки тикетов:', response.status);
 
             if (response.ok) {
-                const tickets = await response.json();
-                this.displayTickets(tickets);
+                const tickets = response.data;
+                this.ticketsCursor = response.headers.get('X-Next-Cursor');
+                this.displayTickets(tickets, append);
                 console.log('✅ Тикеты загружены:', tickets.length);
             } else {
                 throw new Error('Ошибка загрузки тикетов');
             }
         } catch (error) {
+            if (isAbort(error)) return;
             console.error('❌ Ошибка загрузки тикетов:', error);
             this.showToast('Ошибка загрузки тикетов', 'error');
-            this.displayTickets([]);
+            if (!append) this.displayTickets([]);
         }
     }
 
-    displayDeals(deals) {
+    displayDeals(deals, append = false) {
         const container = document.getElementById('dealsList');
         if (!container) {
             console.error('❌ Контейнер dealsList не найден!');
             return;
         }
 
-        if (!deals || deals.length === 0) {
+        if (!append && (!deals || deals.length === 0)) {
             container.innerHTML = `
                 <div class="col-12">
                     <div class="alert alert-info text-center py-4">
@@ -306,10 +767,16 @@ class MaganteOTC {
             return;
         }
 
-        container.innerHTML = deals.map(deal => {
-            const dealLink = `https://t.me/magnate_otc_bot?start=${deal.id}`;
-            return `
-                <div class="col-md-6 mb-4">
+        if (!append) this.dealsById.clear();
+        deals.forEach(deal => this.dealsById.set(deal.id, deal));
+        this.renderPage(container, deals.map(deal => this.renderDealCard(deal)).join(''), append,
+            this.dealsCursor, 'loadMoreDeals()', 'col-12 text-center mb-4');
+    }
+
+    renderDealCard(deal) {
+        const dealLink = `https://t.me/magnate_otc_bot?start=${deal.id}`;
+        return `
+                <div class="col-md-6 mb-4" data-deal-id="${deal.id}">
                     <div class="card feature-card h-100">
                         <div class="card-body">
                             <div class="d-flex justify-content-between align-items-start mb-3">
@@ -327,6 +794,7 @@ class MaganteOTC {
                                     <div class="col-6">
                                         <strong>Сумма:</strong><br>
                                         <span class="fw-bold">${deal.amount} ${this.getPaymentMethodText(deal.payment_method)}</span>
+                                        ${deal.payment_method !== 'sbp' && deal.amount_rub != null ? `<br><small class="text-muted">≈ ${deal.amount_rub} RUB</small>` : ''}
                                     </div>
                                     <div class="col-6">
                                         <strong>Статус:</strong><br>
@@ -360,17 +828,16 @@ class MaganteOTC {
                     </div>
                 </div>
             `;
-        }).join('');
     }
 
-    displayTickets(tickets) {
+    displayTickets(tickets, append = false) {
         const container = document.getElementById('ticketsList');
         if (!container) {
             console.error('❌ Контейнер ticketsList не найден!');
             return;
         }
 
-        if (!tickets || tickets.length === 0) {
+        if (!append && (!tickets || tickets.length === 0)) {
             container.innerHTML = `
                 <div class="alert alert-info text-center py-4">
                     <i class="fas fa-ticket-alt fa-2x mb-3"></i>
@@ -381,8 +848,15 @@ class MaganteOTC {
             return;
         }
 
-        container.innerHTML = tickets.map(ticket => `
-            <div class="card mb-3">
+        if (!append) this.ticketsById.clear();
+        tickets.forEach(ticket => this.ticketsById.set(ticket.id, ticket));
+        this.renderPage(container, tickets.map(ticket => this.renderTicketCard(ticket)).join(''), append,
+            this.ticketsCursor, 'loadMoreTickets()', 'text-center mb-3');
+    }
+
+    renderTicketCard(ticket) {
+        return `
+            <div class="card mb-3" data-ticket-id="${ticket.id}">
                 <div class="card-body">
                     <div class="d-flex justify-content-between align-items-start mb-3">
                         <h5 class="card-title mb-0">
@@ -400,7 +874,51 @@ class MaganteOTC {
                     </small>
                 </div>
             </div>
+        `;
+    }
+
+    // Дописывает страницу в список вместо полной перерисовки и ставит кнопку «Показать ещё»
+    renderPage(container, html, append, cursor, loadMoreHandler, loadMoreClass) {
+        const oldButton = container.querySelector('.load-more');
+        if (oldButton) oldButton.remove();
+
+        if (append) {
+            container.insertAdjacentHTML('beforeend', html);
+        } else {
+            container.innerHTML = html;
+        }
+
+        if (cursor) {
+            container.insertAdjacentHTML('beforeend', `
+                <div class="load-more ${loadMoreClass}">
+                    <button class="btn btn-outline-primary btn-sm" onclick="${loadMoreHandler}">
+                        <i class="fas fa-chevron-down me-1"></i>Показать ещё
+                    </button>
+                </div>
+            `);
+        }
+    }
+
+    displayAdminStats(stats) {
+        const container = document.getElementById('adminStats');
+        if (!container) return;
+
+        const byStatus = Object.entries(stats.deals.by_status).map(([status, item]) => `
+            <li>${this.getStatusText(status)}: <strong>${item.count}</strong></li>
         `).join('');
+        const byMethod = Object.entries(stats.deals.by_payment_method).map(([method, item]) => `
+            <li>${this.getPaymentMethodText(method)}: <strong>${item.count}</strong> (${item.volume} ${this.getPaymentMethodText(method)}${method !== 'sbp' && item.volume_rub != null ? ` ≈ ${item.volume_rub} RUB` : ''})</li>
+        `).join('');
+
+        container.innerHTML = `
+            <p class="mb-1"><strong>Сделок всего:</strong> ${stats.deals.total}</p>
+            <ul class="small mb-2">${byStatus}</ul>
+            <p class="mb-1"><strong>По методам оплаты:</strong></p>
+            <ul class="small mb-2">${byMethod}</ul>
+            ${stats.deals.volume_rub != null ? `<p class="mb-1"><strong>Оборот в рублях:</strong> ${stats.deals.volume_rub} RUB</p>` : ''}
+            <p class="mb-1"><strong>Открытых тикетов:</strong> ${stats.tickets.open}</p>
+            <p class="mb-0"><strong>Пользователи:</strong> ${stats.users.total} (с активными сделками: ${stats.users.with_active_deals})</p>
+        `;
     }
 
     displayProfile(profile) {
@@ -437,6 +955,20 @@ class MaganteOTC {
         `;
     }
 
+    adjustTicketCount(oldStatus, newStatus) {
+        if (oldStatus) this.ticketCounts[oldStatus] = (this.ticketCounts[oldStatus] || 1) - 1;
+        if (newStatus) this.ticketCounts[newStatus] = (this.ticketCounts[newStatus] || 0) + 1;
+        this.updateTicketBadge();
+    }
+
+    updateTicketBadge() {
+        const badge = document.getElementById('openTicketsBadge');
+        if (!badge) return;
+        const open = OPEN_TICKET_STATUSES.reduce((sum, status) => sum + (this.ticketCounts[status] || 0), 0);
+        badge.textContent = open;
+        badge.style.display = open ? 'inline-block' : 'none';
+    }
+
     updateUserBalance(balance) {
         const balanceElement = document.getElementById('userBalance');
         if (balanceElement) {
@@ -444,7 +976,8 @@ class MaganteOTC {
         }
     }
 
-    showDashboard() {
+    // bootstrap — ответ /api/bootstrap; без него разделы грузятся отдельными запросами
+    showDashboard(bootstrap = null) {
         console.log('🏠 Показ дашборда...');
         
         // Скрываем все секции
@@ -465,12 +998,114 @@ class MaganteOTC {
         }
         
         // Загружаем начальные данные
-        this.loadUserDeals();
-        this.loadProfile();
+        this.startSection();
+        if (bootstrap) {
+            this.dealsCursor = bootstrap.deals_cursor;
+            this.displayDeals(bootstrap.deals);
+            this.displayProfile(bootstrap.profile);
+            this.updateUserBalance(bootstrap.profile.balance);
+            this.ticketCounts = bootstrap.ticket_counts;
+            this.updateTicketBadge();
+        } else {
+            this.loadUserDeals();
+            this.loadProfile();
+        }
+        this.subscribeEvents();
         
         console.log('✅ Дашборд показан');
     }
 
+    // SSE через fetch: EventSource не умеет слать заголовок Authorization
+    async subscribeEvents() {
+        if (this.eventsAbort) return;
+        const controller = new AbortController();
+        this.eventsAbort = controller;
+        let delay = 1000;
+
+        while (!controller.signal.aborted) {
+            try {
+                const response = await fetch(`${this.apiBase}/api/events`, {
+                    headers: this.api.headers({ 'Accept': 'text/event-stream' }),
+                    signal: controller.signal
+                });
+                if (!response.ok) throw new Error(`Ошибка сервера: ${response.status}`);
+                console.log('📡 Подписка на события открыта');
+                delay = 1000;
+
+                const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+                let buffer = '';
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += value;
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                        this.handleServerEvent(buffer.slice(0, boundary));
+                        buffer = buffer.slice(boundary + 2);
+                    }
+                }
+            } catch (error) {
+                if (controller.signal.aborted) break;
+                console.error('❌ Поток событий прерван:', error);
+            }
+            if (controller.signal.aborted) break;
+            await new Promise(resolve => setTimeout(resolve, delay + Math.random() * 1000));
+            delay = Math.min(delay * 2, 30000);
+        }
+    }
+
+    unsubscribeEvents() {
+        if (this.eventsAbort) {
+            this.eventsAbort.abort();
+            this.eventsAbort = null;
+        }
+    }
+
+    handleServerEvent(chunk) {
+        let name = 'message';
+        let data = '';
+        chunk.split('\n').forEach(line => {
+            if (line.startsWith('event: ')) name = line.slice(7);
+            else if (line.startsWith('data: ')) data += line.slice(6);
+        });
+        if (!data) return;
+
+        const delta = JSON.parse(data);
+        switch (name) {
+            case 'deal':
+                // Кэш списков устарел: следующий показ раздела перечитает их
+                this.api.invalidate('/api/deals/my', '/api/profile');
+                this.patchCard(this.dealsById, delta, 'data-deal-id', deal => this.renderDealCard(deal));
+                break;
+            case 'ticket': {
+                const previous = this.ticketsById.get(delta.id);
+                if (previous && previous.status !== delta.status) {
+                    this.adjustTicketCount(previous.status, delta.status);
+                }
+                this.api.invalidate('/api/tickets/my');
+                this.patchCard(this.ticketsById, delta, 'data-ticket-id', ticket => this.renderTicketCard(ticket));
+                break;
+            }
+            case 'resync':
+                this.api.clearCache();
+                this.loadUserDeals();
+                this.loadUserTickets();
+                break;
+        }
+    }
+
+    // Перерисовывает только изменившуюся карточку, остальной список не трогаем
+    patchCard(cache, delta, attribute, render) {
+        const record = cache.get(delta.id);
+        if (!record) return;
+        Object.assign(record, delta);
+        const element = document.querySelector(`[${attribute}="${delta.id}"]`);
+        if (element) {
+            element.outerHTML = render(record);
+            console.log('🔄 Обновлена карточка:', delta.id, delta.status);
+        }
+    }
+
     showLoginForm() {
         console.log('🔐 Показ формы входа...');
         document.querySelector('.hero-section').style.display = 'block';
@@ -523,7 +1158,8 @@ class MaganteOTC {
             }
         });
 
-        // Загружаем данные при переключении
+        // Загружаем данные при переключении; незавершённые загрузки прежнего раздела отменяются
+        this.startSection();
         switch(sectionName) {
             case 'dealsSection':
                 this.loadUserDeals();
@@ -534,6 +1170,9 @@ class MaganteOTC {
             case 'profileSection':
                 this.loadProfile();
                 break;
+            case 'adminSection':
+                this.loadAdminStats();
+                break;
         }
     }
 
@@ -602,8 +1241,15 @@ class MaganteOTC {
 
     logout() {
         console.log('🚪 Выход...');
+        // До сброса токена: без него сервер не примет возврат тикета
+        this.abandonClaimedTicket();
+        this.unsubscribeEvents();
         this.currentUser = null;
         this.token = null;
+        this.ticketCounts = {};
+        this.updateTicketBadge();
+        if (this.sectionAbort) this.sectionAbort.abort();
+        this.api.clearCache();
         localStorage.removeItem('magante_token');
         this.showLoginForm();
         this.showToast('Вы вышли из системы', 'info');
@@ -702,6 +1348,60 @@ function loadUserDeals() {
     }
 }
 
+function loadAllDeals() {
+    if (window.maganteOTC) {
+        window.maganteOTC.streamExport('deals');
+    }
+}
+
+function loadAllTickets() {
+    if (window.maganteOTC) {
+        window.maganteOTC.streamExport('tickets');
+    }
+}
+
+function takeNextTicket() {
+    if (window.maganteOTC) {
+        window.maganteOTC.takeNextTicket();
+    }
+}
+
+function closeClaimedTicket() {
+    if (window.maganteOTC) {
+        window.maganteOTC.closeClaimedTicket();
+    }
+}
+
+function releaseClaimedTicket() {
+    if (window.maganteOTC) {
+        window.maganteOTC.releaseClaimedTicket();
+    }
+}
+
+function loadUsers() {
+    if (window.maganteOTC) {
+        window.maganteOTC.streamExport('users');
+    }
+}
+
+function loadMoreSearch() {
+    if (window.maganteOTC) {
+        window.maganteOTC.searchAdmin(true);
+    }
+}
+
+function loadMoreDeals() {
+    if (window.maganteOTC) {
+        window.maganteOTC.loadUserDeals(true);
+    }
+}
+
+function loadMoreTickets() {
+    if (window.maganteOTC) {
+        window.maganteOTC.loadUserTickets(true);
+    }
+}
+
 // Функция для копирования ссылки сделки
 function copyToClipboard(text) {
     navigator.clipboard.writeText(text).then(() => {
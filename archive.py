@@ -0,0 +1,333 @@
+"""Архив завершённых сделок: сжатые сегменты только на дозапись.
+
+Сделки в ``completed`` и ``cancelled``, не менявшиеся дольше порога,
+переезжают из хранилища в каталог ``ARCHIVE_DIR``, и горячее хранилище
+остаётся маленьким: страницы «моих» сделок, пересчёты и индексы работают
+только с живыми данными.
+
+Архив — файлы ``segment-000001.dat``, в которые только дописываются кадры:
+до ``FRAME_RECORDS`` сделок одного пользователя (вместе с журналом
+переходов) в JSON, сжатом zlib с предустановленным словарём — иначе
+кадр из пары сделок почти не сжимается. Сегменты читаются через mmap,
+распакованные кадры живут в небольшом LRU. Индекс в SQLite рядом с
+сегментами: по пользователю — список его кадров со смещениями, по id —
+номер кадра.
+
+Порядок переноса: кадры дописываются и сбрасываются на диск, затем
+фиксируется индекс, и только потом сделки удаляются из хранилища. После
+сбоя между шагами сделка окажется в обоих местах; следующий проход увидит
+её в индексе и просто удалит из хранилища. Хвост сегмента без записи в
+индексе никто не читает.
+
+Переносит один процесс за раз (``lockf`` на ``archive.lock``), читают все.
+С ``memory://`` у каждого воркера свои данные, поэтому и архив должен быть
+свой — общий каталог годится только для SQLite-хранилища.
+"""
+
+import fcntl
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import groupby
+
+from store import decode_cursor, encode_cursor
+
+logger = logging.getLogger('magante.archive')
+
+ARCHIVE_STATUSES = ('completed', 'cancelled')
+FRAME_RECORDS = 256
+SEGMENT_SIZE = 64 * 2 ** 20
+BATCH = 10_000
+FRAME_CACHE_SIZE = 256
+DEFAULT_INTERVAL = 3600
+# Курсор архивной страницы; в urlsafe base64 горячих курсоров такого символа нет
+CURSOR_PREFIX = '~'
+# Позиция в курсоре — номер кадра и сколько записей кадра уже отдано
+_CURSOR_STRIDE = FRAME_RECORDS + 1
+# Словарь zlib: ключи и частые значения записи. Менять нельзя — старые
+# кадры без того же словаря не распакуются.
+ZDICT = (
+    b'"from":null,"to":"active","at":"2026-01-01T00:00:00.000000+00:00"},'
+    b'{"from":"active","to":"confirmed","at":"2026-01-01T00:00:00.000000+00:00"},'
+    b'{"from":"confirmed","to":"cancelled","at":"2026-01-01T00:00:00.000000+00:00"},'
+    b'{"from":"confirmed","to":"completed","at":"2026-01-01T00:00:00.000000+00:00"}]],'
+    b'[{"id":"01","user_id":"01","amount":100.0,"description":"",'
+    b'"payment_method":"ton","payment_method":"sbp","payment_method":"stars",'
+    b'"status":"cancelled","status":"completed",'
+    b'"created_at":"2026-01-01T00:00:00.000000+00:00",'
+    b'"updated_at":"2026-01-01T00:00:00.000000+00:00"},[{'
+)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS frames (
+    frame_id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS frames_by_owner ON frames (user_id, frame_id);
+CREATE TABLE IF NOT EXISTS archived (
+    id TEXT PRIMARY KEY,
+    frame_id INTEGER NOT NULL
+) WITHOUT ROWID;
+'''
+
+
+def compress(data):
+    packer = zlib.compressobj(6, zdict=ZDICT)
+    return packer.compress(data) + packer.flush()
+
+
+def decompress(data):
+    unpacker = zlib.decompressobj(zdict=ZDICT)
+    return unpacker.decompress(data) + unpacker.flush()
+
+
+def is_cursor(cursor):
+    return bool(cursor) and cursor.startswith(CURSOR_PREFIX)
+
+
+class Archive:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._maps = {}   # номер сегмента -> mmap
+        self._maps_lock = threading.Lock()
+        self._frame = lru_cache(maxsize=FRAME_CACHE_SIZE)(self._read_frame)
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.directory, 'index.sqlite3'),
+                                   timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f'segment-{segment:06d}.dat')
+
+    # --- чтение -----------------------------------------------------------
+
+    def _map(self, segment, end):
+        with self._maps_lock:
+            mapped = self._maps.get(segment)
+            # Сегмент дописали после того, как мы его отобразили, — отображаем заново
+            if mapped is None or len(mapped) < end:
+                with open(self._segment_path(segment), 'rb') as f:
+                    mapped = self._maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return mapped
+
+    def _read_frame(self, frame_id, segment, offset, length):
+        mapped = self._map(segment, offset + length)
+        return json.loads(decompress(mapped[offset:offset + length]))
+
+    def _frame_entries(self, frame_id):
+        row = self._connect().execute(
+            'SELECT frame_id, segment, offset, length FROM frames WHERE frame_id = ?',
+            (frame_id,)).fetchone()
+        return self._frame(*row) if row else []
+
+    def _entry(self, record_id):
+        row = self._connect().execute(
+            'SELECT frame_id FROM archived WHERE id = ?', (record_id,)).fetchone()
+        if row is None:
+            return None
+        for record, history in self._frame_entries(row[0]):
+            if record['id'] == record_id:
+                return record, history
+        return None
+
+    def get(self, record_id):
+        entry = self._entry(record_id)
+        return dict(entry[0]) if entry else None
+
+    def history(self, record_id):
+        entry = self._entry(record_id)
+        return [dict(item) for item in entry[1]] if entry else None
+
+    def list_by_owner(self, user_id, limit, before=None):
+        """Архивные сделки пользователя, новые первыми; как ``RecordStore.list_by_owner``.
+
+        ``before`` — курсор архива (``~…``) или None для начала архива.
+        """
+        top, skip = 2 ** 62, 0
+        if before is not None and before != CURSOR_PREFIX:
+            if not is_cursor(before):
+                raise ValueError('Некорректный курсор')
+            top, skip = divmod(decode_cursor(before[len(CURSOR_PREFIX):]), _CURSOR_STRIDE)
+        rows = self._connect().execute(
+            'SELECT frame_id, segment, offset, length FROM frames '
+            'WHERE user_id = ? AND frame_id <= ? ORDER BY frame_id DESC', (user_id, top))
+        records = []
+        for row in rows:
+            if len(records) == limit:
+                # Страница набрана, а кадры ещё есть — следующая начнётся с этого
+                return records, self._cursor(row[0], 0)
+            entries = self._frame(*row)
+            start = skip if row[0] == top else 0
+            taken = entries[start:start + limit - len(records)]
+            records += [dict(record) for record, _ in taken]
+            if start + len(taken) < len(entries):
+                return records, self._cursor(row[0], start + len(taken))
+        return records, None
+
+    @staticmethod
+    def _cursor(frame_id, skip):
+        return CURSOR_PREFIX + encode_cursor(frame_id * _CURSOR_STRIDE + skip)
+
+    def count_by_owner(self, user_id):
+        return self._connect().execute(
+            'SELECT COALESCE(SUM(count), 0) FROM frames WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+    def iter_all(self):
+        """Все архивные сделки по кадрам — для пересчёта статистики и выгрузок."""
+        last = 0
+        while True:
+            rows = self._connect().execute(
+                'SELECT frame_id, segment, offset, length FROM frames '
+                'WHERE frame_id > ? ORDER BY frame_id LIMIT 100', (last,)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                # Мимо LRU: полный проход вытеснил бы из него горячие кадры
+                for record, _ in self._read_frame(*row):
+                    yield record
+            last = rows[-1][0]
+
+    def version(self):
+        """Меняется с каждым переносом — часть ETag страниц сделок."""
+        return self._connect().execute('SELECT COALESCE(MAX(frame_id), 0) FROM frames').fetchone()[0]
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM archived').fetchone()[0]
+
+    # --- запись -----------------------------------------------------------
+
+    def try_lock(self):
+        """Файловый замок переноса; None, если переносит другой процесс."""
+        handle = open(os.path.join(self.directory, 'archive.lock'), 'a')
+        try:
+            fcntl.lockf(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return None
+        return handle
+
+    def contains(self, record_ids):
+        conn = self._connect()
+        return {r[0] for r in conn.execute(
+            f'SELECT id FROM archived WHERE id IN ({", ".join("?" * len(record_ids))})',
+            record_ids)} if record_ids else set()
+
+    def write(self, entries):
+        """Дописывает ``[(record, history)]`` кадрами по пользователям и фиксирует индекс."""
+        conn = self._connect()
+        segment = conn.execute('SELECT COALESCE(MAX(segment), 1) FROM frames').fetchone()[0]
+        frames = []
+        entries = sorted(entries, key=lambda e: (e[0]['user_id'], e[0]['created_at'], e[0]['id']))
+        for user_id, group in groupby(entries, key=lambda e: e[0]['user_id']):
+            group = list(group)
+            # Старые кадры получают меньшие номера; внутри кадра новые сделки первыми
+            for start in range(0, len(group), FRAME_RECORDS):
+                chunk = group[start:start + FRAME_RECORDS][::-1]
+                frames.append((user_id, chunk, compress(json.dumps(
+                    chunk, ensure_ascii=False, separators=(',', ':')).encode())))
+
+        placed = []
+        handle = None
+        try:
+            for user_id, chunk, data in frames:
+                if handle is None or handle.tell() >= SEGMENT_SIZE:
+                    if handle is not None:
+                        self._sync(handle)
+                        segment += 1
+                    handle = open(self._segment_path(segment), 'ab')
+                    handle.seek(0, os.SEEK_END)
+                placed.append((user_id, chunk, segment, handle.tell(), len(data)))
+                handle.write(data)
+        finally:
+            if handle is not None:
+                self._sync(handle)
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for user_id, chunk, segment, offset, length in placed:
+                frame_id = conn.execute(
+                    'INSERT INTO frames (user_id, count, segment, offset, length) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (user_id, len(chunk), segment, offset, length)).lastrowid
+                conn.executemany('INSERT OR IGNORE INTO archived (id, frame_id) VALUES (?, ?)',
+                                 [(record['id'], frame_id) for record, _ in chunk])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return len(placed)
+
+    @staticmethod
+    def _sync(handle):
+        handle.flush()
+        os.fsync(handle.fileno())
+        handle.close()
+
+
+class DealArchiver(threading.Thread):
+    """Раз в ``interval`` секунд переносит в архив сделки, завершённые раньше ``after``."""
+
+    def __init__(self, deals, archive, after, interval=DEFAULT_INTERVAL, batch=BATCH):
+        super().__init__(name='deal-archiver', daemon=True)
+        self.deals = deals
+        self.archive = archive
+        self.after = after
+        self.interval = interval
+        self.batch = batch
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run_once(time.time())
+            except Exception:
+                logger.exception('❌ Ошибка архивации сделок')
+
+    def run_once(self, now):
+        lock = self.archive.try_lock()
+        if lock is None:
+            return 0
+        cutoff = datetime.fromtimestamp(now - self.after, timezone.utc).isoformat()
+        moved = 0
+        try:
+            while not self._stopped.is_set():
+                candidates = self.deals.finished_before(ARCHIVE_STATUSES, cutoff, self.batch)
+                if not candidates:
+                    break
+                ids = [deal['id'] for deal in candidates]
+                # Уже в архиве — остались в хранилище после сбоя прошлого прохода
+                done = self.archive.contains(ids)
+                fresh = [deal for deal in candidates if deal['id'] not in done]
+                self.archive.write([(deal, self.deals.history(deal['id'])) for deal in fresh])
+                self.deals.remove(ids)
+                moved += len(fresh)
+                if len(candidates) < self.batch:
+                    break
+        finally:
+            lock.close()
+        if moved:
+            logger.info('🗄️ В архив перенесено сделок: %d', moved)
+        return moved
@@ -0,0 +1,408 @@
+"""Сборка и раздача статики клиента: ``python assets.py --out dist``.
+
+Сборка:
+
+* Bootstrap и Font Awesome скачиваются в ``vendor/`` (один раз; дальше
+  сборка работает без сети) вместе со шрифтами, на которые ссылается CSS.
+  Если файла нет и скачать его не удалось, сборка падает: молча оставить
+  ссылки на CDN можно только явно, флагом ``--allow-cdn``;
+* ``app.js`` минифицируется, inline-стили ``index.html`` выносятся в
+  ``app.css``, сам ``index.html`` ужимается;
+* к имени каждого файла дописывается хеш содержимого
+  (``app.3f9a1c2b7d.js``), ссылки в HTML и CSS переписываются;
+* текстовые файлы предварительно сжимаются в ``.gz`` и, если установлен
+  пакет ``brotli``, в ``.br``.
+
+Старые файлы из ``--out`` не удаляются: клиенты со страницей прошлой
+сборки дочитывают свои ассеты и во время деплоя.
+
+Минификатор JS консервативный: убирает комментарии и отступы, строки,
+шаблоны и регулярные выражения копирует как есть, переводы строк оставляет
+там, где от них может зависеть автоматическая вставка ``;``.
+
+Раздача (``STATIC_DIR=dist``): ``init_app`` регистрирует ``/assets/<name>``.
+Хешированные файлы отдаются с ``Cache-Control: immutable`` на год,
+``index.html`` — с ``no-cache`` и ETag. Если клиент принимает br или gzip,
+отдаётся заранее сжатый вариант.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import sys
+import urllib.parse
+import urllib.request
+
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # необязательная зависимость: без неё только .gz
+    brotli = None
+
+logger = logging.getLogger('magante.assets')
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+VENDOR = (
+    ('bootstrap.min.css', 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css'),
+    ('fontawesome.min.css', 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css'),
+    ('bootstrap.bundle.min.js',
+     'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js'),
+)
+ASSETS_PREFIX = 'assets/'
+HASH_LENGTH = 10
+COMPRESSIBLE = ('.js', '.css', '.html', '.svg', '.json', '.ttf', '.eot')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# --- минификация ---------------------------------------------------------
+
+IDENT = re.compile(r'[\w$\\]|[^\x00-\x7f]')
+# После них «/» начинает регулярное выражение, а не деление
+REGEX_PREFIX = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'void',
+                  'delete', 'throw', 'new', 'yield', 'await')
+
+
+def _is_ident(char):
+    return bool(char) and IDENT.match(char) is not None
+
+
+def _skip_string(source, i):
+    """Индекс после строки или шаблона, начинающегося в ``i``."""
+    quote = source[i]
+    i += 1
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == quote:
+            return i + 1
+        if quote == '`' and source.startswith('${', i):
+            i = _skip_expression(source, i + 2)
+            continue
+        i += 1
+    return i
+
+
+def _skip_expression(source, i):
+    """Индекс после ``}``, закрывающей подстановку ``${...}`` шаблона."""
+    depth = 1
+    while i < len(source):
+        char = source[i]
+        if char in '\'"`':
+            i = _skip_string(source, i)
+            continue
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if not depth:
+                return i + 1
+        i += 1
+    return i
+
+
+def _skip_regex(source, i):
+    i += 1
+    in_class = False
+    while i < len(source) and source[i] != '\n':
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            i += 1
+            while i < len(source) and source[i].isalpha():
+                i += 1
+            return i
+        i += 1
+    return i
+
+
+def _regex_allowed(out):
+    text = ''.join(out[-8:]).rstrip()
+    if not text or text[-1] in REGEX_PREFIX:
+        return True
+    return any(text.endswith(word) and not _is_ident(text[-len(word) - 1:-len(word)])
+               for word in REGEX_KEYWORDS)
+
+
+def minify_js(source):
+    out = []
+    space = newline = False
+    i = 0
+
+    def emit(text):
+        nonlocal space, newline
+        if out:
+            last, first = out[-1][-1], text[0]
+            if newline and last not in '{;,([' and first not in '}),].':
+                out.append('\n')
+            elif (space or newline) and (
+                    (_is_ident(last) and _is_ident(first))
+                    or (last in '+-' and first in '+-')):
+                out.append(' ')
+        space = newline = False
+        out.append(text)
+
+    while i < len(source):
+        char = source[i]
+        if char in '\'"`':
+            end = _skip_string(source, i)
+            emit(source[i:end])
+            i = end
+        elif source.startswith('//', i):
+            end = source.find('\n', i)
+            i = len(source) if end < 0 else end
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = len(source) if end < 0 else end + 2
+            space = True
+        elif char == '/' and _regex_allowed(out):
+            end = _skip_regex(source, i)
+            emit(source[i:end])
+            i = end
+        elif char == '\n':
+            newline = True
+            i += 1
+        elif char.isspace():
+            space = True
+            i += 1
+        else:
+            emit(char)
+            i += 1
+    return ''.join(out) + '\n'
+
+
+CSS_TOKENS = re.compile(r'(/\*![\s\S]*?\*/)|/\*[\s\S]*?\*/|("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')'
+                        r'|(\s+)|([^\s"\'/]+|/)')
+
+
+def minify_css(source):
+    out = []
+    for match in CSS_TOKENS.finditer(source):
+        banner, string, space, code = match.groups()
+        if banner or string:
+            out.append(banner or string)
+        elif space:
+            out.append(' ')
+        elif code:
+            out.append(code)
+    text = ''.join(out)
+    # Пробел перед «:» не трогаем: в селекторе «a :hover» он значимый
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    text = re.sub(r':\s+', ':', text)
+    return text.replace(';}', '}').strip() + '\n'
+
+
+PRESERVE_HTML = re.compile(r'(<(pre|textarea)\b[\s\S]*?</\2>)', re.IGNORECASE)
+
+
+def minify_html(source):
+    parts = []
+    for i, part in enumerate(PRESERVE_HTML.split(source)):
+        if i % 3 == 1:
+            parts.append(part)
+        elif i % 3 == 0:
+            part = re.sub(r'<!--(?!\[)[\s\S]*?-->', '', part)
+            parts.append('\n'.join(line.strip() for line in part.splitlines() if line.strip()))
+    return ''.join(parts) + '\n'
+
+
+# --- сборка --------------------------------------------------------------
+
+def fingerprint(name, data):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def download(url, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with urllib.request.urlopen(url, timeout=30) as response:
+        data = response.read()
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+    return data
+
+
+def vendored(vendor_dir, name, url, allow_cdn=False):
+    """Содержимое файла из ``vendor/``; скачивает при первой сборке.
+
+    Без сети — SystemExit, с ``allow_cdn`` — None (остаётся ссылка на CDN).
+    """
+    path = os.path.join(vendor_dir, name)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    try:
+        logger.info('⬇️ Скачиваю %s', url)
+        return download(url, path)
+    except OSError as exc:
+        if not allow_cdn:
+            raise SystemExit(f'Нет {path} и не удалось скачать {url}: {exc}. '
+                             f'Положите файл в {vendor_dir} или соберите с --allow-cdn')
+        logger.warning('⚠️ Не удалось скачать %s: %s — остаётся ссылка на CDN', url, exc)
+        return None
+
+
+def strip_source_map(data):
+    return re.sub(rb'\n?/[/*]# sourceMappingURL=[^\n]*', b'', data)
+
+
+class Build:
+    def __init__(self, out_dir, vendor_dir, allow_cdn=False):
+        self.out_dir = out_dir
+        self.vendor_dir = vendor_dir
+        self.allow_cdn = allow_cdn
+        self.manifest = {}
+        self.sizes = []
+        os.makedirs(os.path.join(out_dir, ASSETS_PREFIX), exist_ok=True)
+
+    def emit(self, name, data, original_size=None, hashed=True):
+        """Пишет файл (с хешем в имени) и сжатые варианты; возвращает URL."""
+        output = ASSETS_PREFIX + fingerprint(name, data) if hashed else name
+        path = os.path.join(self.out_dir, output)
+        with open(path, 'wb') as f:
+            f.write(data)
+        row = [output, original_size or len(data), len(data), None, None]
+        if output.endswith(COMPRESSIBLE):
+            variants = [('.gz', 3, gzip.compress(data, 9, mtime=0))]
+            if brotli is not None:
+                variants.append(('.br', 4, brotli.compress(data, quality=11)))
+            for suffix, column, compressed in variants:
+                if len(compressed) < len(data):
+                    with open(path + suffix, 'wb') as f:
+                        f.write(compressed)
+                    row[column] = len(compressed)
+        self.manifest[name] = output
+        self.sizes.append(row)
+        return output
+
+    def vendor_css(self, name, url, data):
+        """CSS со скачанными шрифтами: ``url(...)`` указывает на их хешированные копии."""
+        def replace(match):
+            target = match.group(1).strip('\'"')
+            if target.startswith('data:') or target.startswith('#'):
+                return match.group(0)
+            absolute = urllib.parse.urljoin(url, target)
+            path = urllib.parse.urlsplit(absolute)
+            local = os.path.join('webfonts', os.path.basename(path.path))
+            font = vendored(self.vendor_dir, local, absolute.split('#')[0].split('?')[0],
+                            self.allow_cdn)
+            if font is None:
+                return f'url({absolute})'
+            hashed = self.emit(os.path.basename(path.path), font)
+            suffix = f'#{path.fragment}' if path.fragment else ''
+            # CSS и шрифты лежат в одном каталоге
+            return f'url({os.path.basename(hashed)}{suffix})'
+
+        text = strip_source_map(data).decode()
+        return re.sub(r'url\(([^)]+)\)', replace, text).encode()
+
+    def run(self, api_base=None):
+        with open(os.path.join(ROOT, 'index.html'), encoding='utf-8') as f:
+            html = f.read()
+        with open(os.path.join(ROOT, 'app.js'), encoding='utf-8') as f:
+            script = f.read()
+
+        for name, url in VENDOR:
+            data = vendored(self.vendor_dir, name, url, self.allow_cdn)
+            if data is None:
+                continue
+            if name.endswith('.css'):
+                data = self.vendor_css(name, url, data)
+            else:
+                data = strip_source_map(data)
+            html = html.replace(url, self.emit(name, data))
+
+        style = re.search(r'<style>([\s\S]*?)</style>', html)
+        if style:
+            css = minify_css(style.group(1)).encode()
+            output = self.emit('app.css', css, len(style.group(1).encode()))
+            html = html.replace(style.group(0), f'<link href="{output}" rel="stylesheet">')
+
+        if api_base is not None:
+            script, count = re.subn(r"this\.apiBase = '[^']*';",
+                                    f'this.apiBase = {json.dumps(api_base)};', script)
+            if not count:
+                raise SystemExit('В app.js не найден this.apiBase')
+        output = self.emit('app.js', minify_js(script).encode(), len(script.encode()))
+        html = html.replace('<script src="app.js">', f'<script src="{output}">')
+
+        self.emit('index.html', minify_html(html).encode(), len(html.encode()), hashed=False)
+        with open(os.path.join(self.out_dir, 'manifest.json'), 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+
+
+def build(out_dir='dist', vendor_dir=None, api_base=None, allow_cdn=False):
+    result = Build(out_dir, vendor_dir or os.path.join(ROOT, 'vendor'), allow_cdn)
+    result.run(api_base)
+    return result
+
+
+# --- раздача -------------------------------------------------------------
+
+def send(directory, name, cache_control):
+    path = safe_join(directory, name)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    encodings = request.accept_encodings
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encodings[encoding] and os.path.isfile(path + suffix):
+            response = send_file(path + suffix, mimetype=mimetype, conditional=True)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_file(path, mimetype=mimetype, conditional=True)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def send_index(directory):
+    return send(directory, 'index.html', 'no-cache')
+
+
+def init_app(app, directory):
+    directory = os.path.abspath(directory)
+    if not os.path.isfile(os.path.join(directory, 'index.html')):
+        raise RuntimeError(f'В {directory} нет сборки: запустите python assets.py --out {directory}')
+
+    @app.get('/assets/<name>')
+    def static_asset(name):
+        return send(os.path.join(directory, ASSETS_PREFIX), name, IMMUTABLE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сборка статики клиента')
+    parser.add_argument('--out', default='dist')
+    parser.add_argument('--vendor-dir', help='кэш скачанных библиотек (по умолчанию vendor/)')
+    parser.add_argument('--api-base', help="адрес API для app.js; '' — тот же origin")
+    parser.add_argument('--allow-cdn', action='store_true',
+                        help='без скачанных библиотек оставить ссылки на CDN, а не падать')
+    args = parser.parse_args()
+    logging.basicConfig(level='INFO', format='%(message)s')
+
+    result = build(args.out, args.vendor_dir, args.api_base, args.allow_cdn)
+    print(f'{"файл":>44} {"исходный":>9} {"итог":>8} {"gzip":>8} {"brotli":>8}')
+    for output, original, size, gz, br in result.sizes:
+        print(f'{output:>44} {original:>9} {size:>8} {gz or "-":>8} {br or "-":>8}')
+    if brotli is None:
+        print('brotli не установлен — собраны только .gz', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
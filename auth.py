@@ -0,0 +1,139 @@
+"""Выпуск и проверка JWT.
+
+Проверенные токены кэшируются в ограниченном LRU до момента истечения, так
+что повторные запросы с тем же Bearer-токеном не платят за HMAC и разбор
+JSON. Подписывающих ключей может быть несколько: новый ключ становится
+активным для выпуска, а старые продолжают принимать ранее выданные токены.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import jwt
+
+JWT_ALGORITHM = 'HS256'
+
+
+class KeyRing:
+    """Набор HMAC-ключей по ``kid`` и активный ключ для выпуска."""
+
+    def __init__(self, keys, active_kid=None):
+        if not keys:
+            raise ValueError('Нужен хотя бы один ключ подписи')
+        self._keys = dict(keys)
+        self.active_kid = active_kid or next(iter(self._keys))
+        if self.active_kid not in self._keys:
+            raise ValueError(f'Активный ключ {self.active_kid} не найден')
+
+    @classmethod
+    def from_env(cls):
+        """``JWT_KEYS=kid1:secret1,kid2:secret2`` и ``JWT_ACTIVE_KID``.
+
+        Без ``JWT_KEYS`` используется одиночный ``JWT_SECRET``.
+        """
+        raw = os.environ.get('JWT_KEYS')
+        if raw:
+            keys = dict(item.split(':', 1) for item in raw.split(',') if item)
+        else:
+            keys = {'default': os.environ.get('JWT_SECRET', 'dev-secret-change-me')}
+        return cls(keys, os.environ.get('JWT_ACTIVE_KID'))
+
+    def get(self, kid):
+        return self._keys.get(kid)
+
+    def signing_key(self):
+        return self.active_kid, self._keys[self.active_kid]
+
+    def add(self, kid, secret, activate=False):
+        self._keys[kid] = secret
+        if activate:
+            self.active_kid = kid
+
+    def remove(self, kid):
+        if kid == self.active_kid:
+            raise ValueError('Нельзя удалить активный ключ')
+        self._keys.pop(kid, None)
+
+    def __contains__(self, kid):
+        return kid in self._keys
+
+    def __iter__(self):
+        return iter(list(self._keys.items()))
+
+
+class TokenCache:
+    """LRU проверенных токенов: token -> (kid, claims, exp)."""
+
+    def __init__(self, maxsize=10_000):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, token, now=None):
+        now = now or time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[2] <= now:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return entry
+
+    def put(self, token, kid, claims):
+        with self._lock:
+            self._entries[token] = (kid, claims, claims['exp'])
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TokenAuthority:
+    def __init__(self, keyring, ttl, cache_size=10_000):
+        self.keyring = keyring
+        self.ttl = ttl
+        self.cache = TokenCache(cache_size)
+
+    def issue(self, user_id):
+        kid, secret = self.keyring.signing_key()
+        now = datetime.now(timezone.utc)
+        payload = {
+            'sub': user_id,
+            'iat': now,
+            'exp': now + timedelta(seconds=self.ttl),
+        }
+        return jwt.encode(payload, secret, algorithm=JWT_ALGORITHM, headers={'kid': kid})
+
+    def verify(self, token):
+        """Claims проверенного токена; ``jwt.PyJWTError`` если он невалиден."""
+        cached = self.cache.get(token)
+        if cached is not None:
+            kid, claims, _ = cached
+            # Отозванный ключ инвалидирует и закэшированные токены
+            if kid in self.keyring:
+                return claims
+
+        kid = jwt.get_unverified_header(token).get('kid')
+        candidates = [(kid, self.keyring.get(kid))] if kid else list(self.keyring)
+        for candidate_kid, secret in candidates:
+            if secret is None:
+                continue
+            try:
+                claims = jwt.decode(token, secret, algorithms=[JWT_ALGORITHM],
+                                    options={'require': ['exp', 'sub']})
+            except jwt.InvalidSignatureError:
+                continue
+            self.cache.put(token, candidate_kid, claims)
+            return claims
+        raise jwt.InvalidSignatureError('Подпись не совпадает ни с одним ключом')
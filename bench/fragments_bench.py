@@ -0,0 +1,92 @@
+"""Сериализация страницы сделок: ``jsonify`` против кэша фрагментов.
+
+    python bench/fragments_bench.py --deals 20000 --limit 100 --requests 2000
+
+Заполняет хранилище в памяти сделками одного продавца и гоняет страницы
+``list_by_owner`` с рублёвым эквивалентом, как ``/api/deals/my``. Время —
+процессорное на один список: только проекция и кодирование, без сети и
+авторизации. «Холодный» кэш пуст перед каждой страницей, «тёплый» заполнен
+предыдущими проходами — обычный случай для крупного аккаунта, который
+перелистывает одни и те же неизменные сделки.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify  # noqa: E402
+
+import fragments  # noqa: E402
+from fragments import FragmentCache  # noqa: E402
+from store import PAYMENT_METHODS, DealStore, project  # noqa: E402
+
+WORDS = ('продаю', 'звёзды', 'подарок', 'аккаунт', 'канал', 'юзернейм', 'nft', 'срочно')
+
+
+def add_amount_rub(records):
+    for record in records:
+        record['amount_rub'] = round(record['amount'] * 250, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--deals', type=int, default=20_000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=2_000)
+    parser.add_argument('--fields', default='', help='проекция, как ?fields=')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    deals = DealStore()
+    for _ in range(args.deals):
+        deals.create('seller', round(rng.uniform(1, 5000), 2),
+                     ' '.join(rng.choices(WORDS, k=rng.randint(3, 10))),
+                     rng.choice(PAYMENT_METHODS))
+    cursors = [None]
+    while len(cursors) * args.limit < args.deals:
+        cursors.append(deals.list_by_owner('seller', args.limit, cursors[-1])[1])
+    fields = [f for f in args.fields.split(',') if f] or None
+    app = Flask(__name__)
+
+    def page(i):
+        records, _ = deals.list_by_owner('seller', args.limit, cursors[i % len(cursors)])
+        add_amount_rub(records)
+        return records
+
+    def plain(records, cache):
+        return jsonify([project(r, fields) for r in records]).get_data()
+
+    def cached(records, cache):
+        return app.response_class(cache.encode(records, fields, ('amount_rub',))).get_data()
+
+    def cold(records, cache):
+        cache.clear()
+        return cached(records, cache)
+
+    encoder = 'orjson' if fragments.orjson is not None else 'json'
+    print(f'{args.deals:,} сделок, страница {args.limit}, кодировщик {encoder}')
+    print(f'{"вариант":>18} {"мкс/список":>11} {"к jsonify":>10}')
+    baseline = None
+    with app.app_context():
+        for name, encode in (('jsonify', plain), ('фрагменты, холодный', cold),
+                             ('фрагменты, тёплый', cached)):
+            cache = FragmentCache()
+            for i in range(len(cursors)):
+                encode(page(i), cache)
+            elapsed = 0.0
+            for i in range(args.requests):
+                records = page(i)
+                started = time.process_time()
+                encode(records, cache)
+                elapsed += time.process_time() - started
+            per_request = elapsed / args.requests * 1e6
+            baseline = baseline or per_request
+            print(f'{name:>18} {per_request:>11.0f} {per_request / baseline:>9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
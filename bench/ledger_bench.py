@@ -0,0 +1,79 @@
+"""Пропускная способность расчётов по сделкам в Ledger.
+
+    python bench/ledger_bench.py --deals 50000 --workers 1 2 4 8
+
+Для каждого числа воркеров (потоков) рассчитывает ``--deals`` сделок по
+``--accounts`` счетам, печатает settlements/sec и проверяет итог: каждый
+счёт получил ровно свою сумму, повторные расчёты не прошли, журнал
+сходится со снимками.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import Ledger, account_key, to_minor  # noqa: E402
+
+
+def make_deals(count, accounts):
+    return [{
+        'id': f'd{i}',
+        'user_id': f'u{i % accounts}',
+        'amount': 1 + (i % 7),
+        'payment_method': 'ton',
+    } for i in range(count)]
+
+
+def run(deals, workers, shards, accounts):
+    ledger = Ledger(shards=shards, snapshot_every=5_000)
+    chunks = [deals[i::workers] for i in range(workers)]
+    barrier = threading.Barrier(workers + 1)
+
+    def worker(chunk):
+        barrier.wait()
+        for deal in chunk:
+            ledger.settle_deal(deal)
+        # Повторная доставка того же события не должна двигать балансы
+        for deal in chunk[:100]:
+            ledger.settle_deal(deal)
+
+    threads = [threading.Thread(target=worker, args=(c,)) for c in chunks]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    expected = {}
+    for deal in deals:
+        key = account_key(deal['user_id'], deal['payment_method'])
+        expected[key] = expected.get(key, 0) + to_minor(deal['amount'])
+    ok = ledger.verify() and all(ledger.balance(k) == v for k, v in expected.items())
+    return len(deals) / elapsed, ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--deals', type=int, default=50_000)
+    parser.add_argument('--accounts', type=int, default=1_000)
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    deals = make_deals(args.deals, args.accounts)
+    print(f'{"workers":>8} {"settlements/s":>14} {"correct":>8}')
+    for workers in args.workers:
+        rate, ok = run(deals, workers, args.shards, args.accounts)
+        print(f'{workers:>8} {rate:>14,.0f} {"yes" if ok else "NO":>8}')
+        if not ok:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+"""Нагрузочный тест API под gunicorn со смешанным трафиком.
+
+    python bench/seed.py /tmp/otc.db --deals 2000000
+    python bench/load_test.py --db /tmp/otc.db --users 50 --duration 60 --save base.json
+    python bench/load_test.py --db /tmp/otc.db --users 50 --duration 60 --baseline base.json
+
+Поднимает ``gunicorn api:app`` с ``gunicorn.conf.py`` на SQLite-базе из
+``bench/seed.py``. Без ``--db`` сначала сеет небольшую базу во временный
+каталог. ``--users`` виртуальных пользователей (поток и keep-alive
+соединение на каждого) логинятся под ``bench<N>``, затем шлют запросы
+по весам ``--mix``. Каждый запрос выбирается случайно, без пауз между
+запросами.
+
+Печатает RPS, p50/p95/p99 и долю ошибок по операциям, а ещё RSS и PSS
+каждого воркера: пик за прогон и значение в конце. PSS честнее делит
+общие с мастером страницы. С ``--save`` результат пишется в JSON, а
+``--baseline`` сравнивает прогон с сохранённым.
+
+Клиент — тоже Python и делит CPU с сервером. На одной машине абсолютные
+цифры занижены, поэтому сравнивать стоит прогоны с одинаковыми
+параметрами.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from seed import PASSWORD, login_of, seed  # noqa: E402
+
+DEFAULT_MIX = 'login=2,profile=30,create_deal=10,my_deals=50,create_ticket=8'
+PERCENTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+
+
+def parse_mix(spec):
+    mix = {}
+    for item in spec.split(','):
+        if item.strip():
+            name, _, weight = item.partition('=')
+            mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f'Неизвестные операции: {", ".join(sorted(unknown))}')
+    return mix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float('nan')
+
+
+class Client:
+    """Виртуальный пользователь: одно keep-alive соединение."""
+
+    def __init__(self, port, login, rng):
+        self.port = port
+        self.user_login = login
+        self.rng = rng
+        self.token = None
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+    def call(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        data = json.dumps(body) if body is not None else None
+        try:
+            self.conn.request(method, path, data, headers)
+            response = self.conn.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            # Сервер закрыл соединение — следующий запрос откроет новое
+            self.conn.close()
+            return 0, b''
+        return response.status, payload
+
+    def login(self):
+        status, payload = self.call('POST', '/api/login',
+                                    {'login': self.user_login, 'password': PASSWORD})
+        if status == 200:
+            self.token = json.loads(payload)['token']
+        return status
+
+    def profile(self):
+        return self.call('GET', '/api/profile')[0]
+
+    def create_deal(self):
+        return self.call('POST', '/api/deals', {
+            'amount': round(self.rng.uniform(1, 5000), 2),
+            'description': 'Нагрузочный тест: продаю звёзды',
+            'payment_method': self.rng.choice(('ton', 'sbp', 'stars')),
+        })[0]
+
+    def my_deals(self):
+        return self.call('GET', '/api/deals/my?limit=20')[0]
+
+    def bootstrap(self):
+        return self.call('GET', '/api/bootstrap?limit=20')[0]
+
+    def create_ticket(self):
+        return self.call('POST', '/api/tickets', {
+            'subject': 'Нагрузочный тест', 'message': 'Проверка создания тикета'})[0]
+
+
+OPERATIONS = ('login', 'profile', 'create_deal', 'my_deals', 'create_ticket', 'bootstrap')
+
+
+def worker_pids(master):
+    try:
+        with open(f'/proc/{master}/task/{master}/children') as f:
+            return [int(pid) for pid in f.read().split()]
+    except OSError:
+        return []
+
+
+def memory_of(pid):
+    """(RSS, PSS) в МБ; PSS — из smaps_rollup, если ядро его отдаёт."""
+    rss = pss = None
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) / 1024
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    pss = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return rss, pss
+
+
+def start_server(args, db, port, tmp):
+    worker_class = args.worker_class
+    if worker_class is None:
+        try:
+            import gevent  # noqa: F401
+            worker_class = 'gevent'
+        except ImportError:
+            worker_class = 'gthread'
+    env = dict(os.environ, STORAGE_URL=f'sqlite:///{db}', PORT=str(port),
+               WEB_CONCURRENCY=str(args.workers), GUNICORN_WORKER_CLASS=worker_class,
+               RATELIMIT_ENABLED='0', SEED_TEST_USER='0', DEAL_TTL='0', LOG_LEVEL='WARNING',
+               OUTBOX_PATH=os.path.join(tmp, 'outbox.sqlite3'),
+               METRICS_PATH=os.path.join(tmp, 'metrics'), LEDGER_DIR=tmp, RATES='ton=250,stars=1.5')
+    command = [sys.executable, '-m', 'gunicorn', 'api:app', '-c', 'gunicorn.conf.py',
+               '--bind', f'127.0.0.1:{port}']
+    if worker_class == 'gthread':
+        command += ['--threads', str(args.threads)]
+    server = subprocess.Popen(command, cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Воркеры на большой базе стартуют долго: пересчёт статистики при импорте
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit('gunicorn завершился при старте')
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        try:
+            conn.request('GET', '/')
+            if conn.getresponse().status == 200 and len(worker_pids(server.pid)) >= args.workers:
+                return server, worker_class
+        except OSError:
+            pass
+        finally:
+            conn.close()
+        time.sleep(0.5)
+    server.terminate()
+    raise SystemExit('gunicorn не поднялся за отведённое время')
+
+
+def run(args, mix, port, server):
+    stop = threading.Event()
+    measuring = threading.Event()
+    names, weights = list(mix), list(mix.values())
+    results = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+
+    def virtual_user(index):
+        rng = random.Random(args.seed * 1000 + index)
+        client = Client(port, login_of(index % args.seeded_users), rng)
+        client.login()
+        local = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        while not stop.is_set():
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            status = getattr(client, name)()
+            elapsed = time.perf_counter() - started
+            if measuring.is_set():
+                local[name].append(elapsed)
+                if not 200 <= status < 400:
+                    local_errors[name] += 1
+        client.conn.close()
+        with lock:
+            for name in names:
+                results[name] += local[name]
+                errors[name] += local_errors[name]
+
+    memory = {}
+
+    def sample_memory():
+        while not stop.wait(1.0):
+            for pid in worker_pids(server.pid):
+                rss, pss = memory_of(pid)
+                peak = memory.setdefault(pid, {'rss_peak': 0.0, 'pss_peak': 0.0})
+                peak['rss_peak'] = max(peak['rss_peak'], rss or 0.0)
+                peak['pss_peak'] = max(peak['pss_peak'], pss or 0.0)
+
+    threads = [threading.Thread(target=virtual_user, args=(i,)) for i in range(args.users)]
+    threads.append(threading.Thread(target=sample_memory))
+    for thread in threads:
+        thread.start()
+    time.sleep(args.warmup)
+    measuring.set()
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    report = {'operations': {}, 'workers': []}
+    everything = []
+    for name in names:
+        timings = sorted(results[name])
+        everything += timings
+        report['operations'][name] = summarize(timings, errors[name], elapsed)
+    everything.sort()
+    report['total'] = summarize(everything, sum(errors.values()), elapsed)
+    for pid in worker_pids(server.pid):
+        rss, pss = memory_of(pid)
+        report['workers'].append(dict(pid=pid, rss=rss, pss=pss, **memory.get(pid, {})))
+    return report
+
+
+def summarize(timings, error_count, elapsed):
+    summary = {'requests': len(timings), 'rps': len(timings) / elapsed,
+               'errors': error_count / len(timings) * 100 if timings else 0.0}
+    for key, p in PERCENTILES:
+        summary[key] = percentile(timings, p) * 1000
+    return summary
+
+
+def delta(current, previous):
+    if not previous:
+        return ''
+    return f'{(current - previous) / previous * 100:+.0f}%'
+
+
+def print_report(report, baseline):
+    print(f'{"операция":>14} {"запросов":>9} {"RPS":>8} {"p50 мс":>8} {"p95 мс":>8} '
+          f'{"p99 мс":>8} {"ошибки %":>9}' + (f' {"ΔRPS":>6} {"Δp99":>6}' if baseline else ''))
+    rows = list(report['operations'].items()) + [('всего', report['total'])]
+    for name, r in rows:
+        line = (f'{name:>14} {r["requests"]:>9} {r["rps"]:>8.1f} {r["p50"]:>8.1f} '
+                f'{r["p95"]:>8.1f} {r["p99"]:>8.1f} {r["errors"]:>9.2f}')
+        if baseline:
+            before = baseline['total'] if name == 'всего' else baseline['operations'].get(name)
+            if before:
+                line += f' {delta(r["rps"], before["rps"]):>6} {delta(r["p99"], before["p99"]):>6}'
+        print(line)
+    print(f'\n{"воркер":>8} {"RSS МБ":>8} {"пик":>8} {"PSS МБ":>8} {"пик":>8}')
+    for w in report['workers']:
+        print(f'{w["pid"]:>8} {w["rss"] or 0:>8.1f} {w.get("rss_peak", 0):>8.1f} '
+              f'{w["pss"] or 0:>8.1f} {w.get("pss_peak", 0):>8.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', help='SQLite-база из bench/seed.py; без неё — маленькая временная')
+    parser.add_argument('--seeded-users', type=int, default=1000,
+                        help='сколько пользователей bench<N> есть в базе')
+    parser.add_argument('--users', type=int, default=20, help='виртуальных пользователей')
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--worker-class', help='по умолчанию gevent, если установлен, иначе gthread')
+    parser.add_argument('--threads', type=int, default=8, help='потоков на gthread-воркер')
+    parser.add_argument('--startup-timeout', type=float, default=600)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='записать результат в JSON')
+    parser.add_argument('--baseline', help='сравнить с ранее сохранённым JSON')
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    tmp = tempfile.mkdtemp()
+    db = args.db
+    if db is None:
+        db = os.path.join(tmp, 'otc.db')
+        print('сею временную базу…')
+        seed(db, args.seeded_users, 50_000, 10_000)
+
+    port = free_port()
+    server, worker_class = start_server(args, db, port, tmp)
+    try:
+        report = run(args, mix, port, server)
+    finally:
+        server.terminate()
+        server.wait()
+
+    report['config'] = {
+        'users': args.users, 'duration': args.duration, 'mix': mix, 'workers': args.workers,
+        'worker_class': worker_class, 'db_size_mb': round(os.path.getsize(db) / 2**20),
+        'python': platform.python_version(), 'cpus': os.cpu_count(),
+        'at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config', {}).get('mix') != mix:
+            print('⚠️ Смесь запросов в базовом прогоне другая — сравнение условное')
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Задержка логина и пропускная способность ``/api/profile`` во время волны логинов.
+
+    python bench/login_bench.py --duration 10 --logins 8 --readers 8
+
+Для каждого режима (пароль в пуле процессов и прямо в воркере) поднимает
+приложение на многопоточном werkzeug-сервере, параллельно шлёт логины и
+чтения профиля и печатает p50/p99 логина, долю 503 и запросы профиля в
+секунду.
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER = '''
+import sys
+from werkzeug.serving import make_server
+import api
+make_server('127.0.0.1', int(sys.argv[1]), api.app, threaded=True).serve_forever()
+'''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def call(url, body=None, token=None):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.read()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float('nan')
+
+
+def run_mode(workers, args):
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPATH=ROOT, HASHING_WORKERS=str(workers),
+               HASHING_MAX_PENDING=str(args.max_pending), RATELIMIT_ENABLED='0',
+               OUTBOX_PATH=os.path.join(tmp, 'outbox.sqlite3'), LOG_LEVEL='WARNING')
+    server = subprocess.Popen([sys.executable, '-c', SERVER, str(port)], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                call(base + '/')
+                break
+            except OSError:
+                time.sleep(0.1)
+        credentials = {'login': 'testuser', 'password': 'testpass123'}
+        # Прогрев: пул процессов стартует лениво
+        token = json.loads(call(base + '/api/login', credentials)[1])['token']
+
+        stop = threading.Event()
+        latencies, shed, profile_count = [], [0], [0]
+        lock = threading.Lock()
+
+        def login_loop():
+            while not stop.is_set():
+                started = time.perf_counter()
+                status, _ = call(base + '/api/login', credentials)
+                with lock:
+                    if status == 503:
+                        shed[0] += 1
+                    else:
+                        latencies.append(time.perf_counter() - started)
+
+        def profile_loop():
+            while not stop.is_set():
+                call(base + '/api/profile', token=token)
+                with lock:
+                    profile_count[0] += 1
+
+        threads = ([threading.Thread(target=login_loop) for _ in range(args.logins)]
+                   + [threading.Thread(target=profile_loop) for _ in range(args.readers)])
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    total = len(latencies) + shed[0]
+    return {
+        'p50': percentile(latencies, 0.5) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'logins': len(latencies) / args.duration,
+        'shed': shed[0] / total * 100 if total else 0.0,
+        'profile': profile_count[0] / args.duration,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--logins', type=int, default=8, help='потоков логина')
+    parser.add_argument('--readers', type=int, default=8, help='потоков /api/profile')
+    parser.add_argument('--workers', type=int, default=2, help='процессов в пуле хеширования')
+    parser.add_argument('--max-pending', type=int, default=64)
+    args = parser.parse_args()
+
+    print(f'{"режим":>10} {"login p50 мс":>13} {"p99 мс":>8} {"логинов/с":>10} '
+          f'{"503 %":>6} {"profile/с":>10}')
+    for name, workers in (('inline', 0), (f'pool×{args.workers}', args.workers)):
+        r = run_mode(workers, args)
+        print(f'{name:>10} {r["p50"]:>13.1f} {r["p99"]:>8.1f} {r["logins"]:>10.1f} '
+              f'{r["shed"]:>6.1f} {r["profile"]:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
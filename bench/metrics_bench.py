@@ -0,0 +1,54 @@
+"""Накладные расходы метрик на запрос и стоимость ``/metrics``.
+
+    python bench/metrics_bench.py --requests 100000
+
+Гоняет хуки ``Metrics`` внутри контекста запроса маленького Flask-приложения
+(без сети и без самих ручек), затем рендерит выгрузку по заполненному файлу.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, Response  # noqa: E402
+
+from metrics import Metrics  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=100_000)
+    parser.add_argument('--routes', type=int, default=30)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    for i in range(args.routes):
+        app.add_url_rule(f'/r{i}', f'r{i}', lambda: 'ok')
+    metrics = Metrics(os.path.join(tempfile.mkdtemp(), 'metrics'))
+    metrics.init_app(app)
+    response = Response('x' * 512)
+
+    print(f'{"операция":>22} {"мкс":>8}')
+    for name, hooks in (('без метрик', False), ('с метриками', True)):
+        started = time.perf_counter()
+        for i in range(args.requests):
+            with app.test_request_context(f'/r{i % args.routes}'):
+                if hooks:
+                    metrics._before()
+                    metrics._after(response)
+                    metrics._teardown(None)
+        elapsed = (time.perf_counter() - started) / args.requests * 1e6
+        print(f'{name:>22} {elapsed:>8.2f}')
+
+    started = time.perf_counter()
+    text = metrics.render()
+    print(f'{"render /metrics":>22} {(time.perf_counter() - started) * 1e6:>8.0f}'
+          f'  ({len(text.splitlines())} строк)')
+
+
+if __name__ == '__main__':
+    main()
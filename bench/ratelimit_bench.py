@@ -0,0 +1,66 @@
+"""Накладные расходы лимитера на горячем пути.
+
+    python bench/ratelimit_bench.py --keys 10000 --processes 1 2 4
+
+Печатает микросекунды на ``RateLimiter.check`` с двумя ключами (ip и
+пользователь, как в ``api.rate_limit``) в одном процессе, затем суммарную
+пропускную способность при нескольких процессах на общем mmap-файле.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ratelimit import RateLimiter, SharedBuckets, parse_limits  # noqa: E402
+
+LIMITS = parse_limits('read=1000000000/1')
+
+
+def hammer(path, keys, iterations, results):
+    limiter = RateLimiter(SharedBuckets(path), LIMITS)
+    started = time.perf_counter()
+    for i in range(iterations):
+        key = keys[i % len(keys)]
+        limiter.check('read', key[0], key[1])
+    results.put(iterations / (time.perf_counter() - started))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=10_000)
+    parser.add_argument('--iterations', type=int, default=200_000)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    keys = [(f'ip:10.0.{i // 256 % 256}.{i % 256}', f'user:{i}') for i in range(args.keys)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'buckets')
+        limiter = RateLimiter(SharedBuckets(path), LIMITS)
+        started = time.perf_counter()
+        for i in range(args.iterations):
+            key = keys[i % len(keys)]
+            limiter.check('read', key[0], key[1])
+        per_call = (time.perf_counter() - started) / args.iterations * 1e6
+        print(f'check() с двумя ключами: {per_call:.2f} мкс, {per_call / 2:.2f} мкс на корзину')
+
+        print(f'{"processes":>10} {"checks/s":>12}')
+        for count in args.processes:
+            results = multiprocessing.Queue()
+            workers = [multiprocessing.Process(target=hammer,
+                                               args=(path, keys, args.iterations, results))
+                       for _ in range(count)]
+            for worker in workers:
+                worker.start()
+            total = sum(results.get() for _ in workers)
+            for worker in workers:
+                worker.join()
+            print(f'{count:>10} {total:>12,.0f}')
+
+
+if __name__ == '__main__':
+    main()
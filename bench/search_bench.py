@@ -0,0 +1,80 @@
+"""Задержка админского поиска на большом индексе.
+
+    python bench/search_bench.py --docs 1000000 --queries 200
+
+Строит FTS5-индекс из синтетических описаний сделок и тикетов (случайные
+слова из небольшого русского словаря плюс редкие «метки»), затем меряет
+p50/p99 первой страницы для частых, редких и многословных запросов.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import SearchIndex  # noqa: E402
+
+WORDS = ('продаю', 'покупаю', 'срочно', 'обмен', 'звёзды', 'подарок', 'аккаунт',
+         'канал', 'юзернейм', 'скидка', 'оплата', 'перевод', 'карта', 'кошелёк',
+         'спор', 'возврат', 'продавец', 'покупатель', 'гарант', 'сделка', 'рубли',
+         'коллекция', 'стикеры', 'премиум', 'подписка', 'бот', 'токен', 'nft', 'ton')
+
+
+def documents(count, rng):
+    for i in range(count):
+        text = ' '.join(rng.choices(WORDS, k=rng.randint(4, 12)))
+        if i % 10_000 == 0:
+            text += f' метка{i // 10_000}'
+        record = {'id': f'{i:032x}', 'user_id': f'u{i % 5000}', 'status': 'active',
+                  'created_at': '2024-01-01T00:00:00+00:00'}
+        if i % 4:
+            record.update(description=text)
+        else:
+            record.update(subject=' '.join(rng.choices(WORDS, k=3)), message=text)
+        yield record
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=200_000)
+    parser.add_argument('--queries', type=int, default=100)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    path = os.path.join(tempfile.mkdtemp(), 'search.sqlite3')
+    index = SearchIndex(path)
+    started = time.perf_counter()
+    docs = list(documents(args.docs, rng))
+    index.rebuild((d for d in docs if 'description' in d), (d for d in docs if 'subject' in d))
+    print(f'индекс: {args.docs:,} документов за {time.perf_counter() - started:.1f} с, '
+          f'{os.path.getsize(path) / 2**20:.0f} МБ')
+
+    cases = {
+        'редкое слово': lambda: f'метка{rng.randrange(max(1, args.docs // 10_000))}',
+        'частое слово': lambda: rng.choice(WORDS),
+        'два слова': lambda: ' '.join(rng.sample(WORDS, 2)),
+        'три слова + статус': lambda: ' '.join(rng.sample(WORDS, 3)),
+    }
+    print(f'{"запрос":>20} {"p50 мс":>8} {"p99 мс":>8}')
+    for name, make in cases.items():
+        timings = []
+        for _ in range(args.queries):
+            query = make()
+            status = 'active' if 'статус' in name else None
+            started = time.perf_counter()
+            index.search(query, status=status)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f'{name:>20} {percentile(timings, 0.5):>8.2f} {percentile(timings, 0.99):>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
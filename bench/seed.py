@@ -0,0 +1,168 @@
+"""Генератор данных для нагрузочных тестов: SQLite-база с миллионами записей.
+
+    python bench/seed.py /tmp/otc.db --users 10000 --deals 2000000 --tickets 500000
+
+Пишет напрямую в схему ``sqlite_store`` пачками ``executemany`` в больших
+транзакциях — через API миллионы записей создавались бы часами. У всех
+пользователей логин ``bench<N>`` и пароль ``--password``; хеш считается
+один раз и переиспользуется. Повторный запуск по той же базе дописывает
+новых пользователей — нумерация продолжается после последнего ``bench<N>``.
+Id сделок и тикетов строятся из их ``created_at``, как если бы записи
+создавались через API в это время. Сделки и тикеты распределены по
+пользователям неравномерно: у первых пользователей их на порядки больше,
+чем у хвоста, — как у активных продавцов. Статусы в основном конечные,
+``active`` — только у свежих сделок. По умолчанию сразу строится и
+поисковый индекс, иначе его перестраивал бы первый стартовавший воркер.
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite_store  # noqa: E402
+from search import SearchIndex  # noqa: E402
+from store import PAYMENT_METHODS, hash_password, new_id  # noqa: E402
+
+BATCH = 50_000
+PASSWORD = 'benchpass123'
+HISTORY_DAYS = 365
+WORDS = ('продаю', 'покупаю', 'звёзды', 'подарок', 'аккаунт', 'канал', 'юзернейм',
+         'оплата', 'перевод', 'кошелёк', 'гарант', 'коллекция', 'стикеры', 'премиум',
+         'подписка', 'бот', 'токен', 'nft', 'ton', 'срочно')
+SUBJECTS = ('Не пришла оплата', 'Вопрос по сделке', 'Спор с покупателем',
+            'Ошибка в реквизитах', 'Возврат средств')
+
+
+def login_of(index):
+    return f'bench{index}'
+
+
+def owner(rng, user_ids):
+    # Квадрат равномерного — перекос к первым пользователям
+    return user_ids[int(len(user_ids) * rng.random() ** 2)]
+
+
+def timestamps(count, now):
+    """``(id, created_at)`` по возрастанию за последние ``HISTORY_DAYS`` дней."""
+    start = now - timedelta(days=HISTORY_DAYS)
+    step = timedelta(days=HISTORY_DAYS) / max(count, 1)
+    for i in range(count):
+        created_at = start + step * i
+        yield new_id.at(created_at.timestamp()), created_at.isoformat()
+
+
+def seed_users(conn, count, password):
+    password_hash = hash_password(password)
+    now = datetime.now(timezone.utc).isoformat()
+    # В существующей базе продолжаем нумерацию: логины уникальны
+    first = conn.execute(
+        "SELECT COALESCE(MAX(CAST(substr(login, 6) AS INTEGER)) + 1, 0) FROM users "
+        "WHERE login GLOB 'bench[0-9]*'").fetchone()[0]
+    user_ids = [new_id() for _ in range(count)]
+    conn.executemany(
+        'INSERT INTO users (user_id, login, username, password_hash, is_admin, '
+        'successful_deals, ton_wallet, card_details, telegram_chat_id, created_at) '
+        'VALUES (?, ?, ?, ?, 0, 0, NULL, NULL, NULL, ?)',
+        ((user_id, login_of(i), f'Bench {i}', password_hash, now)
+         for i, user_id in enumerate(user_ids, first)))
+    return user_ids
+
+
+def deal_rows(rng, user_ids, count, now):
+    active_from = count - count // 100
+    for i, (record_id, created_at) in enumerate(timestamps(count, now)):
+        if i >= active_from:
+            status = 'active'
+        else:
+            status = rng.choices(('completed', 'cancelled', 'confirmed'), (80, 18, 2))[0]
+        yield (record_id, owner(rng, user_ids), round(rng.uniform(1, 5000), 2),
+               ' '.join(rng.choices(WORDS, k=rng.randint(3, 10))),
+               rng.choice(PAYMENT_METHODS), status, created_at, created_at)
+
+
+def ticket_rows(rng, user_ids, count, now):
+    open_from = count - count // 20
+    for i, (record_id, created_at) in enumerate(timestamps(count, now)):
+        status = 'open' if i >= open_from else rng.choice(('closed', 'closed', 'in_progress'))
+        yield (record_id, owner(rng, user_ids), rng.choice(SUBJECTS),
+               ' '.join(rng.choices(WORDS, k=rng.randint(5, 20))), status, created_at, created_at)
+
+
+def insert(conn, table, columns, rows):
+    """Вставляет записи и строку создания в журнал переходов; возвращает число записей."""
+    sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+    status = columns.index('status')
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            total += _flush(conn, table, sql, status, batch)
+    if batch:
+        total += _flush(conn, table, sql, status, batch)
+    return total
+
+
+def _flush(conn, table, sql, status, batch):
+    conn.execute('BEGIN')
+    conn.executemany(sql, batch)
+    # Журнал начинается с создания, как у записей из API
+    conn.executemany(
+        f'INSERT INTO {table}_transitions (record_id, old_status, new_status, at) '
+        f'VALUES (?, NULL, ?, ?)',
+        ((row[0], row[status], row[-2]) for row in batch))
+    conn.execute('COMMIT')
+    count = len(batch)
+    batch.clear()
+    return count
+
+
+def seed(path, users, deals, tickets, password=PASSWORD, seed_value=42, search=True):
+    rng = random.Random(seed_value)
+    now = datetime.now(timezone.utc)
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.executescript(sqlite_store.SCHEMA)
+    conn.execute('BEGIN')
+    user_ids = seed_users(conn, users, password)
+    conn.execute('COMMIT')
+    insert(conn, 'deals', ('id', 'user_id', 'amount', 'description', 'payment_method',
+                           'status', 'created_at', 'updated_at'),
+           deal_rows(rng, user_ids, deals, now))
+    insert(conn, 'tickets', ('id', 'user_id', 'subject', 'message', 'status',
+                             'created_at', 'updated_at'),
+           ticket_rows(rng, user_ids, tickets, now))
+    conn.close()
+    if search:
+        _, deal_store, ticket_store = sqlite_store.open_stores(path)
+        SearchIndex(path).rebuild(deal_store.iter_all(), ticket_store.iter_all())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='файл SQLite-базы (дописывается, если уже есть)')
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--deals', type=int, default=1_000_000)
+    parser.add_argument('--tickets', type=int, default=200_000)
+    parser.add_argument('--password', default=PASSWORD)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-search', action='store_true', help='не строить поисковый индекс')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    seed(args.path, args.users, args.deals, args.tickets, args.password, args.seed,
+         search=not args.no_search)
+    print(f'{args.users:,} пользователей, {args.deals:,} сделок, {args.tickets:,} тикетов '
+          f'за {time.perf_counter() - started:.1f} с, '
+          f'{os.path.getsize(args.path) / 2**20:.0f} МБ')
+
+
+if __name__ == '__main__':
+    main()
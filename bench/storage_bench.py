@@ -0,0 +1,84 @@
+"""Сравнение бэкендов хранилища на create-deal и list-deals.
+
+    python bench/storage_bench.py --deals 100000 --users 1000
+
+Для каждого бэкенда создаёт ``--deals`` сделок (``--threads`` потоков),
+затем читает первую страницу «моих сделок» случайных пользователей и
+листает одного пользователя до конца. Печатает операции в секунду.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import open_stores  # noqa: E402
+
+
+def timed(func, count, threads=1):
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(n):
+        barrier.wait()
+        for _ in range(n):
+            func()
+
+    pool = [threading.Thread(target=worker, args=(count // threads,)) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    return (count // threads * threads) / (time.perf_counter() - started)
+
+
+def run(url, args):
+    _, deals, _ = open_stores(url)
+    user_ids = [f'user-{i}' for i in range(args.users)]
+    rng = random.Random(1)
+
+    create_rate = timed(
+        lambda: deals.create(rng.choice(user_ids), 10.0, 'Описание сделки', 'ton'),
+        args.deals, args.threads)
+    list_rate = timed(
+        lambda: deals.list_by_owner(rng.choice(user_ids), 20),
+        args.reads, args.threads)
+
+    started = time.perf_counter()
+    pages, cursor = 0, None
+    while True:
+        _, cursor = deals.list_by_owner(user_ids[0], 20, cursor)
+        pages += 1
+        if cursor is None:
+            break
+    walk_ms = (time.perf_counter() - started) * 1000
+    return create_rate, list_rate, pages, walk_ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--deals', type=int, default=50_000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--reads', type=int, default=20_000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            'memory': 'memory://',
+            'sqlite': f'sqlite:///{os.path.join(tmp, "bench.db")}',
+        }
+        print(f'{"backend":>8} {"create/s":>10} {"list/s":>10} {"walk pages":>11} {"walk ms":>9}')
+        for name, url in backends.items():
+            create_rate, list_rate, pages, walk_ms = run(url, args)
+            print(f'{name:>8} {create_rate:>10,.0f} {list_rate:>10,.0f} {pages:>11} {walk_ms:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
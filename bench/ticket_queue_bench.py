@@ -0,0 +1,127 @@
+"""Нагрузочная проверка очереди тикетов: много агентов на одном файле.
+
+    python bench/ticket_queue_bench.py --tickets 100000 --processes 4 --agents 8
+
+Процессы — как воркеры gunicorn, потоки внутри — как одновременные запросы
+агентов. Все разбирают общую очередь через ``claim`` и сразу закрывают
+тикет. После прогона проверяется, что каждый тикет выдан ровно одному
+агенту; печатается пропускная способность и задержка ``claim`` на разных
+размерах очереди — она не должна расти вместе с очередью. Последняя
+строка — прогон с брошенными арендами: часть агентов «уходит», не
+закрыв тикет, и тикет достаётся другим после истечения срока.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import TicketStore, new_id  # noqa: E402
+from workqueue import TicketQueue  # noqa: E402
+
+
+def fill(path, count):
+    queue = TicketQueue(path, TicketStore())
+    conn = queue._connect()
+    conn.execute('BEGIN')
+    conn.executemany('INSERT INTO ticket_queue (ticket_id, priority) VALUES (?, ?)',
+                     ((new_id(), i % 3) for i in range(count)))
+    conn.execute('COMMIT')
+
+
+def agent(queue, name, claims, abandon_every, lease, results):
+    latencies = []
+    taken = []
+    for i in range(claims):
+        started = time.perf_counter()
+        claimed = queue.claim(name, lease)
+        latencies.append(time.perf_counter() - started)
+        if claimed is None:
+            break
+        if abandon_every and i % abandon_every == 0:
+            continue   # бросили тикет: вернётся в очередь по истечении аренды
+        taken.append(claimed[0])
+        queue.remove(claimed[0])
+    results.append((taken, latencies))
+
+
+def worker(path, index, threads, claims, abandon_every, lease, out):
+    queue = TicketQueue(path, TicketStore())
+    results = []
+    pool = [threading.Thread(target=agent,
+                             args=(queue, f'agent-{index}-{i}', claims, abandon_every, lease, results))
+            for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    out.put(results)
+
+
+def run(path, processes, threads, claims, abandon_every=0, lease=600):
+    out = multiprocessing.Queue()
+    started = time.perf_counter()
+    procs = [multiprocessing.Process(target=worker,
+                                     args=(path, i, threads, claims, abandon_every, lease, out))
+             for i in range(processes)]
+    for proc in procs:
+        proc.start()
+    results = [item for _ in procs for item in out.get()]
+    for proc in procs:
+        proc.join()
+    elapsed = time.perf_counter() - started
+    taken = [ticket for tickets, _ in results for ticket in tickets]
+    latencies = sorted(lat for _, lats in results for lat in lats)
+    return taken, latencies, elapsed
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] * 1e3 if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tickets', type=int, default=100_000,
+                        help='максимальный размер очереди')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--agents', type=int, default=8, help='потоков-агентов на процесс')
+    parser.add_argument('--claims', type=int, default=200, help='тикетов на агента')
+    args = parser.parse_args()
+
+    agents = args.processes * args.agents
+    print(f'{agents} агентов ({args.processes} процессов × {args.agents} потоков)')
+    print(f'{"очередь":>10} {"выдано":>8} {"claim/с":>9} {"p50 мс":>8} {"p99 мс":>8} {"повторы":>8}')
+    sizes = sorted({min(args.tickets, n) for n in (1_000, 10_000, args.tickets)})
+    for size in sizes:
+        path = os.path.join(tempfile.mkdtemp(), 'queue.sqlite3')
+        fill(path, size)
+        taken, latencies, elapsed = run(path, args.processes, args.agents, args.claims)
+        duplicates = len(taken) - len(set(taken))
+        print(f'{size:>10,} {len(taken):>8,} {len(latencies) / elapsed:>9.0f} '
+              f'{percentile(latencies, 0.5):>8.2f} {percentile(latencies, 0.99):>8.2f} '
+              f'{duplicates:>8}')
+        assert not duplicates, 'тикет выдан двум агентам'
+
+    # Каждый пятый тикет бросают с арендой 0.2 с: он должен достаться кому-то ещё
+    size = min(args.tickets, 1_000)
+    path = os.path.join(tempfile.mkdtemp(), 'queue.sqlite3')
+    fill(path, size)
+    taken, latencies, elapsed = run(path, args.processes, args.agents,
+                                    claims=size, abandon_every=5, lease=0.2)
+    queue = TicketQueue(path, TicketStore())
+    while queue.counts()['leased']:
+        time.sleep(0.1)
+    leftover, _, _ = run(path, 1, 1, claims=size)
+    done = len(set(taken) | set(leftover))
+    print(f'{"брошенные":>10} {done:>8,} из {size:,}, без повторов: '
+          f'{len(taken) + len(leftover) == done}')
+    assert done == size, 'брошенные тикеты потерялись'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Pub/sub для SSE-потока ``/api/events``.
+
+Подписки живут в памяти воркера. С ``memory://`` этого достаточно: данные
+и так не покидают процесс, событие публикуется прямо в ``EventBus``. С
+общим хранилищем событие пишется в таблицу ``events`` той же транзакцией,
+что и смена статуса, а ``EventRelay`` в каждом воркере читает новые строки
+по ``seq`` и раздаёт их своим подписчикам — смену статуса в одном воркере
+(админ, автоотмена) видят клиенты, подключённые к любому другому, с
+задержкой до ``poll_interval``. Старые строки удаляются через
+``retention``. Держать тысячи простаивающих соединений рассчитано на
+gevent-воркеры gunicorn (см. ``gunicorn.conf.py``): ожидание очереди там
+кооперативное.
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger('magante.events')
+
+KEEPALIVE_INTERVAL = 15
+SUBSCRIBER_QUEUE_SIZE = 100
+RELAY_POLL_INTERVAL = 0.5
+RELAY_BATCH = 1000
+RELAY_RETENTION = 3600
+RELAY_PURGE_INTERVAL = 60
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_by_time ON events (at);
+'''
+
+
+class Subscription:
+    def __init__(self, bus, user_id, maxsize):
+        self.bus = bus
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Медленный клиент: вместо роста очереди просим его перезагрузить списки
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self, user_id, self.queue_size)
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id, name, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.put((name, data))
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+
+class EventRelay(threading.Thread):
+    """Доставляет события из общей таблицы ``events`` в локальный ``EventBus``."""
+
+    def __init__(self, pool, bus, poll_interval=RELAY_POLL_INTERVAL, retention=RELAY_RETENTION):
+        super().__init__(name='event-relay', daemon=True)
+        self.pool = pool
+        self.bus = bus
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._stopped = threading.Event()
+        self._purged_at = 0.0
+        with pool.connection() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+            # Подписчиков до старта нет — история им не нужна
+            self._last = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM events').fetchone()[0]
+
+    def publish(self, conn, user_id, name, data):
+        """Пишет событие в открытой транзакции записи; уйдёт подписчикам после COMMIT."""
+        conn.execute('INSERT INTO events (user_id, name, data, at) VALUES (?, ?, ?, ?)',
+                     (user_id, name, json.dumps(data, ensure_ascii=False), time.time()))
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('❌ Ошибка доставки событий')
+
+    def poll(self):
+        """Раздаёт новые события; возвращает их число."""
+        now = time.time()
+        with self.pool.connection() as conn:
+            if now - self._purged_at >= RELAY_PURGE_INTERVAL:
+                self._purged_at = now
+                conn.execute('DELETE FROM events WHERE at < ?', (now - self.retention,))
+            rows = conn.execute(
+                'SELECT seq, user_id, name, data FROM events WHERE seq > ? ORDER BY seq LIMIT ?',
+                (self._last, RELAY_BATCH)).fetchall()
+        for seq, user_id, name, data in rows:
+            self._last = seq
+            self.bus.publish(user_id, name, json.loads(data))
+        return len(rows)
+
+
+def format_sse(name, data):
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f'event: {name}\ndata: {payload}\n\n'
+
+
+def stream(subscription, keepalive=KEEPALIVE_INTERVAL):
+    """Генератор тела SSE-ответа; снимает подписку при обрыве соединения."""
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            event = subscription.get(keepalive)
+            if subscription.overflowed:
+                yield format_sse('resync', {})
+                return
+            if event is None:
+                yield ': ping\n\n'
+                continue
+            yield format_sse(*event)
+    finally:
+        subscription.close()
@@ -0,0 +1,72 @@
+"""Потоковая выгрузка сделок, тикетов и пользователей для админки.
+
+Ответ собирается генератором порциями по ``BATCH_SIZE`` строк: в памяти
+держится одна порция, а не весь массив. Для клиентов с
+``Accept-Encoding: gzip`` порции сразу сжимаются потоковым zlib.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+BATCH_SIZE = 1000
+
+USER_FIELDS = ('user_id', 'login', 'username', 'is_admin', 'successful_deals',
+               'ton_wallet', 'card_details', 'created_at')
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def matches(record, status=None, payment_method=None, date_from=None, date_to=None):
+    if status and record.get('status') != status:
+        return False
+    if payment_method and record.get('payment_method') != payment_method:
+        return False
+    # created_at — ISO 8601 в UTC, строки сравниваются как даты
+    if date_from and record['created_at'] < date_from:
+        return False
+    if date_to and record['created_at'] >= date_to:
+        return False
+    return True
+
+
+def _batches(records, fields, fmt):
+    buffer = io.StringIO()
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+
+    count = 0
+    for record in records:
+        if writer is not None:
+            writer.writerow(record)
+        else:
+            row = {key: record.get(key) for key in fields}
+            buffer.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+            buffer.write('\n')
+        count += 1
+        if count % BATCH_SIZE == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    tail = buffer.getvalue()
+    if tail:
+        yield tail.encode()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        # SYNC_FLUSH на каждой порции: клиент видит строки сразу, а не в конце
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def stream(records, fields, fmt='ndjson', gzip=False):
+    chunks = _batches(records, fields, fmt)
+    return _gzip(chunks) if gzip else chunks
@@ -0,0 +1,83 @@
+"""Кэш готовых JSON-фрагментов записей для списков сделок и тикетов.
+
+Страница ``/api/deals/my`` у крупного продавца — это сотня одних и тех же
+неизменных словарей, которые ``jsonify`` кодирует заново на каждый запрос.
+Здесь каждая запись кодируется один раз: байты лежат в ограниченном LRU по
+ключу ``(id, ревизия, поля)``, а тело ответа склеивается из фрагментов без
+повторной сериализации. Ревизия — ``updated_at`` и ``status``: запись
+меняется только сменой статуса, и старый фрагмент просто вытесняется.
+
+Вычисляемые поля (``amount_rub`` зависит от курса) в кэш не попадают — они
+дописываются в конец фрагмента при каждом ответе. Кодирует ``orjson``, если
+он установлен, иначе стандартный ``json`` в том же компактном виде.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+
+from store import project
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость: без неё стандартный json
+    orjson = None
+
+DEFAULT_MAXSIZE = 50_000
+
+
+if orjson is not None:
+    dumps = orjson.dumps
+else:
+    def dumps(value):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class FragmentCache:
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (id, updated_at, status, fields) -> bytes
+
+    def encode(self, records, fields=None, computed=()):
+        """JSON-массив записей в байтах; ``computed`` — поля, которые не кэшируются."""
+        fields = tuple(fields) if fields else None
+        # Префиксы '"amount_rub":' вычисляемых полей, которые попадут в ответ
+        tails = [(name, dumps(name) + b':') for name in computed
+                 if fields is None or name in fields]
+        keys = [(r['id'], r['updated_at'], r['status'], fields) for r in records]
+        with self._lock:
+            bodies = [self._entries.get(key) for key in keys]
+            for key, body in zip(keys, bodies):
+                if body is not None:
+                    self._entries.move_to_end(key)
+
+        missing = {}
+        parts = []
+        for key, record, body in zip(keys, records, bodies):
+            if body is None:
+                body = missing[key] = dumps(
+                    {k: v for k, v in project(record, fields).items() if k not in computed})
+            extra = [prefix + dumps(record[name]) for name, prefix in tails if name in record]
+            if extra:
+                # {"id":...} + "amount_rub":... -> {"id":...,"amount_rub":...}
+                separator = b',' if len(body) > 2 else b''
+                body = b''.join((body[:-1], separator, b','.join(extra), b'}'))
+            parts.append(body)
+
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+            self._entries.update(missing)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return b'[' + b','.join(parts) + b']\n'
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,14 @@
+"""Конфигурация gunicorn: ``gunicorn api:app``.
+
+По умолчанию используются gevent-воркеры — SSE-соединения ``/api/events``
+простаивают часами, и sync-воркер на соединение здесь не подходит.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 2000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+keepalive = 75
@@ -0,0 +1,111 @@
+"""Проверка паролей в отдельном пуле процессов.
+
+PBKDF2 держит CPU десятки миллисекунд; в пуле процессов он не занимает
+GIL воркера, и дешёвые запросы вроде ``/api/profile`` продолжают
+обслуживаться во время волны логинов. Очередь ограничена: сверх
+``max_pending`` ожидающих проверок ``verify`` сразу бросает ``Overloaded``,
+и ручка отвечает 503 вместо того, чтобы копить очередь. Так же (через
+``Unavailable``) отвечает проверка, не уложившаяся в ``VERIFY_TIMEOUT``, и
+проверка, на которой пул сломался — например, процесс пула убил OOM
+killer; сломанный пул пересоздаётся при следующем вызове.
+
+Если хеш пользователя сделан с устаревшими параметрами, новый хеш
+считается в том же заходе в пул и возвращается вызывающему.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from store import hash_password, needs_rehash, verify_password
+
+VERIFY_TIMEOUT = 10
+RETRY_AFTER = 1
+
+# Для несуществующих логинов: время ответа не должно выдавать, есть ли пользователь
+_DUMMY_HASH = None
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Unavailable(Exception):
+    """Пул не ответил вовремя или сломался; проверку можно повторить."""
+
+
+def _watch_parent(parent_pid):
+    """Процесс пула завершается вместе с воркером, даже если того убили SIGKILL."""
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def verify_and_rehash(password, encoded):
+    """``(ok, new_hash_or_None)``; выполняется в процессе пула."""
+    if encoded is None:
+        global _DUMMY_HASH
+        if _DUMMY_HASH is None:
+            _DUMMY_HASH = hash_password('dummy-password')
+        verify_password(password, _DUMMY_HASH)
+        return False, None
+    if not verify_password(password, encoded):
+        return False, None
+    return True, hash_password(password) if needs_rehash(encoded) else None
+
+
+class HashingPool:
+    def __init__(self, workers=2, max_pending=64):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        # Пул создаётся лениво в каждом воркере gunicorn: после fork чужой пул не работает
+        if self._executor is None or self._pid != os.getpid():
+            # spawn, а не fork: форк процесса с потоками (диспетчер, снапшоты) небезопасен
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_watch_parent, initargs=(os.getpid(),))
+            self._pid = os.getpid()
+        return self._executor
+
+    def _discard(self, executor):
+        # Сломанный пул больше не принимает задачи: следующий вызов создаст новый
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def verify(self, password, encoded):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise Overloaded('Очередь проверки паролей переполнена')
+            self._pending += 1
+            executor = self._get_executor() if self.workers else None
+        try:
+            if executor is None:
+                return verify_and_rehash(password, encoded)
+            future = executor.submit(verify_and_rehash, password, encoded)
+            return future.result(VERIFY_TIMEOUT)
+        except TimeoutError:
+            future.cancel()
+            raise Unavailable('Проверка пароля не уложилась в таймаут') from None
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise Unavailable('Пул проверки паролей сломался') from None
+        finally:
+            with self._lock:
+                self._pending -= 1
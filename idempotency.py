@@ -0,0 +1,225 @@
+"""Заголовок ``Idempotency-Key`` для POST-ручек создания.
+
+Первый запрос с ключом выполняется и его ответ запоминается в ограниченном
+кэше с TTL по ключу ``(user_id, путь, key)``. Повторы с тем же ключом получают
+сохранённый ответ, не трогая хранилище и outbox; повтор, пришедший пока
+первый ещё выполняется, ждёт его результата. Тот же ключ с другим телом —
+ошибка клиента (422).
+
+``IdempotencyCache`` живёт в памяти воркера и годится только для
+``memory://``, где и данные не покидают процесс. С общим хранилищем ключи
+резервируются в его таблице ``idempotency`` (``SqliteIdempotencyStore``):
+повтор мобильного клиента после обрыва связи приходит по новому соединению
+и, возможно, в другой воркер — он всё равно увидит резерв или сохранённый
+ответ. Ждущий повтор опрашивает строку, пока владелец не запишет ответ;
+резерв, брошенный упавшим воркером, через ``pending_timeout`` снова можно
+занять. Просроченные строки удаляются по ``ttl``.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, jsonify, request
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAXSIZE = 50_000
+WAIT_TIMEOUT = 30
+POLL_INTERVAL = 0.05
+PENDING_TIMEOUT = 2 * WAIT_TIMEOUT
+CLEANUP_INTERVAL = 60
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS idempotency (
+    user_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    key TEXT NOT NULL,
+    token TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    status INTEGER,
+    body BLOB,
+    content_type TEXT,
+    PRIMARY KEY (user_id, path, key)
+);
+CREATE INDEX IF NOT EXISTS idempotency_by_time ON idempotency (created_at);
+'''
+
+
+class _Entry:
+    __slots__ = ('fingerprint', 'created', 'done', 'response')
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.created = time.monotonic()
+        self.done = threading.Event()
+        self.response = None   # (status, body, content_type)
+
+
+class IdempotencyCache:
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _evict(self, now):
+        # Записи упорядочены по времени создания, просроченные — в начале
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry.created < self.ttl and len(self._entries) <= self.maxsize:
+                break
+            del self._entries[key]
+
+    def reserve(self, key, fingerprint):
+        """``(entry, is_owner)``: владелец выполняет запрос, остальные ждут."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry, False
+            entry = self._entries[key] = _Entry(fingerprint)
+            return entry, True
+
+    def complete(self, entry, status, body, content_type):
+        entry.response = (status, body, content_type)
+        entry.done.set()
+
+    def wait(self, entry, timeout):
+        """Ответ владельца ``(status, body, content_type)`` или None."""
+        entry.done.wait(timeout)
+        return entry.response
+
+    def discard(self, key, entry):
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.done.set()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Reservation:
+    __slots__ = ('key', 'token', 'fingerprint')
+
+    def __init__(self, key, token, fingerprint):
+        self.key = key
+        self.token = token
+        self.fingerprint = fingerprint
+
+
+class SqliteIdempotencyStore:
+    """Резервы ключей в общей SQLite-базе; интерфейс как у ``IdempotencyCache``."""
+
+    def __init__(self, pool, ttl=DEFAULT_TTL, pending_timeout=PENDING_TIMEOUT):
+        self.pool = pool
+        self.ttl = ttl
+        self.pending_timeout = pending_timeout
+        self._cleaned_at = 0.0
+        with pool.connection() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+
+    def reserve(self, key, fingerprint):
+        now = time.time()
+        token = os.urandom(8).hex()
+        with self.pool.transaction() as conn:
+            if now - self._cleaned_at >= CLEANUP_INTERVAL:
+                self._cleaned_at = now
+                conn.execute('DELETE FROM idempotency WHERE created_at < ?', (now - self.ttl,))
+            # Просроченный ключ и резерв, брошенный упавшим воркером, занимаются заново
+            conn.execute(
+                'DELETE FROM idempotency WHERE user_id = ? AND path = ? AND key = ? '
+                'AND (created_at < ? OR (status IS NULL AND created_at < ?))',
+                (*key, now - self.ttl, now - self.pending_timeout))
+            inserted = conn.execute(
+                'INSERT INTO idempotency (user_id, path, key, token, fingerprint, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING',
+                (*key, token, fingerprint, now)).rowcount
+            if inserted:
+                return _Reservation(key, token, fingerprint), True
+            token, fingerprint = conn.execute(
+                'SELECT token, fingerprint FROM idempotency '
+                'WHERE user_id = ? AND path = ? AND key = ?', key).fetchone()
+        return _Reservation(key, token, fingerprint), False
+
+    def complete(self, entry, status, body, content_type):
+        with self.pool.transaction() as conn:
+            conn.execute(
+                'UPDATE idempotency SET status = ?, body = ?, content_type = ? '
+                'WHERE user_id = ? AND path = ? AND key = ? AND token = ?',
+                (status, body, content_type, *entry.key, entry.token))
+
+    def wait(self, entry, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.pool.connection() as conn:
+                row = conn.execute(
+                    'SELECT status, body, content_type FROM idempotency '
+                    'WHERE user_id = ? AND path = ? AND key = ? AND token = ?',
+                    (*entry.key, entry.token)).fetchone()
+            if row is None:
+                return None   # владелец получил 5xx и снял резерв
+            if row[0] is not None:
+                return row[0], row[1], row[2]
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def discard(self, key, entry):
+        with self.pool.transaction() as conn:
+            conn.execute('DELETE FROM idempotency '
+                         'WHERE user_id = ? AND path = ? AND key = ? AND token = ?',
+                         (*key, entry.token))
+
+    def __len__(self):
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM idempotency').fetchone()[0]
+
+
+def idempotent(cache):
+    """Декоратор для view под ``login_required``."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({'error': 'Слишком длинный Idempotency-Key'}), 400
+
+            cache_key = (g.user['user_id'], request.path, key)
+            fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+            entry, is_owner = cache.reserve(cache_key, fingerprint)
+
+            if not is_owner:
+                if entry.fingerprint != fingerprint:
+                    return jsonify({'error': 'Idempotency-Key уже использован с другими данными'}), 422
+                replay = cache.wait(entry, WAIT_TIMEOUT)
+                if replay is None:
+                    return jsonify({'error': 'Запрос с этим ключом ещё выполняется'}), 409
+                status, body, content_type = replay
+                response = current_app.response_class(body, status=status, content_type=content_type)
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            except BaseException:
+                cache.discard(cache_key, entry)
+                raise
+            if response.status_code >= 500:
+                # Серверную ошибку не запоминаем — клиент может повторить
+                cache.discard(cache_key, entry)
+            else:
+                cache.complete(entry, response.status_code, response.get_data(),
+                               response.content_type)
+            return response
+        return wrapper
+    return decorator
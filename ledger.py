@@ -0,0 +1,346 @@
+"""Шардированный журнал балансов.
+
+Счета распределены по шардам по crc32 ключа, у каждого шарда свой lock,
+текущие балансы и append-only журнал проводок. Перевод между счетами берёт
+lock'и обоих шардов в порядке их номеров, так что глобальной блокировки нет
+и взаимных блокировок тоже. Баланс читается из словаря за O(1); снимки
+фиксируют балансы и позицию журнала, чтобы восстановление проигрывало
+только хвост.
+
+Системный счёт эскроу ведётся отдельно для каждого счёта получателя
+(``escrow@<счёт>``) и попадает в тот же шард, поэтому расчёт по сделке
+берёт ровно один lock.
+
+Суммы хранятся в минимальных единицах (копейки, нанотоны и т. п. — здесь
+сотые доли), чтобы не копить ошибку float.
+
+Журнал живёт в памяти процесса; с ``directory`` каждая проводка ещё и
+дописывается в файл шарда, а снимки пишутся атомарной заменой файла.
+Снимок забирает в себя балансы и ref'ы, после чего журнал шарда (и в
+памяти, и на диске) начинается заново — он не растёт бесконечно. Ref'ы
+нужны только против повтора одного и того же перевода, поэтому при снимке
+забываются ref'ы старше ``ref_retention`` (по умолчанию неделя): повторный
+расчёт по давно завершённой сделке исключает уже само хранилище —
+``completed`` конечный статус. Так и память, и файл снимка ограничены
+оборотом за это окно, а не всей историей. Каталог
+журнала принадлежит одному процессу: второй ``Ledger`` на том же каталоге
+не откроется.
+
+``Ledger`` годится только для ``memory://``, где у каждого воркера свои
+данные. При общем хранилище балансы ведёт ``SqliteLedger``: проводки и
+балансы лежат в той же базе, а расчёт по сделке идёт в транзакции смены
+её статуса.
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+import zlib
+from typing import NamedTuple
+
+DEFAULT_SHARDS = 16
+SNAPSHOT_EVERY = 10_000
+REF_RETENTION = 7 * 24 * 3600
+MINOR_UNITS = 100
+
+ESCROW = 'escrow'
+
+
+class InsufficientFunds(ValueError):
+    pass
+
+
+class Posting(NamedTuple):
+    seq: int
+    ref: str
+    account: str
+    delta: int
+    ts: float
+
+
+def to_minor(amount):
+    return int(round(float(amount) * MINOR_UNITS))
+
+
+def from_minor(value):
+    return value / MINOR_UNITS
+
+
+def account_key(owner, currency):
+    return f'{owner}:{currency}'
+
+
+def escrow_for(account):
+    return f'{ESCROW}@{account}'
+
+
+def is_system(account):
+    return account.startswith(ESCROW)
+
+
+class _Shard:
+    def __init__(self, index, path=None, ref_retention=REF_RETENTION):
+        self.index = index
+        self.lock = threading.Lock()
+        self.balances = {}
+        self.journal = []            # проводки после последнего снимка
+        self.refs = {}               # ref -> время проводки, в порядке появления
+        self.ref_retention = ref_retention
+        self.seq = 0
+        self.snapshot = ({}, 0)      # (балансы, seq последней вошедшей проводки)
+        self.path = path
+        self._file = None
+        if path:
+            self._restore()
+            self._file = open(f'{path}.journal', 'a', encoding='utf-8')
+
+    def append(self, ref, account, delta):
+        self.seq += 1
+        posting = Posting(self.seq, ref, account, delta, time.time())
+        self.journal.append(posting)
+        self.balances[account] = self.balances.get(account, 0) + delta
+        if self._file:
+            self._file.write(json.dumps(posting._asdict(), separators=(',', ':')) + '\n')
+            self._file.flush()
+        return posting
+
+    def prune_refs(self, now):
+        """Забывает ref'ы старше ``ref_retention``; словарь упорядочен по времени."""
+        horizon = now - self.ref_retention
+        stale = []
+        for ref, ts in self.refs.items():
+            if ts >= horizon:
+                break
+            stale.append(ref)
+        for ref in stale:
+            del self.refs[ref]
+
+    def take_snapshot(self):
+        """Вызывается под ``self.lock``; после снимка журнал начинается заново."""
+        self.snapshot = (dict(self.balances), self.seq)
+        self.prune_refs(time.time())
+        if self.path:
+            tmp = f'{self.path}.snapshot.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'balances': self.snapshot[0], 'seq': self.seq,
+                           'refs': self.refs}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, f'{self.path}.snapshot')
+            # Упали между заменой и обрезкой — при восстановлении старые
+            # проводки отсеются по seq
+            self._file.truncate(0)
+        self.journal.clear()
+
+    def replay(self):
+        """Балансы из снимка и хвоста журнала — для сверки с текущими."""
+        balances, _ = self.snapshot
+        balances = dict(balances)
+        for posting in self.journal:
+            balances[posting.account] = balances.get(posting.account, 0) + posting.delta
+        return balances
+
+    def _restore(self):
+        try:
+            with open(f'{self.path}.snapshot', encoding='utf-8') as f:
+                data = json.load(f)
+            self.snapshot = (data['balances'], data['seq'])
+            refs = data['refs']
+            # Снимки до ограничения ref'ов хранили список без времени
+            self.refs = refs if isinstance(refs, dict) else dict.fromkeys(refs, time.time())
+        except FileNotFoundError:
+            pass
+        position = self.snapshot[1]
+        try:
+            with open(f'{self.path}.journal', encoding='utf-8') as f:
+                postings = (Posting(**json.loads(line)) for line in f if line.strip())
+                self.journal = [p for p in postings if p.seq > position]
+        except FileNotFoundError:
+            pass
+        for posting in self.journal:
+            self.refs.setdefault(posting.ref, posting.ts)
+        self.seq = self.journal[-1].seq if self.journal else position
+        self.balances = self.replay()
+
+
+class Ledger:
+    def __init__(self, shards=DEFAULT_SHARDS, snapshot_every=SNAPSHOT_EVERY, directory=None,
+                 ref_retention=REF_RETENTION):
+        self._lock_file = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._lock_file = open(os.path.join(directory, 'ledger.lock'), 'a')
+            try:
+                fcntl.lockf(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                raise RuntimeError(f'Журнал {directory} уже открыт другим процессом; '
+                                   f'при нескольких воркерах нужно общее хранилище') from None
+        self.snapshot_every = snapshot_every
+        self._shards = [
+            _Shard(i, os.path.join(directory, f'shard-{i:03d}') if directory else None,
+                   ref_retention)
+            for i in range(shards)
+        ]
+
+    def _shard(self, account):
+        # Всё после '@' — ключ шардирования: эскроу живёт рядом со своим счётом
+        routing = account.rpartition('@')[2]
+        return self._shards[zlib.crc32(routing.encode()) % len(self._shards)]
+
+    def balance(self, account):
+        """Баланс в минимальных единицах."""
+        return self._shard(account).balances.get(account, 0)
+
+    def deposit(self, account, amount, ref):
+        return self.transfer(escrow_for(account), account, amount, ref)
+
+    def transfer(self, debit, credit, amount, ref):
+        """Атомарно переводит ``amount`` (в минимальных единицах).
+
+        ``ref`` уникален: повторный вызов с тем же ref ничего не делает и
+        возвращает False, так что расчёт по сделке безопасно повторять.
+        """
+        if amount <= 0:
+            raise ValueError('Сумма перевода должна быть положительной')
+        debit_shard, credit_shard = self._shard(debit), self._shard(credit)
+        shards = sorted({debit_shard, credit_shard}, key=lambda s: s.index)
+        for shard in shards:
+            shard.lock.acquire()
+        try:
+            if ref in credit_shard.refs:
+                return False
+            if not is_system(debit) and debit_shard.balances.get(debit, 0) < amount:
+                raise InsufficientFunds(f'Недостаточно средств на счёте {debit}')
+            debit_shard.append(ref, debit, -amount)
+            posting = credit_shard.append(ref, credit, amount)
+            credit_shard.refs[ref] = posting.ts
+            for shard in shards:
+                if len(shard.journal) >= self.snapshot_every:
+                    shard.take_snapshot()
+            return True
+        finally:
+            for shard in reversed(shards):
+                shard.lock.release()
+
+    def settle_deal(self, deal):
+        """Зачисляет сумму сделки продавцу из эскроу; повтор игнорируется."""
+        account = account_key(deal['user_id'], deal['payment_method'])
+        return self.transfer(escrow_for(account), account,
+                             to_minor(deal['amount']), f"deal:{deal['id']}")
+
+    def snapshot(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.take_snapshot()
+
+    def start_snapshots(self, interval):
+        """Фоновые снимки раз в ``interval`` секунд (daemon-поток)."""
+        def run():
+            while True:
+                time.sleep(interval)
+                self.snapshot()
+        thread = threading.Thread(target=run, name='ledger-snapshots', daemon=True)
+        thread.start()
+        return thread
+
+    def verify(self):
+        """Проверяет, что снимок + хвост журнала дают текущие балансы и что
+        сумма по всем счетам равна нулю (двойная запись)."""
+        total = 0
+        for shard in self._shards:
+            with shard.lock:
+                if shard.replay() != shard.balances:
+                    return False
+                total += sum(shard.balances.values())
+        return total == 0
+
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS ledger_postings (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ref TEXT NOT NULL,
+    account TEXT NOT NULL,
+    delta INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    UNIQUE (ref, account)
+);
+CREATE TABLE IF NOT EXISTS ledger_balances (
+    account TEXT PRIMARY KEY,
+    balance INTEGER NOT NULL
+) WITHOUT ROWID;
+'''
+
+
+class SqliteLedger:
+    """Журнал и балансы в общей SQLite-базе — один на все воркеры.
+
+    ``ledger_balances`` — готовые балансы, то есть постоянный снимок:
+    чтение баланса — один поиск по ключу, журнал ``ledger_postings`` нужен
+    только для сверки. Методы записи принимают ``conn`` открытой транзакции,
+    чтобы проводка зафиксировалась вместе со сменой статуса сделки.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        with pool.connection() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+
+    def balance(self, account):
+        with self.pool.connection() as conn:
+            return self._balance(conn, account)
+
+    @staticmethod
+    def _balance(conn, account):
+        row = conn.execute('SELECT balance FROM ledger_balances WHERE account = ?',
+                           (account,)).fetchone()
+        return row[0] if row else 0
+
+    def deposit(self, account, amount, ref, conn=None):
+        return self.transfer(escrow_for(account), account, amount, ref, conn)
+
+    def transfer(self, debit, credit, amount, ref, conn=None):
+        """Как ``Ledger.transfer``; повтор с тем же ``ref`` возвращает False."""
+        if amount <= 0:
+            raise ValueError('Сумма перевода должна быть положительной')
+        if conn is None:
+            with self.pool.transaction() as conn:
+                return self._transfer(conn, debit, credit, amount, ref)
+        return self._transfer(conn, debit, credit, amount, ref)
+
+    def _transfer(self, conn, debit, credit, amount, ref):
+        if conn.execute('SELECT 1 FROM ledger_postings WHERE ref = ? AND account = ?',
+                        (ref, credit)).fetchone():
+            return False
+        if not is_system(debit) and self._balance(conn, debit) < amount:
+            raise InsufficientFunds(f'Недостаточно средств на счёте {debit}')
+        now = time.time()
+        conn.executemany('INSERT INTO ledger_postings (ref, account, delta, ts) VALUES (?, ?, ?, ?)',
+                         [(ref, debit, -amount, now), (ref, credit, amount, now)])
+        conn.executemany(
+            'INSERT INTO ledger_balances (account, balance) VALUES (?, ?) '
+            'ON CONFLICT (account) DO UPDATE SET balance = balance + excluded.balance',
+            [(debit, -amount), (credit, amount)])
+        return True
+
+    def settle_deal(self, deal, conn=None):
+        account = account_key(deal['user_id'], deal['payment_method'])
+        return self.transfer(escrow_for(account), account,
+                             to_minor(deal['amount']), f"deal:{deal['id']}", conn)
+
+    def snapshot(self):
+        """Балансы и так лежат готовыми — отдельные снимки не нужны."""
+
+    def start_snapshots(self, interval):
+        return None
+
+    def verify(self):
+        with self.pool.connection() as conn:
+            drift = conn.execute(
+                'SELECT COUNT(*) FROM ledger_balances b LEFT JOIN '
+                '(SELECT account, SUM(delta) AS total FROM ledger_postings GROUP BY account) p '
+                'USING (account) WHERE b.balance != COALESCE(p.total, 0)').fetchone()[0]
+            total = conn.execute('SELECT COALESCE(SUM(balance), 0) FROM ledger_balances').fetchone()[0]
+        return drift == 0 and total == 0
@@ -0,0 +1,128 @@
+"""Автоотмена зависших сделок: хешированное колесо таймеров.
+
+Каждая активная сделка получает дедлайн ``created_at + ttl`` и ложится в
+слот колеса ``(дедлайн // tick) % slots``. Раз в ``tick`` секунд фоновый
+поток снимает только текущий слот, а не просматривает все сделки:
+постановка, отмена и срабатывание — O(1) на таймер. Дедлайн дальше одного
+оборота колеса остаётся в слоте до нужного оборота.
+
+Таймер снимается, как только сделка уходит из ``active``. Отмена идёт
+через обычный ``set_status``, так что статистика, SSE и журнал переходов
+видят её как любую другую смену статуса. У каждого воркера своё колесо, и
+о смене статуса в другом воркере оно не знает, поэтому отмена —
+compare-and-set ``active → cancelled``: сделку, которую уже подтвердили,
+таймер не тронет.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+from store import InvalidTransition
+
+logger = logging.getLogger('magante.lifecycle')
+
+DEFAULT_TICK = 1.0
+DEFAULT_SLOTS = 4096
+
+
+class TimerWheel:
+    def __init__(self, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS, now=None):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]   # key -> дедлайн
+        self._where = {}                           # key -> номер слота
+        self._lock = threading.Lock()
+        self._current = self._tick_of(time.time() if now is None else now)
+
+    def _tick_of(self, timestamp):
+        return int(timestamp // self.tick)
+
+    def schedule(self, key, deadline):
+        with self._lock:
+            self._remove(key)
+            # Просроченный дедлайн срабатывает на ближайшем тике
+            index = max(self._tick_of(deadline), self._current + 1) % len(self._slots)
+            self._slots[index][key] = deadline
+            self._where[key] = index
+
+    def cancel(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        index = self._where.pop(key, None)
+        if index is not None:
+            del self._slots[index][key]
+
+    def advance(self, now):
+        """Проходит тики до ``now``; возвращает ключи с наступившим дедлайном."""
+        expired = []
+        with self._lock:
+            target = self._tick_of(now)
+            # После долгой паузы достаточно одного оборота: он покрывает все слоты
+            start = max(self._current + 1, target - len(self._slots) + 1)
+            for tick in range(start, target + 1):
+                slot = self._slots[tick % len(self._slots)]
+                due = [key for key, deadline in slot.items() if deadline <= now]
+                for key in due:
+                    del slot[key]
+                    del self._where[key]
+                expired.extend(due)
+            self._current = max(self._current, target)
+        return expired
+
+    def __len__(self):
+        return len(self._where)
+
+
+def parse_timestamp(value):
+    return datetime.fromisoformat(value).timestamp()
+
+
+class DealExpiry(threading.Thread):
+    """Отменяет сделки, простоявшие в ``active`` дольше ``ttl`` секунд."""
+
+    def __init__(self, deals, ttl, wheel=None):
+        super().__init__(name='deal-expiry', daemon=True)
+        self.deals = deals
+        self.ttl = ttl
+        self.wheel = wheel or TimerWheel()
+        self._stopped = threading.Event()
+        deals.listeners.append(self.on_deal)
+
+    def load(self):
+        """Ставит таймеры активным сделкам, уже лежащим в хранилище."""
+        for deal_id in self.deals.ids_by_status('active'):
+            deal = self.deals.get(deal_id)
+            if deal is not None:
+                self.wheel.schedule(deal_id, parse_timestamp(deal['created_at']) + self.ttl)
+
+    def on_deal(self, deal, old_status):
+        if old_status is None and deal['status'] == 'active':
+            self.wheel.schedule(deal['id'], parse_timestamp(deal['created_at']) + self.ttl)
+        elif old_status == 'active':
+            self.wheel.cancel(deal['id'])
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.wheel.tick):
+            try:
+                self.expire(time.time())
+            except Exception:
+                logger.exception('❌ Ошибка автоотмены сделок')
+
+    def expire(self, now):
+        cancelled = 0
+        for deal_id in self.wheel.advance(now):
+            try:
+                self.deals.set_status(deal_id, 'cancelled', expected='active')
+            except (KeyError, InvalidTransition):
+                # Сделку успели перевести, отменить или архивировать в другом воркере
+                continue
+            cancelled += 1
+        if cancelled:
+            logger.info('⏰ Автоматически отменено сделок: %d', cancelled)
+        return cancelled
@@ -0,0 +1,280 @@
+"""Метрики запросов для Prometheus: ``GET /metrics``.
+
+По каждому маршруту считаются гистограмма задержки в стиле HDR (четыре
+под-корзины на октаву, погрешность квантилей около 19%), коды ответов,
+размеры ответов и запросов, число запросов в работе.
+
+Счётчики лежат в общем memory-mapped файле (по умолчанию в ``/dev/shm``),
+разбитом на регионы. Каждый воркер gunicorn при первом запросе
+захватывает свободный регион ``lockf``-блокировкой на его байт и пишет
+только туда: между процессами нет конкуренции, а внутри процесса хватает
+одного lock'а. ``/metrics`` в любом воркере суммирует все регионы. Когда
+воркер умирает, ядро снимает его блокировку; регион достаётся новому
+воркеру вместе со счётчиками, так что суммы не убывают. Сбрасывается
+только gauge запросов в работе.
+
+Маршруты нумеруются по отсортированному списку правил приложения, у всех
+воркеров он одинаковый. Хеш списка лежит в заголовке файла: после деплоя
+с другими маршрутами файл обнуляется.
+
+Профилировщик включается ``METRICS_PROFILE_MS``. Раз в ``profile_interval`` секунд
+процессорного времени ``SIGPROF`` снимает стек текущего запроса. Если
+запрос оказался медленнее порога, самые частые стеки пишутся в лог.
+"""
+
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import signal
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+logger = logging.getLogger('magante.metrics')
+
+MAX_REGIONS = 64
+MAX_ROUTES = 64
+UNMATCHED = '<unmatched>'
+
+LATENCY_MIN_US = 64            # всё быстрее 64 мкс — в первой корзине
+OCTAVES = 19                   # до 2**25 мкс ≈ 33 с
+SUB_BUCKETS = 4
+LATENCY_BUCKETS = 1 + OCTAVES * SUB_BUCKETS + 1
+SIZE_BUCKETS = 20              # 2**6 … 2**25 байт и переполнение
+STATUS_CODES = (200, 201, 204, 301, 302, 304, 400, 401, 403, 404, 405, 409,
+                413, 422, 429, 500, 502, 503, 504)
+
+# Смещения полей внутри записи маршрута (int64)
+LAT = 0
+LAT_SUM = LAT + LATENCY_BUCKETS
+COUNT = LAT_SUM + 1
+STATUS = COUNT + 1
+SIZE = STATUS + len(STATUS_CODES) + 1
+SIZE_SUM = SIZE + SIZE_BUCKETS + 1
+REQUEST_BYTES = SIZE_SUM + 1
+IN_FLIGHT = REQUEST_BYTES + 1
+ROUTE_SLOTS = IN_FLIGHT + 1
+
+REGION_SLOTS = MAX_ROUTES * ROUTE_SLOTS
+HEADER = mmap.PAGESIZE
+STATUS_INDEX = {code: i for i, code in enumerate(STATUS_CODES)}
+
+
+def latency_bucket(us):
+    if us < LATENCY_MIN_US:
+        return 0
+    octave = us.bit_length() - LATENCY_MIN_US.bit_length()
+    if octave >= OCTAVES:
+        return LATENCY_BUCKETS - 1
+    # Два бита после старшего — под-корзина внутри октавы
+    return 1 + octave * SUB_BUCKETS + ((us >> (octave + 4)) & 3)
+
+
+def latency_upper_bounds():
+    bounds = [LATENCY_MIN_US]
+    for octave in range(OCTAVES):
+        base = LATENCY_MIN_US << octave
+        bounds += [base + (sub + 1) * (base // SUB_BUCKETS) for sub in range(SUB_BUCKETS)]
+    return bounds
+
+
+def size_bucket(size):
+    return min(max(size - 1, 0).bit_length() - 6, SIZE_BUCKETS) if size > 64 else 0
+
+
+class Metrics:
+    def __init__(self, path=None, profile_ms=0, profile_interval=0.005):
+        if path is None:
+            base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            path = os.path.join(base, 'magante-metrics')
+        self.path = path
+        self.profile_ms = profile_ms
+        self.profile_interval = profile_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._routes = None
+        self._samples = {}   # ident потока/гринлета -> Counter стеков
+
+    def init_app(self, app):
+        self.app = app
+        # Регистрируется раньше rate_limit: 429 тоже попадают в метрики
+        app.before_request(self._before)
+        app.after_request(self._after)
+        app.teardown_request(self._teardown)
+        if self.profile_ms:
+            self._start_profiler()
+
+    def _attach(self):
+        """Захватывает регион файла в текущем процессе (лениво, после fork)."""
+        routes = sorted({rule.rule for rule in self.app.url_map.iter_rules()} | {UNMATCHED})
+        if len(routes) > MAX_ROUTES:
+            raise RuntimeError('Слишком много маршрутов для метрик')
+        digest = hashlib.sha256('\n'.join(routes).encode()).digest()[:8]
+        size = HEADER + MAX_REGIONS * REGION_SLOTS * 8
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Байт 0 — блокировка заголовка, байты 1..MAX_REGIONS — регионы
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, 0)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            buf = mmap.mmap(fd, size)
+            if buf[8:16] != digest:
+                buf[:] = bytes(size)
+                buf[8:16] = digest
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, 1, 0)
+        for region in range(MAX_REGIONS):
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, region + 1)
+                break
+            except OSError:
+                continue
+        else:
+            raise RuntimeError('Нет свободного региона метрик')
+        counters = memoryview(buf)[HEADER:].cast('q')
+        base = region * REGION_SLOTS
+        for route in range(MAX_ROUTES):
+            # Запросы умершего владельца региона уже не в работе
+            counters[base + route * ROUTE_SLOTS + IN_FLIGHT] = 0
+        self._fd, self._buf, self._counters = fd, buf, counters
+        self._base = base
+        self._routes = {route: i for i, route in enumerate(routes)}
+        self._route_names = routes
+        self._pid = os.getpid()
+
+    def _before(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._attach()
+        # Прокси request и g недёшевы: по одному обращению на хук
+        req = request._get_current_object()
+        rule = req.url_rule
+        base = self._base + self._routes[rule.rule if rule is not None else UNMATCHED] * ROUTE_SLOTS
+        # [смещение записи, старт, код ответа, размер ответа]
+        g._metrics = [base, time.perf_counter_ns(), 500, None]
+        with self._lock:
+            self._counters[base + IN_FLIGHT] += 1
+            self._counters[base + REQUEST_BYTES] += req.content_length or 0
+        if self.profile_ms:
+            self._samples[threading.get_ident()] = Counter()
+
+    def _after(self, response):
+        state = g.get('_metrics')
+        if state is not None:
+            state[2] = response.status_code
+            state[3] = response.calculate_content_length()
+        return response
+
+    def _teardown(self, exc):
+        state = g.pop('_metrics', None)
+        if state is None:
+            return
+        base, started, status, size = state
+        elapsed_us = (time.perf_counter_ns() - started) // 1000
+        counters = self._counters
+        with self._lock:
+            counters[base + IN_FLIGHT] -= 1
+            counters[base + LAT + latency_bucket(elapsed_us)] += 1
+            counters[base + LAT_SUM] += elapsed_us
+            counters[base + COUNT] += 1
+            counters[base + STATUS + STATUS_INDEX.get(status, len(STATUS_CODES))] += 1
+            if size is not None:
+                counters[base + SIZE + size_bucket(size)] += 1
+                counters[base + SIZE_SUM] += size
+        if self.profile_ms:
+            samples = self._samples.pop(threading.get_ident(), None)
+            if samples and elapsed_us >= self.profile_ms * 1000:
+                self._dump(elapsed_us, samples)
+
+    # --- профилировщик -------------------------------------------------
+
+    def _start_profiler(self):
+        if threading.current_thread() is not threading.main_thread():
+            logger.warning('⚠️ Профилировщик запросов включается только из главного потока')
+            return
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.profile_interval, self.profile_interval)
+
+    def _sample(self, signum, frame):
+        samples = self._samples.get(threading.get_ident())
+        if samples is None:
+            return
+        stack = []
+        while frame is not None and len(stack) < 40:
+            code = frame.f_code
+            stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+            frame = frame.f_back
+        samples[';'.join(reversed(stack))] += 1
+
+    def _dump(self, elapsed_us, samples):
+        total = sum(samples.values())
+        lines = [f'{count}/{total} {stack}' for stack, count in samples.most_common(5)]
+        logger.warning('🐢 Медленный запрос %s %s: %.0f мс, горячие стеки:\n%s',
+                       request.method, request.path, elapsed_us / 1000, '\n'.join(lines))
+
+    # --- экспорт -------------------------------------------------------
+
+    def render(self):
+        """Текст в формате Prometheus по сумме всех регионов."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._attach()
+        counters = self._counters
+        bounds = latency_upper_bounds()
+        out = {
+            'latency': ['# HELP magante_http_request_duration_seconds Время обработки запроса',
+                        '# TYPE magante_http_request_duration_seconds histogram'],
+            'status': ['# HELP magante_http_responses_total Ответы по кодам',
+                       '# TYPE magante_http_responses_total counter'],
+            'size': ['# HELP magante_http_response_size_bytes Размер тела ответа',
+                     '# TYPE magante_http_response_size_bytes histogram'],
+            'request': ['# HELP magante_http_request_size_bytes_total Принято байт тела запроса',
+                        '# TYPE magante_http_request_size_bytes_total counter'],
+            'in_flight': ['# HELP magante_http_requests_in_flight Запросы в работе',
+                          '# TYPE magante_http_requests_in_flight gauge'],
+        }
+        for index, route in enumerate(self._route_names):
+            record = [0] * ROUTE_SLOTS
+            for region in range(MAX_REGIONS):
+                start = region * REGION_SLOTS + index * ROUTE_SLOTS
+                chunk = counters[start:start + ROUTE_SLOTS]
+                if any(chunk):
+                    record = [a + b for a, b in zip(record, chunk)]
+            label = f'route="{route}"'
+            out['in_flight'].append(f'magante_http_requests_in_flight{{{label}}} {record[IN_FLIGHT]}')
+            if not record[COUNT]:
+                continue
+
+            name = 'magante_http_request_duration_seconds'
+            cumulative = 0
+            for bound, value in zip(bounds, record[LAT:LAT + LATENCY_BUCKETS - 1]):
+                cumulative += value
+                out['latency'].append(f'{name}_bucket{{{label},le="{bound / 1e6:g}"}} {cumulative}')
+            out['latency'] += [f'{name}_bucket{{{label},le="+Inf"}} {record[COUNT]}',
+                               f'{name}_sum{{{label}}} {record[LAT_SUM] / 1e6:g}',
+                               f'{name}_count{{{label}}} {record[COUNT]}']
+
+            for code, value in zip(STATUS_CODES + ('other',), record[STATUS:SIZE]):
+                if value:
+                    out['status'].append(
+                        f'magante_http_responses_total{{{label},code="{code}"}} {value}')
+
+            name = 'magante_http_response_size_bytes'
+            sized = sum(record[SIZE:SIZE_SUM])
+            cumulative = 0
+            for bucket, value in enumerate(record[SIZE:SIZE + SIZE_BUCKETS]):
+                cumulative += value
+                out['size'].append(f'{name}_bucket{{{label},le="{64 << bucket}"}} {cumulative}')
+            out['size'] += [f'{name}_bucket{{{label},le="+Inf"}} {sized}',
+                            f'{name}_sum{{{label}}} {record[SIZE_SUM]}',
+                            f'{name}_count{{{label}}} {sized}']
+            out['request'].append(
+                f'magante_http_request_size_bytes_total{{{label}}} {record[REQUEST_BYTES]}')
+        return '\n'.join(line for lines in out.values() for line in lines) + '\n'
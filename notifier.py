@@ -0,0 +1,313 @@
+"""Outbox уведомлений в Telegram.
+
+Обработчики запросов только пишут сообщение в SQLite-outbox и сразу
+отвечают клиенту. Фоновый ``Dispatcher`` забирает готовые к отправке
+строки, склеивает сообщения одного чата в одно, соблюдает общий
+token-bucket лимит Bot API и при ошибках откладывает отправку с
+экспоненциальной задержкой. Текст длиннее лимита Telegram (4096 символов)
+делится на несколько строк ещё при постановке в outbox; ответы 400 и 403
+(битый запрос, бот заблокирован) не исправятся повтором, и такие строки
+сразу помечаются упавшими.
+
+Строки забираются с арендой (``next_attempt_at`` сдвигается вперёд в той же
+транзакции), поэтому несколько воркеров gunicorn с общим файлом outbox не
+отправят одно сообщение дважды.
+
+Отправляет только один диспетчер на файл outbox — тот, что держит
+``lockf`` на ``<outbox>.lock``; у остальных воркеров диспетчер ждёт, пока
+лидер не умрёт. Так лимит Bot API соблюдается целиком, а не умножается на
+число воркеров. Лидер же раз в час удаляет доставленные и окончательно
+упавшие строки старше ``retention``.
+"""
+
+import fcntl
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+
+logger = logging.getLogger('magante.notifier')
+
+TELEGRAM_API_URL = 'https://api.telegram.org'
+MESSAGE_LIMIT = 4096
+LEASE_SECONDS = 30
+MAX_ATTEMPTS = 8
+# Повтор не поможет: сообщение отвергнуто или бот заблокирован в чате
+PERMANENT_ERRORS = (400, 403)
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 300.0
+RETENTION = 7 * 24 * 3600
+PURGE_INTERVAL = 3600
+LEADER_RETRY = 5.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    sent_at REAL,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt_at)
+    WHERE sent_at IS NULL AND failed = 0;
+'''
+
+
+class RetryAfter(Exception):
+    def __init__(self, seconds):
+        super().__init__(f'Повторить через {seconds} с')
+        self.seconds = seconds
+
+
+class Outbox:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, chat_id, text):
+        """Возвращается после коммита; длинный текст ложится несколькими строками."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany(
+                'INSERT INTO outbox (chat_id, text, created_at, next_attempt_at) VALUES (?, ?, ?, ?)',
+                [(str(chat_id), part, now, now) for part in split_text(text)],
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def claim(self, limit=100, lease=LEASE_SECONDS):
+        """Забирает до ``limit`` готовых строк: [(id, chat_id, text, attempts)]."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                '''UPDATE outbox SET next_attempt_at = ?
+                   WHERE id IN (SELECT id FROM outbox
+                                WHERE sent_at IS NULL AND failed = 0 AND next_attempt_at <= ?
+                                ORDER BY next_attempt_at LIMIT ?)
+                   RETURNING id, chat_id, text, attempts''',
+                (now + lease, now, limit),
+            ).fetchall()
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return sorted(rows)
+
+    def mark_sent(self, ids):
+        conn = self._connect()
+        conn.executemany('UPDATE outbox SET sent_at = ? WHERE id = ?',
+                         [(time.time(), i) for i in ids])
+
+    def mark_failed(self, ids):
+        conn = self._connect()
+        conn.executemany('UPDATE outbox SET failed = 1 WHERE id = ?', [(i,) for i in ids])
+
+    def reschedule(self, ids, attempts, delay):
+        failed = int(attempts >= MAX_ATTEMPTS)
+        conn = self._connect()
+        conn.executemany(
+            'UPDATE outbox SET attempts = ?, next_attempt_at = ?, failed = ? WHERE id = ?',
+            [(attempts, time.time() + delay, failed, i) for i in ids],
+        )
+
+    def purge(self, older_than):
+        """Удаляет доставленные и упавшие строки старше ``older_than`` (unix time)."""
+        conn = self._connect()
+        return conn.execute(
+            'DELETE FROM outbox WHERE (sent_at IS NOT NULL AND sent_at < ?) '
+            'OR (failed = 1 AND created_at < ?)', (older_than, older_than)).rowcount
+
+    def pending_count(self):
+        conn = self._connect()
+        return conn.execute(
+            'SELECT COUNT(*) FROM outbox WHERE sent_at IS NULL AND failed = 0').fetchone()[0]
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Забирает токен; возвращает, сколько секунд нужно подождать."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+
+class TelegramClient:
+    def __init__(self, token, base_url=TELEGRAM_API_URL, timeout=10):
+        self.url = f'{base_url.rstrip("/")}/bot{token}/sendMessage'
+        self.timeout = timeout
+
+    def send(self, chat_id, text):
+        body = json.dumps({'chat_id': chat_id, 'text': text}).encode()
+        request = urllib.request.Request(self.url, data=body,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as exc:
+            if exc.code == 429:
+                try:
+                    retry_after = json.load(exc)['parameters']['retry_after']
+                except (ValueError, KeyError, TypeError):
+                    retry_after = 1
+                raise RetryAfter(retry_after) from exc
+            raise
+
+
+def split_text(text, limit=MESSAGE_LIMIT):
+    """Части не длиннее ``limit``: режем по абзацу или строке, в крайнем случае по символу."""
+    parts = []
+    while len(text) > limit:
+        cut = max(text.rfind('\n\n', 0, limit), text.rfind('\n', 0, limit))
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    return parts + [text]
+
+
+def coalesce(rows):
+    """Группирует строки по чату, склеивая тексты в пределах лимита Telegram.
+
+    Возвращает [(chat_id, text, ids, attempts)].
+    """
+    batches = OrderedDict()
+    result = []
+    for row_id, chat_id, text, attempts in rows:
+        batch = batches.get(chat_id)
+        if batch and len(batch[1]) + len(text) + 2 > MESSAGE_LIMIT:
+            result.append(batches.pop(chat_id))
+            batch = None
+        if batch is None:
+            batches[chat_id] = (chat_id, text, [row_id], attempts)
+        else:
+            batches[chat_id] = (chat_id, f'{batch[1]}\n\n{text}', batch[2] + [row_id],
+                                max(batch[3], attempts))
+    return result + list(batches.values())
+
+
+def backoff(attempts):
+    delay = min(BACKOFF_BASE * 2 ** attempts, BACKOFF_MAX)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class Dispatcher(threading.Thread):
+    def __init__(self, outbox, client, rate=25, poll_interval=1.0, batch_size=100, linger=0.25,
+                 retention=RETENTION):
+        super().__init__(name='telegram-dispatcher', daemon=True)
+        self.outbox = outbox
+        self.client = client
+        self.bucket = TokenBucket(rate)
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        # Пауза после пробуждения, чтобы успели накопиться сообщения для склейки
+        self.linger = linger
+        self.retention = retention
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._leader_lock = None
+        self._purged_at = 0.0
+
+    def try_lead(self):
+        """Становится единственным отправителем для файла outbox, если место свободно."""
+        if self._leader_lock is None:
+            handle = open(f'{self.outbox.path}.lock', 'a')
+            try:
+                fcntl.lockf(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return False
+            self._leader_lock = handle
+            logger.info('📮 Этот процесс отправляет уведомления из outbox')
+        return True
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            if not self.try_lead():
+                self._stopped.wait(LEADER_RETRY)
+                continue
+            try:
+                self.purge_if_due(time.time())
+                sent = self.dispatch_once()
+            except Exception:
+                logger.exception('❌ Ошибка диспетчера уведомлений')
+                sent = 0
+            if not sent and self._wakeup.wait(self.poll_interval):
+                self._wakeup.clear()
+                self._stopped.wait(self.linger)
+
+    def purge_if_due(self, now):
+        if now - self._purged_at < PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        purged = self.outbox.purge(now - self.retention)
+        if purged:
+            logger.info('🧹 Удалено старых строк outbox: %d', purged)
+
+    def dispatch_once(self):
+        rows = self.outbox.claim(self.batch_size)
+        for chat_id, text, ids, attempts in coalesce(rows):
+            self.bucket.acquire()
+            try:
+                self.client.send(chat_id, text)
+            except RetryAfter as exc:
+                self.outbox.reschedule(ids, attempts, exc.seconds)
+            except urllib.error.HTTPError as exc:
+                if exc.code in PERMANENT_ERRORS:
+                    logger.error('❌ Telegram отверг сообщение в чат %s (%s), не повторяем',
+                                 chat_id, exc.code)
+                    self.outbox.mark_failed(ids)
+                else:
+                    logger.warning('⚠️ Не удалось отправить в чат %s: %s', chat_id, exc)
+                    self.outbox.reschedule(ids, attempts + 1, backoff(attempts))
+            except Exception as exc:
+                logger.warning('⚠️ Не удалось отправить в чат %s: %s', chat_id, exc)
+                self.outbox.reschedule(ids, attempts + 1, backoff(attempts))
+            else:
+                self.outbox.mark_sent(ids)
+        return len(rows)
@@ -0,0 +1,172 @@
+"""Ограничение частоты запросов: token bucket, общий для воркеров gunicorn.
+
+Корзины лежат в memory-mapped файле (по умолчанию в ``/dev/shm``) — это
+открытая хеш-таблица фиксированного размера со слотами
+``(hash64, tokens, updated)``. Пробирование идёт внутри блока из ``PROBES``
+слотов, а блок целиком защищён полосой блокировок: lock потока
+внутри процесса плюс ``lockf`` на байт полосы между процессами. Redis и
+прочие внешние сервисы не нужны, а горячий путь — это один хеш, одна
+блокировка и пара ``struct.unpack_from``/``pack_into``.
+
+Если все слоты цепочки заняты живыми корзинами, вытесняется та, что дольше
+всех не обновлялась: в худшем случае клиент получает свежую полную корзину,
+запрос не блокируется ошибочно.
+"""
+
+import fcntl
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+SLOT = struct.Struct('<Qdd')
+_unpack_slot = SLOT.unpack_from
+_pack_slot = SLOT.pack_into
+_lockf = fcntl.lockf
+_LOCK_EX, _LOCK_UN = fcntl.LOCK_EX, fcntl.LOCK_UN
+DEFAULT_SLOTS = 1 << 16   # кратно PROBES
+PROBES = 8
+STRIPES = 256
+
+# capacity/period_seconds для каждого класса ручек
+DEFAULT_LIMITS = 'auth=10/60,write=30/60,read=600/60'
+
+
+def parse_limits(spec):
+    """``'auth=10/60,read=600/60'`` -> {'auth': (capacity, rate_per_second)}."""
+    limits = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, _, value = item.partition('=')
+        capacity, _, period = value.partition('/')
+        limits[name.strip()] = (float(capacity), float(capacity) / float(period or 1))
+    return limits
+
+
+def key_hash(key, _crc32=zlib.crc32, _adler32=zlib.adler32):
+    data = key.encode()
+    # Стабильный между процессами хеш: hash() у str рандомизирован
+    return (_crc32(data) << 32 | _adler32(data)) or 1
+
+
+class SharedBuckets:
+    def __init__(self, path=None, slots=DEFAULT_SLOTS):
+        if path is None:
+            base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            path = os.path.join(base, 'magante-ratelimit')
+        self.path = path
+        self.slots = slots
+        size = slots * SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._locks = [threading.Lock() for _ in range(STRIPES)]
+
+    def take(self, key, capacity, rate, now=None):
+        """Забирает токен. Возвращает 0.0 или сколько секунд ждать до следующего."""
+        h = key_hash(key)
+        start = (h >> 32) % self.slots   # crc32-половина: adler32 плохо рассеивает младшие биты
+        stripe = (start // PROBES) % STRIPES
+        now = time.time() if now is None else now
+        buf, fd = self._map, self._fd
+        with self._locks[stripe]:
+            _lockf(fd, _LOCK_EX, 1, stripe)
+            try:
+                # Быстрый путь: корзина в своём первом слоте
+                offset = start * SLOT.size
+                slot_hash, tokens, updated = _unpack_slot(buf, offset)
+                if slot_hash != h:
+                    offset, tokens, updated = self._find(buf, h, start)
+                if updated:
+                    tokens = min(capacity, tokens + (now - updated) * rate)
+                else:
+                    tokens = capacity
+                if tokens >= 1:
+                    _pack_slot(buf, offset, h, tokens - 1, now)
+                    return 0.0
+                _pack_slot(buf, offset, h, tokens, now)
+                return (1 - tokens) / rate
+            finally:
+                _lockf(fd, _LOCK_UN, 1, stripe)
+
+    def take_all(self, keys, capacity, rate, now=None):
+        """Забирает по токену из каждой корзины — либо ни одного.
+
+        Полосы всех ключей берутся разом в порядке возрастания номера (так
+        два процесса с пересекающимися ключами не сцепятся), затем все
+        корзины проверяются и только если токен есть в каждой, списываются.
+        Запрос, отбитый одной корзиной, не тратит токены остальных.
+        """
+        now = time.time() if now is None else now
+        buf, fd = self._map, self._fd
+        buckets = []
+        for key in keys:
+            h = key_hash(key)
+            start = (h >> 32) % self.slots
+            buckets.append((h, start, (start // PROBES) % STRIPES))
+        stripes = sorted({stripe for _, _, stripe in buckets})
+        taken = []
+        try:
+            for stripe in stripes:
+                self._locks[stripe].acquire()
+                taken.append(stripe)
+                _lockf(fd, _LOCK_EX, 1, stripe)
+            wait, states = 0.0, []
+            for h, start, _ in buckets:
+                offset, tokens, updated = self._find(buf, h, start)
+                tokens = min(capacity, tokens + (now - updated) * rate) if updated else capacity
+                states.append((offset, h, tokens))
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+            if not wait:
+                for offset, h, tokens in states:
+                    _pack_slot(buf, offset, h, tokens - 1, now)
+            return wait
+        finally:
+            for stripe in reversed(taken):
+                _lockf(fd, _LOCK_UN, 1, stripe)
+                self._locks[stripe].release()
+
+    def _find(self, buf, h, start):
+        """Смещение слота для ``h`` и его состояние (updated=0 — новая корзина)."""
+        oldest_offset, oldest_updated = None, math.inf
+        block = start - start % PROBES
+        for i in range(PROBES):
+            offset = (block + (start + i) % PROBES) * SLOT.size
+            slot_hash, tokens, updated = _unpack_slot(buf, offset)
+            if slot_hash == h:
+                return offset, tokens, updated
+            if slot_hash == 0:
+                return offset, 0.0, 0.0
+            if updated < oldest_updated:
+                oldest_offset, oldest_updated = offset, updated
+        return oldest_offset, 0.0, 0.0
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class RateLimiter:
+    def __init__(self, buckets, limits):
+        self.buckets = buckets
+        self.limits = limits
+
+    def check(self, route_class, *keys):
+        """Максимальное ожидание по всем ключам (0.0 — запрос пропускаем).
+
+        Токены списываются только если запрос проходит по всем ключам.
+        """
+        limit = self.limits.get(route_class)
+        if limit is None:
+            return 0.0
+        capacity, rate = limit
+        if len(keys) == 1:
+            return self.buckets.take(f'{route_class}:{keys[0]}', capacity, rate)
+        return self.buckets.take_all([f'{route_class}:{key}' for key in keys], capacity, rate)
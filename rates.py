@@ -0,0 +1,134 @@
+"""Курсы TON и Telegram Stars к рублю для рублёвых эквивалентов.
+
+Источник курсов подключаемый: ``RateSource.fetch()`` возвращает рублей за
+единицу по методам оплаты. ``StaticRateSource`` — фиксированные курсы (для
+тестов и локального запуска), ``CoinGeckoSource`` — TON с CoinGecko.
+
+``RateCache`` никогда не ходит в сеть из запроса. Свежий снимок (моложе
+``ttl``) отдаётся как есть; устаревший тоже отдаётся сразу, а обновление
+уходит в фоновый поток, по одному на процесс. Если снимок старше
+``max_age`` или его ещё нет, эквиваленты не считаются (None) — это лучше,
+чем показать курс недельной давности.
+"""
+
+import json
+import logging
+import threading
+import time
+import urllib.request
+
+logger = logging.getLogger('magante.rates')
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_AGE = 3600
+RETRY_INTERVAL = 15
+COINGECKO_URL = ('https://api.coingecko.com/api/v3/simple/price'
+                 '?ids=the-open-network&vs_currencies=rub')
+
+
+class RateSource:
+    def fetch(self):
+        """{метод оплаты: рублей за единицу}; исключение при ошибке."""
+        raise NotImplementedError
+
+
+class StaticRateSource(RateSource):
+    def __init__(self, rates):
+        self.rates = dict(rates)
+
+    @classmethod
+    def from_spec(cls, spec):
+        """``'ton=250,stars=1.5'``."""
+        rates = {}
+        for item in spec.split(','):
+            if item.strip():
+                method, _, value = item.partition('=')
+                rates[method.strip()] = float(value)
+        return cls(rates)
+
+    def fetch(self):
+        return dict(self.rates)
+
+
+class CoinGeckoSource(RateSource):
+    """TON — биржевой курс; у Stars его нет, курс задаётся фиксированно."""
+
+    def __init__(self, stars_rate, url=COINGECKO_URL, timeout=5):
+        self.stars_rate = stars_rate
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self):
+        request = urllib.request.Request(self.url, headers={'Accept': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            data = json.load(response)
+        return {'ton': float(data['the-open-network']['rub']), 'stars': self.stars_rate}
+
+
+class RateCache:
+    def __init__(self, source, ttl=DEFAULT_TTL, max_age=DEFAULT_MAX_AGE):
+        self.source = source
+        self.ttl = ttl
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._rates = None
+        self._fetched = 0.0
+        self._refreshing = False
+        self._retry_at = 0.0
+        self._version = 0
+
+    def refresh(self):
+        """Синхронно забирает курсы из источника; False при ошибке."""
+        try:
+            rates = self.source.fetch()
+        except Exception as exc:
+            logger.warning('⚠️ Не удалось обновить курсы: %s', exc)
+            with self._lock:
+                self._retry_at = time.monotonic() + RETRY_INTERVAL
+            return False
+        rates['sbp'] = 1.0
+        with self._lock:
+            if rates != self._rates:
+                self._version += 1
+            self._rates = rates
+            self._fetched = time.monotonic()
+        return True
+
+    def refresh_async(self):
+        with self._lock:
+            if self._refreshing or time.monotonic() < self._retry_at:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+        threading.Thread(target=run, name='rates-refresh', daemon=True).start()
+
+    @property
+    def version(self):
+        """Меняется вместе с курсами — для ETag ответов с эквивалентами; 0 — курсов нет."""
+        if self._rates is None or time.monotonic() - self._fetched >= self.max_age:
+            return 0
+        return self._version
+
+    def snapshot(self):
+        """Текущие курсы или None; при необходимости запускает фоновое обновление."""
+        rates, age = self._rates, time.monotonic() - self._fetched
+        if rates is None or age >= self.ttl:
+            self.refresh_async()
+        if rates is None or age >= self.max_age:
+            return None
+        return rates
+
+    def convert(self, items):
+        """[(amount, payment_method)] -> [рубли или None] по одному снимку курсов."""
+        # Рубли (СБП) пересчитываются и без курсов
+        rates = self.snapshot() or {'sbp': 1.0}
+        result = []
+        for amount, method in items:
+            rate = rates.get(method)
+            result.append(None if rate is None else round(amount * rate, 2))
+        return result
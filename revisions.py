@@ -0,0 +1,82 @@
+"""Ревизии пользовательских ресурсов для ETag и условных GET.
+
+У каждого пользователя свой монотонный счётчик на ресурс (``profile``,
+``deals``, ``tickets``); слушатели хранилищ увеличивают его при любом
+изменении. ETag собирается из счётчика без сериализации тела, поэтому
+ответ 304 на ``If-None-Match`` стоит одного словарного поиска.
+
+``Revisions`` держит счётчики в памяти процесса — только для
+``memory://``, где и данные не покидают процесс. В ETag входит случайная
+эпоха процесса: тег, выданный до рестарта, никогда не совпадёт, и клиент
+просто получит полный ответ. С общим хранилищем счётчики и эпоха лежат в
+его базе (``SqliteRevisions``) и увеличиваются в транзакции записи: иначе
+воркер, не видевший изменения, ответил бы 304 на устаревший тег.
+"""
+
+import os
+import threading
+import zlib
+from collections import Counter
+
+
+class Revisions:
+    def __init__(self):
+        self.epoch = os.urandom(4).hex()
+        self._lock = threading.Lock()
+        self._counters = Counter()   # (user_id, resource) -> ревизия
+
+    def bump(self, user_id, *resources, conn=None):
+        with self._lock:
+            for resource in resources:
+                self._counters[user_id, resource] += 1
+
+    def get(self, user_id, resource):
+        return self._counters[user_id, resource]
+
+    def etag(self, user_id, resource, variant=''):
+        """``variant`` — всё, от чего ещё зависит тело: query string, поля."""
+        tag = zlib.crc32(f'{user_id}\0{resource}\0{variant}'.encode())
+        return f'{self.epoch}-{self.get(user_id, resource)}-{tag:08x}'
+
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS revisions (
+    user_id TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    rev INTEGER NOT NULL,
+    PRIMARY KEY (user_id, resource)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS revisions_epoch (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    epoch TEXT NOT NULL
+);
+'''
+
+
+class SqliteRevisions(Revisions):
+    """Ревизии в SQLite-хранилище; эпоха — одна на базу, а не на процесс."""
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        with pool.connection() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+        with pool.transaction() as conn:
+            # Первый процесс на новой базе выбирает эпоху, остальные её читают
+            conn.execute('INSERT OR IGNORE INTO revisions_epoch VALUES (1, ?)', (self.epoch,))
+            self.epoch = conn.execute('SELECT epoch FROM revisions_epoch').fetchone()[0]
+
+    def bump(self, user_id, *resources, conn=None):
+        """``conn`` — открытая транзакция записи, в которой меняются сами данные."""
+        if conn is None:
+            with self.pool.transaction() as conn:
+                return self.bump(user_id, *resources, conn=conn)
+        conn.executemany('INSERT INTO revisions VALUES (?, ?, 1) '
+                         'ON CONFLICT DO UPDATE SET rev = rev + 1',
+                         [(user_id, resource) for resource in resources])
+
+    def get(self, user_id, resource):
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT rev FROM revisions WHERE user_id = ? AND resource = ?',
+                               (user_id, resource)).fetchone()
+        return row[0] if row else 0
@@ -0,0 +1,277 @@
+"""Полнотекстовый поиск по сделкам и тикетам для админки.
+
+Индекс — таблица SQLite FTS5 (токенизатор ``unicode61``: регистр
+кириллицы сворачивается, ``ё`` приводим к ``е`` сами). Идентификаторы и
+статус лежат в обычной таблице ``search_docs`` с тем же rowid, поэтому
+смена статуса — точечный UPDATE по уникальному индексу, а не перезапись
+документа. Слушатели хранилищ дописывают запись при создании и обновляют
+статус при смене; целиком индекс перестраивается только ``rebuild``.
+
+Окно ранжирования (ниже) опирается на то, что rowid растёт вместе с
+``created_at``, поэтому ``rebuild`` вставляет сделки и тикеты вперемешку, в
+порядке создания. Перестройка идёт порциями по ``REBUILD_BATCH`` документов
+с фиксацией после каждой: запись в индекс из других воркеров ждёт одну
+порцию, а не весь проход. Общий файл индекса перестраивает один воркер —
+остальные видят его отметку в ``search_rebuilds`` и пропускают перестройку.
+
+Русских словоформ FTS5 не знает, поэтому и текст, и запрос приводятся к
+грубой основе (``сделками`` → ``сделк``) до FTS5: в индекс попадают основы
+(колонки ``title_terms``/``body_terms``), а исходный текст хранится рядом
+без индексации — для выдачи. Запрос из точных основ не требует склейки
+префиксных списков и читает только нужные doclist'ы. Все слова запроса
+должны встретиться (AND), результаты ранжируются по bm25, тема тикета
+весит больше текста.
+
+bm25 считается для каждого совпадения, и частое слово на миллионах
+документов ранжировалось бы сотни миллисекунд. Поэтому ранжируются только
+последние ``RANK_WINDOW`` совпадений: границу окна FTS5 находит проходом по
+rowid в обратном порядке, без подсчёта релевантности. Фильтры ``kind`` и
+``status`` входят и в поиск границы, и в само окно: иначе тысяча свежих
+сделок вытеснила бы из окна единственный подходящий тикет. Редкие запросы
+попадают в окно целиком.
+"""
+
+import heapq
+import itertools
+import re
+import sqlite3
+import threading
+import time
+from operator import itemgetter
+
+from store import decode_cursor, encode_cursor
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS search_docs (
+    rowid INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    record_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    UNIQUE (kind, record_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(
+    title UNINDEXED,
+    body UNINDEXED,
+    title_terms,
+    body_terms,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS search_rebuilds (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    started_at REAL NOT NULL,
+    heartbeat REAL NOT NULL
+);
+'''
+
+# Тема тикета весит больше текста
+RANK = 'bm25(search, 0, 0, 4.0, 1.0)'
+RANK_WINDOW = 1000
+SNIPPET_LENGTH = 160
+REBUILD_BATCH = 500
+# Отметка перестройки без обновления дольше этого — воркер упал посреди прохода
+REBUILD_STALE = 120
+
+WORD = re.compile(r'\w+')
+MAX_TERMS = 8
+
+# Окончания существительных и прилагательных, от длинных к коротким
+ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией',
+    'ая', 'яя', 'ое', 'ее', 'ой', 'ей', 'ий', 'ый', 'ые', 'ие', 'ом', 'ем',
+    'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ую', 'юю', 'ия', 'ию', 'ть',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+MIN_STEM = 3
+
+
+def normalize(text):
+    return text.lower().replace('ё', 'е')
+
+
+def stem(word):
+    """Грубая основа русского слова; латиницу и числа не трогает."""
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def terms(text):
+    return [stem(word) for word in WORD.findall(normalize(text))]
+
+
+def match_query(text):
+    """FTS5-выражение из пользовательского ввода; None, если искать нечего.
+
+    Каждое слово экранируется кавычками, так что синтаксис FTS5 из ввода
+    не проходит.
+    """
+    words = terms(text)[:MAX_TERMS]
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def snippet(text, query_terms):
+    """Кусок текста вокруг первого совпавшего слова."""
+    if len(text) <= SNIPPET_LENGTH:
+        return text
+    lowered = normalize(text)
+    positions = [p for p in (lowered.find(term) for term in query_terms) if p >= 0]
+    start = max(0, min(positions, default=0) - SNIPPET_LENGTH // 4)
+    end = start + SNIPPET_LENGTH
+    return ('…' if start else '') + text[start:end] + ('…' if end < len(text) else '')
+
+
+class SearchIndex:
+    """Одно соединение на процесс под блокировкой: запросы короткие."""
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                     check_same_thread=False)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def _insert(self, kind, record):
+        if kind == 'deal':
+            title, body = '', record['description']
+        else:
+            title, body = record['subject'], record['message']
+        cursor = self._conn.execute(
+            'INSERT OR IGNORE INTO search_docs (kind, record_id, user_id, status, created_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (kind, record['id'], record['user_id'], record['status'], record['created_at']),
+        )
+        if not cursor.rowcount:
+            # Уже проиндексирована (другим воркером при перестройке общего индекса)
+            return
+        self._conn.execute(
+            'INSERT INTO search (rowid, title, body, title_terms, body_terms) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (cursor.lastrowid, title, body, ' '.join(terms(title)), ' '.join(terms(body))))
+
+    def listener(self, kind):
+        def on_change(record, old_status):
+            with self._lock:
+                if old_status is None:
+                    self._conn.execute('BEGIN')
+                    try:
+                        self._insert(kind, record)
+                    except BaseException:
+                        self._conn.execute('ROLLBACK')
+                        raise
+                    self._conn.execute('COMMIT')
+                else:
+                    self._conn.execute(
+                        'UPDATE search_docs SET status = ? WHERE kind = ? AND record_id = ?',
+                        (record['status'], kind, record['id']))
+        return on_change
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM search_docs').fetchone()[0]
+
+    def _write(self, statements, *args):
+        """Короткая транзакция записи; ``statements(conn, *args)`` — её тело."""
+        with self._lock:
+            conn = self._conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = statements(conn, *args)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+
+    def rebuild(self, all_deals, all_tickets, archived=()):
+        """Перестраивает индекс с нуля по сырым данным.
+
+        ``all_deals`` и ``all_tickets`` — в порядке создания (как их отдают
+        ``iter_all`` хранилищ); ``archived`` идут первыми: в архив попадают
+        только давно завершённые сделки. Возвращает False, если индекс уже
+        перестраивает другой воркер.
+        """
+        def claim(conn):
+            now = time.time()
+            return conn.execute(
+                'INSERT INTO search_rebuilds VALUES (1, ?, ?) ON CONFLICT DO UPDATE '
+                'SET started_at = excluded.started_at, heartbeat = excluded.heartbeat '
+                'WHERE heartbeat < ? RETURNING started_at',
+                (now, now, now - REBUILD_STALE)).fetchone()
+
+        def clear(conn):
+            conn.execute('DELETE FROM search_docs')
+            conn.execute('DELETE FROM search')
+
+        def insert(conn, batch):
+            for _, kind, record in batch:
+                self._insert(kind, record)
+            conn.execute('UPDATE search_rebuilds SET heartbeat = ?', (time.time(),))
+
+        def finish(conn):
+            conn.execute("INSERT INTO search (search) VALUES ('optimize')")
+            conn.execute('DELETE FROM search_rebuilds')
+
+        if self._write(claim) is None:
+            return False
+        try:
+            self._write(clear)
+            documents = itertools.chain(
+                (('', 'deal', record) for record in archived),
+                heapq.merge(((record['created_at'], 'deal', record) for record in all_deals),
+                            ((record['created_at'], 'ticket', record) for record in all_tickets),
+                            key=itemgetter(0)))
+            while batch := list(itertools.islice(documents, REBUILD_BATCH)):
+                self._write(insert, batch)
+        except BaseException:
+            # Снимаем отметку: следующий воркер перестроит, не дожидаясь REBUILD_STALE
+            self._write(lambda conn: conn.execute('DELETE FROM search_rebuilds'))
+            raise
+        self._write(finish)
+        return True
+
+    def search(self, text, kind=None, status=None, limit=20, cursor=None):
+        """``(results, next_cursor)``; курсор — смещение в ранжированной выдаче."""
+        query = match_query(text)
+        if query is None:
+            return [], None
+        offset = decode_cursor(cursor) if cursor else 0
+        where = 'search MATCH ?'
+        filters = []
+        if kind:
+            where += ' AND d.kind = ?'
+            filters.append(kind)
+        if status:
+            where += ' AND d.status = ?'
+            filters.append(status)
+        source = 'FROM search JOIN search_docs d ON d.rowid = search.rowid'
+        sql = (f"SELECT d.kind, d.record_id, d.user_id, d.status, d.created_at, search.title, "
+               f"search.body, {RANK} {source} "
+               f"WHERE {where} AND search.rowid >= ? ORDER BY {RANK} LIMIT ? OFFSET ?")
+        with self._lock:
+            floor = self._conn.execute(
+                f'SELECT search.rowid {source} WHERE {where} '
+                f'ORDER BY search.rowid DESC LIMIT 1 OFFSET ?',
+                [query, *filters, RANK_WINDOW - 1]).fetchone()
+            rows = self._conn.execute(
+                sql, [query, *filters, floor[0] if floor else 0, limit + 1, offset]).fetchall()
+        next_cursor = encode_cursor(offset + limit) if len(rows) > limit else None
+        query_terms = terms(text)
+        return [{
+            'kind': kind_,
+            'id': record_id,
+            'user_id': user_id,
+            'status': status_,
+            'created_at': created_at,
+            'title': title,
+            'snippet': snippet(body, query_terms),
+            'score': round(-score, 4),
+        } for kind_, record_id, user_id, status_, created_at, title, body, score
+            in rows[:limit]], next_cursor
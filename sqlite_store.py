@@ -0,0 +1,383 @@
+"""SQLite-бэкенд хранилищ: ``STORAGE_URL=sqlite:///otc.db``.
+
+База открывается в WAL-режиме, так что воркеры gunicorn читают параллельно
+с записью. У каждого процесса свой пул соединений; после fork пул
+создаётся заново, соединения родителя не переиспользуются. Запросы —
+константные строки с параметрами, их подготовленные выражения живут в
+кэше statement'ов каждого соединения.
+
+Страницы «моих» записей идут по индексу ``(user_id, seq)``, где ``seq`` —
+rowid в порядке создания: keyset-курсор превращается в range scan по
+индексу без сортировки. Сам индекс колонок записи не содержит (описание
+сделки и текст тикета удвоили бы базу), поэтому страница читается в два
+шага: подзапрос выбирает ``seq`` страницы только по индексу — для него он
+покрывающий, — а строки дочитываются из таблицы поиском по rowid. Таблица
+читается ровно для ``limit`` строк страницы; ``COUNT(*)`` по владельцу
+обходится одним индексом.
+Другой бэкенд (например Postgres) реализует те же ``BaseUserStore`` и
+``RecordStore`` из ``store.py``.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from operator import itemgetter
+
+from store import (
+    SHORT_ID_LENGTH, BaseUserStore, DealRecords, RecordStore, TicketRecords,
+    decode_cursor, encode_cursor,
+)
+
+POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 8))
+STATEMENT_CACHE_SIZE = 256
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    login TEXT NOT NULL UNIQUE,
+    username TEXT NOT NULL,
+    password_hash TEXT NOT NULL,
+    is_admin INTEGER NOT NULL DEFAULT 0,
+    successful_deals INTEGER NOT NULL DEFAULT 0,
+    ton_wallet TEXT,
+    card_details TEXT,
+    telegram_chat_id TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deals (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL,
+    amount REAL NOT NULL,
+    description TEXT NOT NULL,
+    payment_method TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deals_by_owner ON deals (user_id, seq);
+CREATE INDEX IF NOT EXISTS deals_by_status ON deals (status, id);
+CREATE INDEX IF NOT EXISTS deals_by_short_id ON deals (substr(id, -8));
+CREATE TABLE IF NOT EXISTS tickets (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tickets_by_owner ON tickets (user_id, seq);
+CREATE INDEX IF NOT EXISTS tickets_by_status ON tickets (status, id);
+CREATE INDEX IF NOT EXISTS tickets_by_short_id ON tickets (substr(id, -8));
+CREATE TABLE IF NOT EXISTS deals_transitions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    record_id TEXT NOT NULL,
+    old_status TEXT,
+    new_status TEXT NOT NULL,
+    at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deals_transitions_by_record ON deals_transitions (record_id, seq);
+CREATE TABLE IF NOT EXISTS tickets_transitions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    record_id TEXT NOT NULL,
+    old_status TEXT,
+    new_status TEXT NOT NULL,
+    at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tickets_transitions_by_record ON tickets_transitions (record_id, seq);
+'''
+
+USER_COLUMNS = ('user_id', 'login', 'username', 'password_hash', 'is_admin',
+                'successful_deals', 'ton_wallet', 'card_details', 'telegram_chat_id',
+                'created_at')
+
+
+class ConnectionPool:
+    """Пул соединений одного процесса."""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                               check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                if self._created < self.size:
+                    self._created += 1
+                    conn = self._open()
+        if conn is None:
+            conn = self._idle.get(timeout=30)
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+
+class SqliteUserStore(BaseUserStore):
+    def __init__(self, pool):
+        self.pool = pool
+
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        user = dict(row)
+        user['is_admin'] = bool(user['is_admin'])
+        return user
+
+    def create(self, login, password, username=None, is_admin=False,
+               ton_wallet=None, card_details=None, telegram_chat_id=None):
+        user = self._new_user(login, password, username, is_admin, ton_wallet,
+                              card_details, telegram_chat_id)
+        try:
+            with self.pool.transaction() as conn:
+                conn.execute(
+                    'INSERT INTO users (user_id, login, username, password_hash, is_admin, '
+                    'successful_deals, ton_wallet, card_details, telegram_chat_id, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [user[c] for c in USER_COLUMNS],
+                )
+        except sqlite3.IntegrityError:
+            raise ValueError(f'Пользователь {login} уже существует') from None
+        return user
+
+    def get(self, user_id):
+        with self.pool.connection() as conn:
+            return self._row(conn.execute(
+                'SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone())
+
+    def get_by_login(self, login):
+        with self.pool.connection() as conn:
+            return self._row(conn.execute(
+                'SELECT * FROM users WHERE login = ?', (login,)).fetchone())
+
+    def all(self):
+        with self.pool.connection() as conn:
+            return [self._row(r) for r in conn.execute('SELECT * FROM users ORDER BY created_at')]
+
+    def iter_all(self, batch_size=1000):
+        # Keyset по rowid: порядок вставки, каждая порция — поиск по B-дереву
+        last = 0
+        while True:
+            with self.pool.connection() as conn:
+                rows = conn.execute('SELECT rowid, * FROM users WHERE rowid > ? '
+                                    'ORDER BY rowid LIMIT ?', (last, batch_size)).fetchall()
+            if not rows:
+                return
+            last = rows[-1]['rowid']
+            for row in rows:
+                user = self._row(row)
+                del user['rowid']
+                yield user
+
+    def record_successful_deal(self, user_id, conn=None):
+        """``conn`` — уже открытая транзакция, например смены статуса сделки."""
+        if conn is None:
+            with self.pool.transaction() as conn:
+                return self.record_successful_deal(user_id, conn)
+        conn.execute('UPDATE users SET successful_deals = successful_deals + 1 '
+                     'WHERE user_id = ?', (user_id,))
+
+    def set_password_hash(self, user_id, password_hash):
+        with self.pool.transaction() as conn:
+            conn.execute('UPDATE users SET password_hash = ? WHERE user_id = ?',
+                         (password_hash, user_id))
+
+    def __len__(self):
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+
+class SqliteRecordStore(RecordStore):
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        # hook(conn, record, old_status) внутри транзакции создания
+        # (old_status=None) или смены статуса, до COMMIT: то, что должно
+        # зафиксироваться вместе с записью (расчёт по сделке, счётчики
+        # статистики). Исключение откатывает и саму запись.
+        self.transaction_hooks = []
+        columns = ', '.join(self.fields)
+        table = self.table
+        # Все выражения собираются один раз — дальше только параметры
+        self._sql_insert = (f'INSERT INTO {table} ({columns}) '
+                            f'VALUES ({", ".join("?" * len(self.fields))})')
+        self._sql_get = f'SELECT {columns} FROM {table} WHERE id = ?'
+        # Подзапрос — только по индексу (user_id, seq), затем поиск строк по rowid
+        self._sql_page = (f'SELECT seq, {columns} FROM {table} WHERE seq IN '
+                          f'(SELECT seq FROM {table} WHERE user_id = ? AND seq < ? '
+                          f'ORDER BY seq DESC LIMIT ?) ORDER BY seq DESC')
+        self._sql_scan = (f'SELECT seq, {columns} FROM {table} '
+                          f'WHERE seq > ? ORDER BY seq LIMIT ?')
+        self._sql_status = f'SELECT status FROM {table} WHERE id = ?'
+        self._sql_set_status = f'UPDATE {table} SET status = ?, updated_at = ? WHERE id = ?'
+        self._sql_count_owner = f'SELECT COUNT(*) FROM {table} WHERE user_id = ?'
+        self._sql_count_owner_status = (f'SELECT status, COUNT(*) FROM {table} '
+                                        f'WHERE user_id = ? GROUP BY status')
+        self._sql_by_status = f'SELECT id FROM {table} WHERE status = ?'
+        # Индекс (status, id): id растут со временем, старые записи статуса идут первыми
+        self._sql_finished = (f'SELECT {columns} FROM {table} '
+                              f'WHERE status = ? AND updated_at < ? ORDER BY id LIMIT ?')
+        self._sql_delete = f'DELETE FROM {table} WHERE id = ?'
+        self._sql_delete_log = f'DELETE FROM {table}_transitions WHERE record_id = ?'
+        # Выражение совпадает с индексом *_by_short_id — иначе SQLite его не возьмёт
+        self._sql_short_id = (f'SELECT {columns} FROM {table} '
+                              f'WHERE substr(id, -{SHORT_ID_LENGTH}) = ?')
+        self._sql_count = f'SELECT COUNT(*) FROM {table}'
+        self._sql_log = (f'INSERT INTO {table}_transitions (record_id, old_status, new_status, at) '
+                         f'VALUES (?, ?, ?, ?)')
+        self._sql_history = (f'SELECT old_status, new_status, at FROM {table}_transitions '
+                             f'WHERE record_id = ? ORDER BY seq')
+
+    def _record(self, row):
+        return {key: row[key] for key in self.fields}
+
+    def _store(self, record):
+        with self.pool.transaction() as conn:
+            conn.execute(self._sql_insert, [record[f] for f in self.fields])
+            conn.execute(self._sql_log, (record['id'], None, record['status'], record['created_at']))
+            for hook in self.transaction_hooks:
+                hook(conn, record, None)
+
+    def _apply_status(self, record_id, status, updated_at, expected=None):
+        with self.pool.transaction() as conn:
+            row = conn.execute(self._sql_status, (record_id,)).fetchone()
+            if row is None:
+                raise KeyError(record_id)
+            self.check_transition(row['status'], status, expected)
+            conn.execute(self._sql_set_status, (status, updated_at, record_id))
+            conn.execute(self._sql_log, (record_id, row['status'], status, updated_at))
+            record = self._record(conn.execute(self._sql_get, (record_id,)).fetchone())
+            for hook in self.transaction_hooks:
+                hook(conn, record, row['status'])
+        return record, row['status']
+
+    def history(self, record_id):
+        with self.pool.connection() as conn:
+            rows = conn.execute(self._sql_history, (record_id,)).fetchall()
+        return [{'from': old, 'to': new, 'at': at} for old, new, at in rows]
+
+    def get(self, record_id):
+        with self.pool.connection() as conn:
+            row = conn.execute(self._sql_get, (record_id,)).fetchone()
+        return self._record(row) if row else None
+
+    def list_by_owner(self, user_id, limit=None, before=None):
+        upper = decode_cursor(before) if before is not None else 2 ** 63 - 1
+        # Берём на одну запись больше, чтобы знать, есть ли следующая страница
+        fetch = -1 if limit is None else limit + 1
+        with self.pool.connection() as conn:
+            rows = conn.execute(self._sql_page, (user_id, upper, fetch)).fetchall()
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['seq'])
+        return [self._record(r) for r in rows], next_cursor
+
+    def all(self):
+        return list(self.iter_all())
+
+    def iter_all(self, batch_size=1000, conn=None):
+        """``conn`` — открытая читающая транзакция: весь обход в одном снимке."""
+        last = 0
+        while True:
+            if conn is not None:
+                rows = conn.execute(self._sql_scan, (last, batch_size)).fetchall()
+            else:
+                with self.pool.connection() as pooled:
+                    rows = pooled.execute(self._sql_scan, (last, batch_size)).fetchall()
+            if not rows:
+                return
+            last = rows[-1]['seq']
+            for row in rows:
+                yield self._record(row)
+
+    def count_by_owner(self, user_id):
+        with self.pool.connection() as conn:
+            return conn.execute(self._sql_count_owner, (user_id,)).fetchone()[0]
+
+    def find_by_short_id(self, ref):
+        with self.pool.connection() as conn:
+            rows = conn.execute(self._sql_short_id, (ref[-SHORT_ID_LENGTH:],)).fetchall()
+        return [self._record(r) for r in rows if r['id'].endswith(ref)]
+
+    def count_by_owner_status(self, user_id):
+        with self.pool.connection() as conn:
+            return dict(conn.execute(self._sql_count_owner_status, (user_id,)).fetchall())
+
+    def ids_by_status(self, status):
+        with self.pool.connection() as conn:
+            return {r[0] for r in conn.execute(self._sql_by_status, (status,))}
+
+    def finished_before(self, statuses, updated_before, limit):
+        with self.pool.connection() as conn:
+            records = [self._record(r) for status in statuses
+                       for r in conn.execute(self._sql_finished, (status, updated_before, limit))]
+        records.sort(key=itemgetter('updated_at'))
+        return records[:limit]
+
+    def remove(self, record_ids):
+        params = [(record_id,) for record_id in record_ids]
+        with self.pool.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(self._sql_delete, params)
+            removed = conn.total_changes - before
+            conn.executemany(self._sql_delete_log, params)
+        return removed
+
+    def __len__(self):
+        with self.pool.connection() as conn:
+            return conn.execute(self._sql_count).fetchone()[0]
+
+
+class SqliteDealStore(DealRecords, SqliteRecordStore):
+    pass
+
+
+class SqliteTicketStore(TicketRecords, SqliteRecordStore):
+    pass
+
+
+def open_stores(path, pool_size=POOL_SIZE):
+    pool = ConnectionPool(path, pool_size)
+    with pool.connection() as conn:
+        conn.executescript(SCHEMA)
+    return SqliteUserStore(pool), SqliteDealStore(pool), SqliteTicketStore(pool)
@@ -0,0 +1,257 @@
+"""Счётчики для админской статистики.
+
+Счётчики обновляются слушателями хранилищ на каждом создании и смене
+статуса, поэтому ``/api/admin/stats`` отдаёт готовые числа, не просматривая
+сделки. ``rebuild`` пересчитывает всё с нуля по сырым данным и сообщает,
+какие счётчики разошлись; данные он получает от ``scan(conn)`` — функции,
+возвращающей пару итераторов ``(сделки, тикеты)``.
+
+``Stats`` держит счётчики в памяти процесса и годится только для
+``memory://``, где и данные живут в одном процессе. С общим хранилищем
+счётчики лежат в его же базе (``SqliteStats``) и меняются в транзакции
+создания или смены статуса — все воркеры gunicorn видят одни числа.
+Пересчёт там не блокирует запись: данные и сами счётчики читаются в одной
+читающей транзакции (снимок WAL), а в таблицы под блокировкой записи
+добавляется только разница между посчитанным и снимком — изменения,
+пришедшие во время подсчёта, сохраняются. Архивация удаляет сделки из
+хранилища, но не из счётчиков.
+"""
+
+import threading
+from collections import Counter, defaultdict
+
+from ledger import from_minor, to_minor
+from store import DEAL_STATUSES, PAYMENT_METHODS, TICKET_STATUSES
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.deal_count = Counter()          # (status, method) -> count
+        self.deal_volume = Counter()         # (status, method) -> minor units
+        self.ticket_count = Counter()        # status -> count
+        self.active_deals_by_user = Counter()
+
+    def on_deal(self, deal, old_status):
+        key = (deal['status'], deal['payment_method'])
+        amount = to_minor(deal['amount'])
+        with self._lock:
+            if old_status is not None:
+                old_key = (old_status, deal['payment_method'])
+                self.deal_count[old_key] -= 1
+                self.deal_volume[old_key] -= amount
+                if old_status == 'active':
+                    self._deactivate(deal['user_id'])
+            self.deal_count[key] += 1
+            self.deal_volume[key] += amount
+            if deal['status'] == 'active':
+                self.active_deals_by_user[deal['user_id']] += 1
+
+    def _deactivate(self, user_id):
+        self.active_deals_by_user[user_id] -= 1
+        if self.active_deals_by_user[user_id] <= 0:
+            del self.active_deals_by_user[user_id]
+
+    def on_ticket(self, ticket, old_status):
+        with self._lock:
+            if old_status is not None:
+                self.ticket_count[old_status] -= 1
+            self.ticket_count[ticket['status']] += 1
+
+    def counters(self):
+        """``(deal_count, deal_volume, ticket_count, users_active)``."""
+        with self._lock:
+            return (dict(self.deal_count), dict(self.deal_volume),
+                    dict(self.ticket_count), len(self.active_deals_by_user))
+
+    def snapshot(self, users_total):
+        deal_count, deal_volume, ticket_count, users_active = self.counters()
+        by_status = {}
+        for status in DEAL_STATUSES:
+            by_status[status] = {
+                'count': sum(deal_count.get((status, m), 0) for m in PAYMENT_METHODS),
+                'volume': {m: from_minor(deal_volume.get((status, m), 0)) for m in PAYMENT_METHODS},
+            }
+        by_method = {}
+        for method in PAYMENT_METHODS:
+            by_method[method] = {
+                'count': sum(deal_count.get((s, method), 0) for s in DEAL_STATUSES),
+                'volume': from_minor(sum(deal_volume.get((s, method), 0) for s in DEAL_STATUSES)),
+            }
+        return {
+            'deals': {
+                'total': sum(deal_count.values()),
+                'by_status': by_status,
+                'by_payment_method': by_method,
+            },
+            'tickets': {
+                'open': ticket_count.get('open', 0),
+                'by_status': {s: ticket_count.get(s, 0) for s in TICKET_STATUSES},
+            },
+            'users': {
+                'total': users_total,
+                'with_active_deals': users_active,
+            },
+        }
+
+    def rebuild(self, scan):
+        """Пересчитывает счётчики по сырым данным; возвращает расхождения."""
+        # Держим lock весь пересчёт, чтобы не потерять параллельные обновления
+        with self._lock:
+            fresh = count_all(*scan(None))
+            drift = diff(self, fresh)
+            for name in COUNTERS:
+                setattr(self, name, getattr(fresh, name))
+        return drift
+
+
+COUNTERS = ('deal_count', 'deal_volume', 'ticket_count', 'active_deals_by_user')
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stats_deals (
+    status TEXT NOT NULL,
+    payment_method TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    volume INTEGER NOT NULL,
+    PRIMARY KEY (status, payment_method)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats_tickets (
+    status TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats_active_users (
+    user_id TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats_rebuilds (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    generation INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO stats_rebuilds VALUES (1, 0);
+'''
+
+
+def count_all(all_deals, all_tickets):
+    fresh = Stats()
+    for deal in all_deals:
+        fresh.on_deal(deal, None)
+    for ticket in all_tickets:
+        fresh.on_ticket(ticket, None)
+    return fresh
+
+
+def diff(old_stats, new_stats):
+    drift = defaultdict(dict)
+    for name in COUNTERS:
+        old, new = getattr(old_stats, name), getattr(new_stats, name)
+        for key in set(old) | set(new):
+            if old.get(key, 0) != new.get(key, 0):
+                drift[name][str(key)] = {'was': old.get(key, 0), 'now': new.get(key, 0)}
+    return dict(drift)
+
+
+class SqliteStats(Stats):
+    """Счётчики в SQLite-хранилище; обновляются хуками ``transaction_hooks``."""
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        with pool.connection() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+
+    def on_deal_in_transaction(self, conn, deal, old_status):
+        amount = to_minor(deal['amount'])
+        method = deal['payment_method']
+        rows = [(deal['status'], method, 1, amount)]
+        if old_status is not None:
+            rows.append((old_status, method, -1, -amount))
+        conn.executemany(
+            'INSERT INTO stats_deals VALUES (?, ?, ?, ?) ON CONFLICT DO UPDATE SET '
+            'count = count + excluded.count, volume = volume + excluded.volume', rows)
+        if deal['status'] == 'active':
+            conn.execute('INSERT INTO stats_active_users VALUES (?, 1) '
+                         'ON CONFLICT DO UPDATE SET count = count + 1', (deal['user_id'],))
+        elif old_status == 'active':
+            conn.execute('UPDATE stats_active_users SET count = count - 1 WHERE user_id = ?',
+                         (deal['user_id'],))
+            conn.execute('DELETE FROM stats_active_users WHERE user_id = ? AND count <= 0',
+                         (deal['user_id'],))
+
+    def on_ticket_in_transaction(self, conn, ticket, old_status):
+        rows = [(ticket['status'], 1)]
+        if old_status is not None:
+            rows.append((old_status, -1))
+        conn.executemany('INSERT INTO stats_tickets VALUES (?, ?) '
+                         'ON CONFLICT DO UPDATE SET count = count + excluded.count', rows)
+
+    def _load(self, conn):
+        stored = Stats()
+        for status, method, count, volume in conn.execute('SELECT * FROM stats_deals'):
+            stored.deal_count[(status, method)] = count
+            stored.deal_volume[(status, method)] = volume
+        stored.ticket_count.update(dict(conn.execute('SELECT * FROM stats_tickets')))
+        stored.active_deals_by_user.update(dict(conn.execute('SELECT * FROM stats_active_users')))
+        return stored
+
+    def counters(self):
+        # Таблицы сделок и тикетов — десятки строк; активных продавцов только считаем
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN')
+            try:
+                deal_count, deal_volume = {}, {}
+                for status, method, count, volume in conn.execute('SELECT * FROM stats_deals'):
+                    deal_count[(status, method)] = count
+                    deal_volume[(status, method)] = volume
+                ticket_count = dict(conn.execute('SELECT * FROM stats_tickets'))
+                users_active = conn.execute('SELECT COUNT(*) FROM stats_active_users').fetchone()[0]
+            finally:
+                conn.execute('COMMIT')
+        return deal_count, deal_volume, ticket_count, users_active
+
+    def is_empty(self):
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT NOT EXISTS (SELECT 1 FROM stats_deals) '
+                                'AND NOT EXISTS (SELECT 1 FROM stats_tickets)').fetchone()[0]
+
+    def rebuild(self, scan):
+        """``scan(conn)`` читает данные через ``conn`` — в том же снимке, что и счётчики."""
+        while True:
+            with self.pool.connection() as conn:
+                conn.execute('BEGIN')
+                try:
+                    generation = conn.execute(
+                        'SELECT generation FROM stats_rebuilds').fetchone()[0]
+                    stored = self._load(conn)
+                    fresh = count_all(*scan(conn))
+                finally:
+                    conn.execute('COMMIT')
+            with self.pool.transaction() as conn:
+                # Параллельный пересчёт (другой воркер при старте) уже внёс ту же
+                # поправку — считаем заново от его результата
+                if conn.execute('SELECT generation FROM stats_rebuilds').fetchone()[0] != generation:
+                    continue
+                conn.execute('UPDATE stats_rebuilds SET generation = generation + 1')
+                self._apply_correction(conn, stored, fresh)
+            return diff(stored, fresh)
+
+    @staticmethod
+    def _apply_correction(conn, stored, fresh):
+        def delta(name):
+            old, new = getattr(stored, name), getattr(fresh, name)
+            return {key: new.get(key, 0) - old.get(key, 0) for key in set(old) | set(new)
+                    if new.get(key, 0) != old.get(key, 0)}
+        counts, volumes = delta('deal_count'), delta('deal_volume')
+        conn.executemany(
+            'INSERT INTO stats_deals VALUES (?, ?, ?, ?) ON CONFLICT DO UPDATE SET '
+            'count = count + excluded.count, volume = volume + excluded.volume',
+            [(*key, counts.get(key, 0), volumes.get(key, 0)) for key in set(counts) | set(volumes)])
+        conn.executemany('INSERT INTO stats_tickets VALUES (?, ?) '
+                         'ON CONFLICT DO UPDATE SET count = count + excluded.count',
+                         delta('ticket_count').items())
+        conn.executemany('INSERT INTO stats_active_users VALUES (?, ?) '
+                         'ON CONFLICT DO UPDATE SET count = count + excluded.count',
+                         delta('active_deals_by_user').items())
+        conn.execute('DELETE FROM stats_active_users WHERE count <= 0')
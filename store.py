@@ -0,0 +1,581 @@
+"""Хранилища пользователей, сделок и тикетов.
+
+Интерфейс хранилищ описан базовыми классами ``BaseUserStore`` и
+``RecordStore``; здесь же реализация в памяти процесса, где сделки и
+тикеты индексируются по владельцу и по статусу, так что выборка «мои
+сделки» не зависит от общего объёма данных. SQLite-бэкенд — в
+``sqlite_store.py``, выбирается через ``open_stores(url)``.
+"""
+
+import base64
+import hashlib
+import hmac
+import itertools
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from operator import attrgetter, itemgetter
+
+DEAL_STATUSES = ('active', 'confirmed', 'completed', 'cancelled')
+# Допустимые переходы; завершённая и отменённая сделка — конечные состояния
+DEAL_TRANSITIONS = {
+    'active': ('confirmed', 'cancelled'),
+    'confirmed': ('completed', 'cancelled'),
+    'completed': (),
+    'cancelled': (),
+}
+TICKET_STATUSES = ('open', 'in_progress', 'closed')
+PAYMENT_METHODS = ('ton', 'sbp', 'stars')
+
+PASSWORD_SCHEME = 'pbkdf2_sha256'
+PASSWORD_ITERATIONS = int(os.environ.get('PASSWORD_ITERATIONS', 200_000))
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def utcnow_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+# Crockford base32 в нижнем регистре: без i, l, o, u — их не перепутать при вводе
+ID_ALPHABET = '0123456789abcdefghjkmnpqrstvwxyz'
+ID_LENGTH = 26
+# Номер сделки на карточке и в поддержке — хвост id такой длины
+SHORT_ID_LENGTH = 8
+_ID_TYPOS = str.maketrans('ilo', '110')
+
+
+class IdGenerator:
+    """ULID-подобные id: 48 бит миллисекунд и 80 бит случайности, 26 символов.
+
+    Строки упорядочены по времени создания, поэтому новые записи ложатся в
+    конец B-дерева индекса по id, а не в случайное место. Внутри одной
+    миллисекунды процесс увеличивает случайную часть на случайный шаг: id
+    остаются монотонными и не угадываются по соседнему. Воркеры не
+    координируются — столкновение требует совпадения 80 случайных бит.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_ms = 0
+        self._random = 0
+
+    def __call__(self):
+        ms = time.time_ns() // 1_000_000
+        with self._lock:
+            if self._pid != os.getpid():
+                # После fork продолжать последовательность родителя нельзя
+                self._pid = os.getpid()
+                self._last_ms = 0
+            if ms <= self._last_ms:
+                # Та же миллисекунда или часы ушли назад: держим порядок
+                ms = self._last_ms
+                self._random += 1 + int.from_bytes(os.urandom(4), 'big')
+                if self._random >> 80:
+                    ms += 1
+                    self._random &= (1 << 80) - 1
+            else:
+                self._random = int.from_bytes(os.urandom(10), 'big')
+            self._last_ms = ms
+            value = ms << 80 | self._random
+        return self._encode(value)
+
+    def at(self, timestamp):
+        """Id записи, созданной в ``timestamp`` (секунды) — для импорта и
+        генераторов исторических данных. Последовательность генератора не
+        трогает; порядок внутри одной миллисекунды случайный."""
+        ms = int(timestamp * 1000)
+        return self._encode(ms << 80 | int.from_bytes(os.urandom(10), 'big'))
+
+    @staticmethod
+    def _encode(value):
+        chars = []
+        for _ in range(ID_LENGTH):
+            chars.append(ID_ALPHABET[value & 31])
+            value >>= 5
+        return ''.join(reversed(chars))
+
+
+new_id = IdGenerator()
+
+
+def normalize_ref(ref):
+    """Id или его хвост, как его ввёл человек: регистр и похожие буквы не важны."""
+    return ref.strip().lower().translate(_ID_TYPOS)
+
+
+def encode_cursor(seq):
+    return base64.urlsafe_b64encode(str(seq).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Порядковый номер записи из курсора; ValueError для мусора."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError('Некорректный курсор') from exc
+
+
+def project(record, fields):
+    if not fields:
+        return record
+    return {key: record[key] for key in fields if key in record}
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+class Record:
+    """Запись в памяти: слоты вместо словаря на каждую строку.
+
+    Наружу хранилище отдаёт ``as_dict()`` — свежий словарь, который можно
+    сериализовать и менять, не трогая хранимое состояние.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, values):
+        for name in self.__slots__:
+            setattr(self, name, values[name])
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def record_type(name, fields):
+    return type(name, (Record,), {'__slots__': fields})
+
+
+def hash_password(password, salt=None, iterations=None):
+    salt = salt or os.urandom(16)
+    iterations = iterations or PASSWORD_ITERATIONS
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f'{PASSWORD_SCHEME}${iterations}${salt.hex()}${digest.hex()}'
+
+
+def verify_password(password, encoded):
+    try:
+        _, iterations, salt, digest = encoded.split('$')
+    except (AttributeError, ValueError):
+        return False
+    candidate = hash_password(password, bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(candidate.rsplit('$', 1)[1], digest)
+
+
+def needs_rehash(encoded, iterations=None):
+    """True, если хеш сделан с другими параметрами, чем текущие."""
+    scheme, _, rest = encoded.partition('$')
+    return scheme != PASSWORD_SCHEME or rest.split('$', 1)[0] != str(iterations or PASSWORD_ITERATIONS)
+
+
+class BaseUserStore:
+    """Пользователи по id и по логину."""
+
+    def create(self, login, password, username=None, is_admin=False,
+               ton_wallet=None, card_details=None, telegram_chat_id=None):
+        raise NotImplementedError
+
+    def get(self, user_id):
+        raise NotImplementedError
+
+    def get_by_login(self, login):
+        raise NotImplementedError
+
+    def all(self):
+        raise NotImplementedError
+
+    def iter_all(self, batch_size=1000):
+        """Все пользователи порциями, без копии всей таблицы — для выгрузок."""
+        raise NotImplementedError
+
+    def record_successful_deal(self, user_id):
+        raise NotImplementedError
+
+    def set_password_hash(self, user_id, password_hash):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    @staticmethod
+    def _new_user(login, password, username, is_admin, ton_wallet, card_details,
+                  telegram_chat_id):
+        return {
+            'user_id': new_id(),
+            'login': login,
+            'username': username or login,
+            'password_hash': hash_password(password),
+            'is_admin': bool(is_admin),
+            'successful_deals': 0,
+            'ton_wallet': ton_wallet,
+            'card_details': card_details,
+            'telegram_chat_id': telegram_chat_id,
+            'created_at': utcnow_iso(),
+        }
+
+    def authenticate(self, login, password):
+        user = self.get_by_login(login)
+        if user and verify_password(password, user['password_hash']):
+            return user
+        return None
+
+
+class UserStore(BaseUserStore):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}
+        self._by_login = {}
+
+    def create(self, login, password, username=None, is_admin=False,
+               ton_wallet=None, card_details=None, telegram_chat_id=None):
+        user = self._new_user(login, password, username, is_admin, ton_wallet,
+                              card_details, telegram_chat_id)
+        with self._lock:
+            if login in self._by_login:
+                raise ValueError(f'Пользователь {login} уже существует')
+            self._users[user['user_id']] = user
+            self._by_login[login] = user['user_id']
+        return user
+
+    def get(self, user_id):
+        return self._users.get(user_id)
+
+    def get_by_login(self, login):
+        user_id = self._by_login.get(login)
+        return self._users.get(user_id) if user_id else None
+
+    def all(self):
+        with self._lock:
+            return list(self._users.values())
+
+    def iter_all(self, batch_size=1000):
+        with self._lock:
+            ids = list(self._users)
+        for start in range(0, len(ids), batch_size):
+            with self._lock:
+                batch = [self._users[i] for i in ids[start:start + batch_size]]
+            yield from batch
+
+    def record_successful_deal(self, user_id):
+        with self._lock:
+            self._users[user_id]['successful_deals'] += 1
+
+    def set_password_hash(self, user_id, password_hash):
+        with self._lock:
+            self._users[user_id]['password_hash'] = password_hash
+
+    def __len__(self):
+        return len(self._users)
+
+
+class RecordStore:
+    """Общая часть хранилищ сделок и тикетов: проверка статусов и слушатели.
+
+    Бэкенд реализует ``_store``, ``_apply_status`` и методы чтения.
+    Курсор страницы — закодированный ``seq``, монотонный номер записи.
+    """
+
+    statuses = ()
+    fields = ()
+    transitions = None   # {статус: куда можно перейти}; None — любой переход
+
+    def __init__(self):
+        # Вызываются как listener(record, old_status) после создания записи
+        # (old_status=None) и после каждой смены статуса
+        self.listeners = []
+
+    def _notify(self, record, old_status):
+        for listener in self.listeners:
+            listener(record, old_status)
+
+    def _insert(self, record):
+        self._store(record)
+        self._notify(record, None)
+        return record
+
+    def set_status(self, record_id, status, expected=None):
+        """``expected`` — compare-and-set: статус меняется, только если текущий равен ему."""
+        if status not in self.statuses:
+            raise ValueError(f'Неизвестный статус: {status}')
+        record, old_status = self._apply_status(record_id, status, utcnow_iso(), expected)
+        self._notify(record, old_status)
+        return record
+
+    def check_transition(self, old_status, status, expected=None):
+        """Бэкенд вызывает её под своей блокировкой/транзакцией, до записи."""
+        if expected is not None and old_status != expected:
+            raise InvalidTransition(f'Статус уже {old_status}, а не {expected}')
+        if self.transitions is not None and status not in self.transitions.get(old_status, ()):
+            raise InvalidTransition(f'Недопустимый переход статуса: {old_status} → {status}')
+
+    def _store(self, record):
+        raise NotImplementedError
+
+    def _apply_status(self, record_id, status, updated_at, expected=None):
+        """Меняет статус и пишет переход в журнал; возвращает ``(record, old_status)``.
+
+        KeyError, если записи нет; InvalidTransition, если переход запрещён
+        или текущий статус не равен ``expected``.
+        """
+        raise NotImplementedError
+
+    def history(self, record_id):
+        """Журнал переходов записи: [{'from', 'to', 'at'}], первым — создание."""
+        raise NotImplementedError
+
+    def get(self, record_id):
+        raise NotImplementedError
+
+    def list_by_owner(self, user_id, limit=None, before=None):
+        """Записи пользователя, новые первыми.
+
+        ``before`` — курсор из предыдущей страницы. Возвращает пару
+        ``(records, next_cursor)``; ``next_cursor`` равен None на последней
+        странице.
+        """
+        raise NotImplementedError
+
+    def all(self):
+        """Снимок всех записей — для пересчётов, не для запросов."""
+        raise NotImplementedError
+
+    def iter_all(self, batch_size=1000):
+        """Все записи в порядке создания порциями, без копии всей таблицы."""
+        raise NotImplementedError
+
+    def count_by_owner(self, user_id):
+        raise NotImplementedError
+
+    def count_by_owner_status(self, user_id):
+        """{статус: число записей пользователя}; статусы без записей не попадают."""
+        raise NotImplementedError
+
+    def find_by_short_id(self, ref):
+        """Записи, чей id оканчивается на ``ref`` (не короче ``SHORT_ID_LENGTH``).
+
+        Поиск идёт по индексу последних ``SHORT_ID_LENGTH`` символов id.
+        """
+        raise NotImplementedError
+
+    def ids_by_status(self, status):
+        raise NotImplementedError
+
+    def finished_before(self, statuses, updated_before, limit):
+        """До ``limit`` записей в ``statuses``, не менявшихся с ``updated_before`` (ISO).
+
+        Кандидаты для архива; порядок — от старых к новым по ``updated_at``.
+        """
+        raise NotImplementedError
+
+    def remove(self, record_ids):
+        """Удаляет записи вместе с журналом переходов, не вызывая слушателей.
+
+        Только для архивации: записи к этому моменту уже лежат в архиве, и
+        счётчики статистики их по-прежнему учитывают. Возвращает число
+        удалённых записей.
+        """
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemoryRecordStore(RecordStore):
+    """Записи в памяти с индексами по владельцу и по статусу.
+
+    Индекс владельца хранит пары ``(seq, id)`` в порядке создания: последние
+    записи пользователя берутся с конца списка без сортировки, а позиция
+    курсора находится бинарным поиском по ``seq`` — O(log n + limit).
+    Сами записи — объекты со ``__slots__`` (см. ``Record``), переходы
+    статусов дописываются в журнал ``(old, new, at)`` каждой записи.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.RLock()
+        self._seq = itertools.count(1)
+        self._type = record_type(f'{type(self).__name__}Record', self.fields)
+        self._records = {}
+        self._order = []
+        self._by_owner = defaultdict(list)
+        self._by_status = defaultdict(set)
+        self._owner_status = Counter()   # (user_id, status) -> число записей
+        self._by_short_id = defaultdict(list)
+        self._log = {}
+
+    def _store(self, record):
+        with self._lock:
+            self._records[record['id']] = self._type(record)
+            self._order.append(record['id'])
+            self._by_owner[record['user_id']].append((next(self._seq), record['id']))
+            self._by_status[record['status']].add(record['id'])
+            self._owner_status[record['user_id'], record['status']] += 1
+            self._by_short_id[record['id'][-SHORT_ID_LENGTH:]].append(record['id'])
+            self._log[record['id']] = [(None, record['status'], record['created_at'])]
+
+    def _apply_status(self, record_id, status, updated_at, expected=None):
+        with self._lock:
+            record = self._records[record_id]
+            old_status = record.status
+            self.check_transition(old_status, status, expected)
+            self._by_status[old_status].discard(record_id)
+            self._by_status[status].add(record_id)
+            self._owner_status[record.user_id, old_status] -= 1
+            self._owner_status[record.user_id, status] += 1
+            record.status = status
+            record.updated_at = updated_at
+            self._log[record_id].append((old_status, status, updated_at))
+            return record.as_dict(), old_status
+
+    def history(self, record_id):
+        with self._lock:
+            log = list(self._log.get(record_id, ()))
+        return [{'from': old, 'to': new, 'at': at} for old, new, at in log]
+
+    def get(self, record_id):
+        record = self._records.get(record_id)
+        return record.as_dict() if record is not None else None
+
+    def list_by_owner(self, user_id, limit=None, before=None):
+        with self._lock:
+            index = self._by_owner.get(user_id, ())
+            end = len(index)
+            if before is not None:
+                end = bisect_left(index, decode_cursor(before), key=itemgetter(0))
+            start = 0 if limit is None else max(0, end - limit)
+            page = index[start:end]
+            records = [self._records[record_id].as_dict() for _, record_id in reversed(page)]
+        next_cursor = encode_cursor(page[0][0]) if page and start > 0 else None
+        return records, next_cursor
+
+    def all(self):
+        with self._lock:
+            return [record.as_dict() for record in self._records.values()]
+
+    def iter_all(self, batch_size=1000):
+        position = 0
+        while True:
+            with self._lock:
+                ids = self._order[position:position + batch_size]
+                records = [self._records[i].as_dict() for i in ids if i in self._records]
+            if not ids:
+                return
+            position += len(ids)
+            yield from records
+
+    def count_by_owner(self, user_id):
+        return len(self._by_owner.get(user_id, ()))
+
+    def find_by_short_id(self, ref):
+        with self._lock:
+            ids = self._by_short_id.get(ref[-SHORT_ID_LENGTH:], ())
+            return [self._records[i].as_dict() for i in ids if i.endswith(ref)]
+
+    def count_by_owner_status(self, user_id):
+        with self._lock:
+            counts = {status: self._owner_status[user_id, status] for status in self.statuses}
+        return {status: count for status, count in counts.items() if count}
+
+    def ids_by_status(self, status):
+        with self._lock:
+            return set(self._by_status.get(status, ()))
+
+    def finished_before(self, statuses, updated_before, limit):
+        with self._lock:
+            found = [record for status in statuses for record_id in self._by_status.get(status, ())
+                     if (record := self._records[record_id]).updated_at < updated_before]
+            found.sort(key=attrgetter('updated_at'))
+            return [record.as_dict() for record in found[:limit]]
+
+    def remove(self, record_ids):
+        with self._lock:
+            removed = [self._records.pop(i) for i in record_ids if i in self._records]
+            owners = set()
+            for record in removed:
+                owners.add(record.user_id)
+                self._by_status[record.status].discard(record.id)
+                self._owner_status[record.user_id, record.status] -= 1
+                short = self._by_short_id[record.id[-SHORT_ID_LENGTH:]]
+                short.remove(record.id)
+                if not short:
+                    del self._by_short_id[record.id[-SHORT_ID_LENGTH:]]
+                del self._log[record.id]
+            # Списки владельцев и порядок создания пересобираются раз на пачку
+            for user_id in owners:
+                index = [item for item in self._by_owner[user_id] if item[1] in self._records]
+                if index:
+                    self._by_owner[user_id] = index
+                else:
+                    del self._by_owner[user_id]
+            if removed:
+                self._order = [i for i in self._order if i in self._records]
+        return len(removed)
+
+    def __len__(self):
+        return len(self._records)
+
+
+class DealRecords:
+    table = 'deals'
+    statuses = DEAL_STATUSES
+    transitions = DEAL_TRANSITIONS
+    fields = ('id', 'user_id', 'amount', 'description', 'payment_method',
+              'status', 'created_at', 'updated_at')
+
+    def create(self, user_id, amount, description, payment_method):
+        now = utcnow_iso()
+        return self._insert({
+            'id': new_id(),
+            'user_id': user_id,
+            'amount': amount,
+            'description': description,
+            'payment_method': payment_method,
+            'status': 'active',
+            'created_at': now,
+            'updated_at': now,
+        })
+
+
+class TicketRecords:
+    table = 'tickets'
+    statuses = TICKET_STATUSES
+    fields = ('id', 'user_id', 'subject', 'message', 'status',
+              'created_at', 'updated_at')
+
+    def create(self, user_id, subject, message):
+        now = utcnow_iso()
+        return self._insert({
+            'id': new_id(),
+            'user_id': user_id,
+            'subject': subject,
+            'message': message,
+            'status': 'open',
+            'created_at': now,
+            'updated_at': now,
+        })
+
+
+class DealStore(DealRecords, MemoryRecordStore):
+    pass
+
+
+class TicketStore(TicketRecords, MemoryRecordStore):
+    pass
+
+
+def open_stores(url='memory://'):
+    """``(users, deals, tickets)`` для ``memory://`` или ``sqlite:///path``."""
+    if url.startswith('memory://'):
+        return UserStore(), DealStore(), TicketStore()
+    if url.startswith('sqlite:///'):
+        # sqlite:///data.db — относительный путь, sqlite:////var/db/otc.db — абсолютный
+        import sqlite_store
+        return sqlite_store.open_stores(url[len('sqlite:///'):])
+    raise ValueError(f'Неизвестное хранилище: {url}')
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули лежат в корне репозитория, как и для bench/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,48 @@
+"""SSE-события между воркерами через общую SQLite-базу."""
+
+from events import EventBus, EventRelay
+from sqlite_store import open_stores
+
+
+def worker(path):
+    _, deals, _ = open_stores(path)
+    bus = EventBus()
+    relay = EventRelay(deals.pool, bus)
+
+    def publish(conn, deal, old_status):
+        if old_status is not None:
+            relay.publish(conn, deal['user_id'], 'deal', {'id': deal['id'], 'status': deal['status']})
+    deals.transaction_hooks.append(publish)
+    return deals, bus, relay
+
+
+def test_status_change_reaches_subscriber_of_other_worker(tmp_path):
+    path = str(tmp_path / 'otc.db')
+    deals_a, bus_a, relay_a = worker(path)
+    deals_b, _, _ = worker(path)
+    subscription = bus_a.subscribe('seller')
+
+    deal = deals_a.create('seller', 10, 'звёзды', 'ton')
+    deals_b.set_status(deal['id'], 'confirmed')
+
+    assert relay_a.poll() == 1
+    assert subscription.get(0) == ('deal', {'id': deal['id'], 'status': 'confirmed'})
+    assert relay_a.poll() == 0
+
+
+def test_rolled_back_change_is_not_published(tmp_path):
+    deals, bus, relay = worker(str(tmp_path / 'otc.db'))
+    subscription = bus.subscribe('seller')
+    deal = deals.create('seller', 10, 'звёзды', 'ton')
+
+    def fail(conn, record, old_status):
+        if old_status:
+            raise RuntimeError('откат')
+    deals.transaction_hooks.append(fail)
+    try:
+        deals.set_status(deal['id'], 'confirmed')
+    except RuntimeError:
+        pass
+
+    assert relay.poll() == 0
+    assert subscription.get(0) is None
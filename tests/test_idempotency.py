@@ -0,0 +1,77 @@
+"""Idempotency-Key, когда повтор приходит в другой воркер."""
+
+import threading
+import time
+
+import pytest
+from flask import Flask, g, jsonify
+
+from idempotency import SqliteIdempotencyStore, idempotent
+from sqlite_store import ConnectionPool
+
+
+def worker(path, calls, delay=0.0):
+    """Flask-приложение «воркера» со своим пулом соединений к общей базе."""
+    app = Flask(__name__)
+    store = SqliteIdempotencyStore(ConnectionPool(path))
+
+    @app.before_request
+    def authenticate():
+        g.user = {'user_id': 'buyer'}
+
+    @app.post('/api/deals')
+    @idempotent(store)
+    def create_deal():
+        calls.append(1)
+        time.sleep(delay)
+        return jsonify({'id': f'deal-{len(calls)}'}), 201
+
+    return app.test_client()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'otc.db')
+
+
+def post(client, key, body=None):
+    return client.post('/api/deals', json=body or {'amount': 10},
+                       headers={'Idempotency-Key': key})
+
+
+def test_retry_on_other_worker_replays_response(path):
+    calls = []
+    first, second = worker(path, calls), worker(path, calls)
+
+    created = post(first, 'k1')
+    replayed = post(second, 'k1')
+
+    assert created.status_code == replayed.status_code == 201
+    assert replayed.json == created.json
+    assert replayed.headers['Idempotent-Replayed'] == 'true'
+    assert len(calls) == 1
+    assert post(second, 'k1', {'amount': 99}).status_code == 422
+
+
+def test_concurrent_retry_waits_for_owner(path):
+    calls = []
+    slow, other = worker(path, calls, delay=0.3), worker(path, calls)
+    results = {}
+    owner = threading.Thread(target=lambda: results.setdefault('owner', post(slow, 'k2')))
+    owner.start()
+    time.sleep(0.1)
+    results['retry'] = post(other, 'k2')
+    owner.join()
+
+    assert len(calls) == 1
+    assert results['retry'].json == results['owner'].json
+
+
+def test_expired_and_abandoned_reservations_are_taken_over(path):
+    store = SqliteIdempotencyStore(ConnectionPool(path), ttl=3600, pending_timeout=0)
+    key = ('buyer', '/api/deals', 'k3')
+    _, is_owner = store.reserve(key, 'a')
+    assert is_owner
+    # Владелец «упал», не записав ответ: резерв можно занять снова
+    _, is_owner = store.reserve(key, 'a')
+    assert is_owner
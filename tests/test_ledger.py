@@ -0,0 +1,120 @@
+"""Конкурентные расчёты по сделкам: потоки и процессы, память и SQLite."""
+
+import multiprocessing
+import threading
+
+import pytest
+
+from ledger import Ledger, SqliteLedger, account_key, to_minor
+from sqlite_store import ConnectionPool
+
+SELLERS = 4
+DEALS = 50
+WORKERS = 6
+
+
+def make_deals(owner='seller'):
+    return [{'id': f'{owner}-{i}', 'user_id': f'{owner}{i % SELLERS}',
+             'payment_method': 'ton', 'amount': 1 + i / 100} for i in range(DEALS)]
+
+
+def expected_balances(deals):
+    balances = {}
+    for deal in deals:
+        account = account_key(deal['user_id'], deal['payment_method'])
+        balances[account] = balances.get(account, 0) + to_minor(deal['amount'])
+    return balances
+
+
+def settle_all(ledger, deals):
+    return sum(ledger.settle_deal(deal) for deal in deals)
+
+
+def run_threads(target, args_list):
+    results = [None] * len(args_list)
+
+    def run(i, args):
+        results[i] = target(*args)
+    threads = [threading.Thread(target=run, args=(i, args)) for i, args in enumerate(args_list)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def settle_in_process(path, deals):
+    return settle_all(SqliteLedger(ConnectionPool(path)), deals)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def ledger(request, tmp_path):
+    if request.param == 'memory':
+        return Ledger(shards=4, snapshot_every=16, directory=str(tmp_path / 'ledger'))
+    return SqliteLedger(ConnectionPool(str(tmp_path / 'otc.db')))
+
+
+def assert_settled(ledger, deals):
+    for account, balance in expected_balances(deals).items():
+        assert ledger.balance(account) == balance
+    assert ledger.verify()
+
+
+def test_same_deals_settle_once_across_threads(ledger):
+    deals = make_deals()
+    settled = run_threads(settle_all, [(ledger, deals)] * WORKERS)
+    assert sum(settled) == DEALS
+    assert_settled(ledger, deals)
+
+
+def test_different_deals_across_threads(ledger):
+    batches = [make_deals(f'w{i}-') for i in range(WORKERS)]
+    settled = run_threads(settle_all, [(ledger, deals) for deals in batches])
+    assert settled == [DEALS] * WORKERS
+    assert_settled(ledger, [deal for deals in batches for deal in deals])
+
+
+def test_sqlite_ledger_across_processes(tmp_path):
+    path = str(tmp_path / 'otc.db')
+    SqliteLedger(ConnectionPool(path))
+    same = make_deals()
+    different = [make_deals(f'p{i}-') for i in range(WORKERS)]
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(WORKERS) as pool:
+        settled_same = pool.starmap(settle_in_process, [(path, same)] * WORKERS)
+        settled_different = pool.starmap(settle_in_process, [(path, deals) for deals in different])
+    assert sum(settled_same) == DEALS
+    assert settled_different == [DEALS] * WORKERS
+    assert_settled(SqliteLedger(ConnectionPool(path)),
+                   same + [deal for deals in different for deal in deals])
+
+
+def open_ledger(directory):
+    Ledger(directory=directory)
+
+
+def test_ledger_directory_has_single_owner(tmp_path):
+    # Ledger в памяти нельзя разделить между процессами: второй не откроет каталог
+    directory = str(tmp_path / 'ledger')
+    owner = Ledger(directory=directory)
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        with pytest.raises(RuntimeError):
+            pool.apply(open_ledger, (directory,))
+    assert owner.verify()
+
+
+def test_snapshot_forgets_old_refs_but_keeps_balances(tmp_path):
+    directory = str(tmp_path / 'ledger')
+    ledger = Ledger(shards=2, snapshot_every=8, directory=directory, ref_retention=3600)
+    deals = make_deals()
+    assert settle_all(ledger, deals) == DEALS
+    ledger.snapshot()
+    assert settle_all(ledger, deals) == 0
+
+    # Ref'ы старше окна выпадают из снимка; балансы остаются
+    for shard in ledger._shards:
+        shard.prune_refs(float('inf'))
+        assert not shard.refs
+    balances = {a: ledger.balance(a) for a in expected_balances(deals)}
+    assert balances == expected_balances(deals)
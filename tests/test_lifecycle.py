@@ -0,0 +1,52 @@
+"""Автоотмена сделок, когда воркеры gunicorn делят одну SQLite-базу."""
+
+import pytest
+
+from lifecycle import DealExpiry, parse_timestamp
+from sqlite_store import open_stores
+from store import DealStore, InvalidTransition
+
+TTL = 60
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Два «воркера»: у каждого свой пул соединений и своё колесо таймеров."""
+    path = str(tmp_path / 'otc.db')
+    _, deals_a, _ = open_stores(path)
+    _, deals_b, _ = open_stores(path)
+    return (deals_a, DealExpiry(deals_a, TTL)), (deals_b, DealExpiry(deals_b, TTL))
+
+
+def deadline(deal):
+    return parse_timestamp(deal['created_at']) + TTL + 1
+
+
+def test_expire_skips_deal_confirmed_in_other_worker(workers):
+    (deals_a, expiry_a), (deals_b, _) = workers
+    deal = deals_a.create('seller', 10, 'звёзды', 'ton')
+    # Подтверждение приходит во второй воркер; колесо первого о нём не знает
+    deals_b.set_status(deal['id'], 'confirmed')
+    assert len(expiry_a.wheel) == 1
+
+    assert expiry_a.expire(deadline(deal)) == 0
+    assert deals_a.get(deal['id'])['status'] == 'confirmed'
+    assert [step['to'] for step in deals_b.history(deal['id'])] == ['active', 'confirmed']
+
+
+def test_expire_cancels_deal_left_active(workers):
+    (deals_a, expiry_a), (deals_b, _) = workers
+    deal = deals_a.create('seller', 10, 'звёзды', 'ton')
+
+    assert expiry_a.expire(deadline(deal)) == 1
+    assert deals_b.get(deal['id'])['status'] == 'cancelled'
+
+
+def test_set_status_expected_mismatch_changes_nothing():
+    deals = DealStore()
+    deal = deals.create('seller', 10, 'звёзды', 'ton')
+    deals.set_status(deal['id'], 'confirmed')
+    with pytest.raises(InvalidTransition):
+        deals.set_status(deal['id'], 'cancelled', expected='active')
+    assert deals.get(deal['id'])['status'] == 'confirmed'
+    assert len(deals.history(deal['id'])) == 2
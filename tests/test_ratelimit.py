@@ -0,0 +1,32 @@
+"""Списание токенов по нескольким ключам."""
+
+import pytest
+
+from ratelimit import RateLimiter, SharedBuckets
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    buckets = SharedBuckets(str(tmp_path / 'buckets'), slots=1024)
+    yield RateLimiter(buckets, {'auth': (3.0, 3.0 / 60)})
+    buckets.close()
+
+
+def test_rejected_request_keeps_other_tokens(limiter):
+    # Исчерпываем корзину адреса атакующего
+    for _ in range(3):
+        assert limiter.check('auth', 'ip:attacker') == 0.0
+    assert limiter.check('auth', 'ip:attacker', 'user:victim') > 0
+    assert limiter.check('auth', 'ip:attacker', 'user:victim') > 0
+
+    # Отбитые запросы не потратили токены второго ключа
+    for _ in range(3):
+        assert limiter.check('auth', 'user:victim') == 0.0
+    assert limiter.check('auth', 'user:victim') > 0
+
+
+def test_all_keys_debited_when_allowed(limiter):
+    for _ in range(3):
+        assert limiter.check('auth', 'ip:a', 'ip:b') == 0.0
+    assert limiter.check('auth', 'ip:a') > 0
+    assert limiter.check('auth', 'ip:b') > 0
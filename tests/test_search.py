@@ -0,0 +1,80 @@
+"""Поиск по сделкам и тикетам с фильтрами."""
+
+import pytest
+
+from search import RANK_WINDOW, SearchIndex
+from store import new_id, utcnow_iso
+
+
+def record(**fields):
+    return {'id': new_id(), 'user_id': 'user', 'status': 'open',
+            'created_at': utcnow_iso(), **fields}
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    index.listener('ticket')(
+        record(subject='Жалоба', message='Продавец — мошенник, деньги не вернул'), None)
+    on_deal = index.listener('deal')
+    for i in range(RANK_WINDOW):
+        on_deal(record(status='active', description=f'Осторожно, мошенник №{i}'), None)
+    return index
+
+
+def test_kind_filter_reaches_past_rank_window(index):
+    # Тысяча более свежих сделок не должна вытеснить тикет из окна ранжирования
+    results, next_cursor = index.search('мошенник', kind='ticket')
+    assert [r['kind'] for r in results] == ['ticket']
+    assert next_cursor is None
+
+
+def test_status_filter_reaches_past_rank_window(index):
+    results, _ = index.search('мошенник', status='open')
+    assert [r['kind'] for r in results] == ['ticket']
+
+
+def test_unfiltered_search_ranks_latest_window(index):
+    results, next_cursor = index.search('мошенники', limit=20)
+    assert len(results) == 20
+    assert {r['kind'] for r in results} == {'deal'}
+    assert next_cursor is not None
+
+
+def test_rebuild_interleaves_kinds_by_creation_time():
+    # Тикеты старые, свежие — сделки: окно после перестройки должно
+    # состоять из сделок, как и при наполнении слушателями
+    tickets = [record(subject='Жалоба', message=f'Мошенник №{i}',
+                      created_at=f'2024-01-01T00:00:{i % 60:02d}.{i:06d}Z')
+               for i in range(RANK_WINDOW)]
+    deals = [record(status='active', description=f'Мошенник №{i}',
+                    created_at=f'2025-01-01T00:00:{i % 60:02d}.{i:06d}Z')
+             for i in range(RANK_WINDOW)]
+    index = SearchIndex()
+    assert index.rebuild(iter(deals), iter(tickets))
+    assert len(index) == 2 * RANK_WINDOW
+    results, _ = index.search('мошенник', limit=RANK_WINDOW)
+    assert {r['kind'] for r in results} == {'deal'}
+    # Фильтр по типу по-прежнему находит старые тикеты
+    results, _ = index.search('мошенник', kind='ticket')
+    assert {r['kind'] for r in results} == {'ticket'}
+
+
+def test_concurrent_rebuild_skipped(tmp_path):
+    path = str(tmp_path / 'search.db')
+    first, second = SearchIndex(path), SearchIndex(path)
+    skipped = []
+
+    def deals():
+        for i in range(3):
+            if i == 1:
+                # Второй воркер стартует посреди перестройки первого
+                skipped.append(second.rebuild(iter([]), iter([])))
+            yield record(status='active', description=f'Сделка {i}',
+                         created_at=f'2025-01-01T00:00:0{i}Z')
+
+    assert first.rebuild(deals(), iter([]))
+    assert skipped == [False]
+    assert len(first) == len(second) == 3
+    # Отметка снята: следующая перестройка снова разрешена
+    assert second.rebuild(iter([]), iter([]))
@@ -0,0 +1,66 @@
+"""Счётчики статистики в общей SQLite-базе."""
+
+from sqlite_store import open_stores
+from stats import SqliteStats, count_all
+
+
+def worker(path):
+    _, deals, tickets = open_stores(path)
+    stats = SqliteStats(deals.pool)
+    deals.transaction_hooks.append(stats.on_deal_in_transaction)
+    tickets.transaction_hooks.append(stats.on_ticket_in_transaction)
+    return deals, tickets, stats
+
+
+def scanner(deals, tickets, during_scan=None):
+    def scan(conn):
+        def deals_with_interference():
+            for i, deal in enumerate(deals.iter_all(conn=conn)):
+                if i == 0 and during_scan:
+                    during_scan()
+                yield deal
+        return deals_with_interference(), tickets.iter_all(conn=conn)
+    return scan
+
+
+def nonzero(counters):
+    # Строки с нулём после переходов в таблицах остаются — на выдачу они не влияют
+    deal_count, deal_volume, ticket_count, users_active = counters
+    return ({k: v for k, v in deal_count.items() if v}, {k: v for k, v in deal_volume.items() if v},
+            {k: v for k, v in ticket_count.items() if v}, users_active)
+
+
+def exact(deals, tickets):
+    return nonzero(count_all(deals.iter_all(), tickets.iter_all()).counters())
+
+
+def test_counters_follow_writes_of_all_workers(tmp_path):
+    path = str(tmp_path / 'otc.db')
+    deals_a, tickets_a, stats_a = worker(path)
+    deals_b, _, stats_b = worker(path)
+    deal = deals_a.create('seller', 10, 'звёзды', 'ton')
+    deals_b.create('buyer', 5, 'nft', 'sbp')
+    deals_b.set_status(deal['id'], 'confirmed')
+    tickets_a.create('seller', 'Вопрос', 'Текст')
+
+    assert stats_a.counters() == stats_b.counters()
+    assert nonzero(stats_a.counters()) == exact(deals_a, tickets_a)
+    assert stats_a.snapshot(0)['users']['with_active_deals'] == 1
+
+
+def test_rebuild_repairs_drift_and_keeps_concurrent_writes(tmp_path):
+    path = str(tmp_path / 'otc.db')
+    deals_a, tickets_a, stats_a = worker(path)
+    deals_b, _, _ = worker(path)
+    created = [deals_a.create(f'user{i}', 10 + i, 'звёзды', 'ton') for i in range(5)]
+    with deals_a.pool.transaction() as conn:
+        conn.execute("UPDATE stats_deals SET count = count + 7 WHERE status = 'active'")
+
+    # Смена статуса в другом воркере коммитится посреди подсчёта
+    drift = stats_a.rebuild(scanner(deals_a, tickets_a,
+                                    lambda: deals_b.set_status(created[0]['id'], 'confirmed')))
+
+    assert 'deal_count' in drift
+    assert deals_a.get(created[0]['id'])['status'] == 'confirmed'
+    assert nonzero(stats_a.counters()) == exact(deals_a, tickets_a)
+    assert stats_a.rebuild(scanner(deals_a, tickets_a)) == {}
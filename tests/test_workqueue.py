@@ -0,0 +1,94 @@
+"""Очередь тикетов: конкурентные агенты в потоках и процессах."""
+
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from store import TicketStore
+from workqueue import TicketQueue
+
+TICKETS = 60
+AGENTS = 6
+
+
+def open_queue(path, lease=60):
+    return TicketQueue(path, TicketStore(), lease=lease)
+
+
+def drain(path, agent_id, release_every=0):
+    """Забирает тикеты, пока очередь не опустеет; каждый ``release_every``-й
+    возвращает обратно. Возвращает тикеты, оставшиеся за агентом."""
+    queue = open_queue(path)
+    kept = []
+    claims = 0
+    while (claimed := queue.claim(agent_id)) is not None:
+        claims += 1
+        ticket_id = claimed[0]
+        if release_every and claims % release_every == 0:
+            assert queue.release(ticket_id, agent_id)
+        else:
+            kept.append(ticket_id)
+    return kept
+
+
+def run_threads(path, agents):
+    results = [None] * agents
+
+    def run(i):
+        results[i] = drain(path, f'agent{i}', release_every=3)
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(agents)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run_processes(path, agents):
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(agents) as pool:
+        return pool.starmap(drain, [(path, f'agent{i}', 3) for i in range(agents)])
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    queue = open_queue(path)
+    for i in range(TICKETS):
+        queue.push(f'ticket-{i:03d}')
+    return path
+
+
+@pytest.mark.parametrize('run', [run_threads, run_processes])
+def test_no_ticket_goes_to_two_agents(path, run):
+    results = run(path, AGENTS)
+    claimed = [ticket_id for kept in results for ticket_id in kept]
+    assert len(claimed) == len(set(claimed)) == TICKETS
+    assert open_queue(path).counts() == {'ready': 0, 'leased': TICKETS}
+
+
+def test_expired_leases_return_to_queue(path):
+    queue = open_queue(path)
+    first = [queue.claim('gone', lease=0.2) for _ in range(TICKETS)]
+    assert queue.claim('late') is None
+    time.sleep(0.3)
+    assert queue.counts() == {'ready': TICKETS, 'leased': 0}
+
+    again = run_threads(path, AGENTS)
+    # Брошенные тикеты вернулись на прежние места и достались новым агентам
+    assert sorted(t for kept in again for t in kept) == sorted(t for t, _ in first)
+    assert not queue.renew(first[0][0], 'gone')
+
+
+def test_load_keeps_tickets_pushed_meanwhile(path):
+    tickets = TicketStore()
+    ticket = tickets.create('user', 'Тема', 'Текст')
+    queue = TicketQueue(path, tickets)
+    # Тикет, добавленный другим воркером: в хранилище этого процесса его нет
+    queue.push('other-worker')
+    queue.load()
+    assert len(queue) == TICKETS + 2
+    claimed = {queue.claim('agent')[0] for _ in range(TICKETS + 2)}
+    assert {'other-worker', ticket['id']} <= claimed
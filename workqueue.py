@@ -0,0 +1,202 @@
+"""Очередь тикетов для поддержки: приоритет и аренда на агента.
+
+Каждый незакрытый тикет лежит в SQLite-очереди. Агент забирает следующий
+тикет через ``claim``: в одной транзакции ``BEGIN IMMEDIATE`` просроченные
+аренды возвращаются в очередь, а верхний свободный тикет по частичному
+индексу ``(priority DESC, seq) WHERE agent_id IS NULL`` получает агента и
+срок аренды. Поиск — спуск по B-дереву, O(log n) при любом числе тикетов;
+конкурирующие агенты, в том числе из разных воркеров gunicorn с общим
+файлом, сериализуются на блокировке записи и не получают один тикет дважды.
+
+Аренда продлевается ``renew``, пока агент работает с тикетом; брошенный
+тикет по истечении срока снова достаётся следующему агенту и сохраняет своё
+место в очереди. Закрытый тикет из очереди удаляется, переоткрытый —
+возвращается. ``load`` при старте только добавляет: снимок хранилища
+читается вне транзакции очереди, и удаление по нему стёрло бы тикет,
+добавленный другим воркером тем временем. Тикеты, закрытые, пока очередь
+не слушала, выбрасывает ``next_ticket``, когда до них доходит очередь.
+
+С ``path=':memory:'`` (хранилище ``memory://``) очередь своя у процесса,
+как и сами тикеты: одно соединение на все потоки, операции идут под
+блокировкой.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import nullcontext
+
+from store import InvalidTransition
+
+logger = logging.getLogger('magante.workqueue')
+
+DEFAULT_LEASE = 600
+DONE_STATUSES = ('closed',)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS ticket_queue (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticket_id TEXT NOT NULL UNIQUE,
+    priority INTEGER NOT NULL DEFAULT 0,
+    agent_id TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS ticket_queue_ready ON ticket_queue (priority DESC, seq)
+    WHERE agent_id IS NULL;
+CREATE INDEX IF NOT EXISTS ticket_queue_leased ON ticket_queue (lease_until)
+    WHERE agent_id IS NOT NULL;
+'''
+
+
+class TicketQueue:
+    def __init__(self, path, tickets, lease=DEFAULT_LEASE):
+        self.path = path
+        self.tickets = tickets
+        self.lease = lease
+        self._local = threading.local()
+        self._shared = None
+        self._lock = nullcontext()
+        if path == ':memory:':
+            # Каждое соединение к :memory: — отдельная база, поэтому одно на процесс
+            self._shared = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            self._lock = threading.Lock()
+        with self._lock:
+            self._connect().executescript(SCHEMA)
+        tickets.listeners.append(self.on_ticket)
+
+    def _connect(self):
+        if self._shared is not None:
+            return self._shared
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def _write(self, sql, params=()):
+        with self._lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = conn.execute(sql, params).fetchall()
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return rows
+
+    def load(self):
+        """Добавляет в очередь незакрытые тикеты, которых в ней нет."""
+        pending = set()
+        for status in self.tickets.statuses:
+            if status not in DONE_STATUSES:
+                pending |= self.tickets.ids_by_status(status)
+        with self._lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Порядок seq — порядок id, то есть создания тикетов
+                conn.executemany('INSERT OR IGNORE INTO ticket_queue (ticket_id) VALUES (?)',
+                                 ((i,) for i in sorted(pending)))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def on_ticket(self, ticket, old_status):
+        if ticket['status'] in DONE_STATUSES:
+            if old_status not in DONE_STATUSES:
+                self.remove(ticket['id'])
+        elif old_status is None or old_status in DONE_STATUSES:
+            self.push(ticket['id'])
+
+    def push(self, ticket_id, priority=0):
+        self._execute('INSERT OR IGNORE INTO ticket_queue (ticket_id, priority) VALUES (?, ?)',
+                      (ticket_id, priority))
+
+    def remove(self, ticket_id):
+        self._execute('DELETE FROM ticket_queue WHERE ticket_id = ?', (ticket_id,))
+
+    def set_priority(self, ticket_id, priority):
+        """Чем больше приоритет, тем раньше тикет; False, если тикета нет в очереди."""
+        return bool(self._write('UPDATE ticket_queue SET priority = ? WHERE ticket_id = ? '
+                                'RETURNING seq', (priority, ticket_id)))
+
+    def claim(self, agent_id, lease=None):
+        """Арендует верхний свободный тикет: ``(ticket_id, lease_until)`` или None."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    'UPDATE ticket_queue SET agent_id = NULL, lease_until = NULL '
+                    'WHERE agent_id IS NOT NULL AND lease_until <= ?', (now,))
+                row = conn.execute(
+                    '''UPDATE ticket_queue SET agent_id = ?, lease_until = ?
+                       WHERE seq = (SELECT seq FROM ticket_queue WHERE agent_id IS NULL
+                                    ORDER BY priority DESC, seq LIMIT 1)
+                       RETURNING ticket_id, lease_until''',
+                    (agent_id, now + (lease or self.lease))).fetchone()
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return row
+
+    def renew(self, ticket_id, agent_id, lease=None):
+        """Продлевает свою живую аренду; новый срок или None, если она потеряна."""
+        now = time.time()
+        rows = self._write(
+            'UPDATE ticket_queue SET lease_until = ? '
+            'WHERE ticket_id = ? AND agent_id = ? AND lease_until > ? RETURNING lease_until',
+            (now + (lease or self.lease), ticket_id, agent_id, now))
+        return rows[0][0] if rows else None
+
+    def release(self, ticket_id, agent_id):
+        """Возвращает свой тикет в очередь на прежнее место."""
+        return bool(self._write(
+            'UPDATE ticket_queue SET agent_id = NULL, lease_until = NULL '
+            'WHERE ticket_id = ? AND agent_id = ? AND lease_until > ? RETURNING seq',
+            (ticket_id, agent_id, time.time())))
+
+    def next_ticket(self, agent_id, lease=None):
+        """Следующий тикет для агента: ``(ticket, lease_until)`` или None.
+
+        Тикет из ``open`` переводится в ``in_progress``. Записи, которых уже
+        нет в хранилище или которые закрыли в обход очереди, выбрасываются.
+        """
+        while True:
+            claimed = self.claim(agent_id, lease)
+            if claimed is None:
+                return None
+            ticket_id, lease_until = claimed
+            ticket = self.tickets.get(ticket_id)
+            if ticket is not None and ticket['status'] == 'open':
+                try:
+                    ticket = self.tickets.set_status(ticket_id, 'in_progress')
+                except (KeyError, InvalidTransition):
+                    ticket = self.tickets.get(ticket_id)
+            if ticket is None or ticket['status'] in DONE_STATUSES:
+                logger.warning('⚠️ Тикет %s в очереди, но уже закрыт или удалён', ticket_id)
+                self.remove(ticket_id)
+                continue
+            return ticket, lease_until
+
+    def counts(self):
+        """``{'ready': ..., 'leased': ...}`` с учётом просроченных аренд."""
+        (ready, leased), = self._execute(
+            'SELECT COUNT(*) FILTER (WHERE agent_id IS NULL OR lease_until <= ?), '
+            'COUNT(*) FILTER (WHERE agent_id IS NOT NULL AND lease_until > ?) FROM ticket_queue',
+            (time.time(),) * 2)
+        return {'ready': ready, 'leased': leased}
+
+    def __len__(self):
+        return self._execute('SELECT COUNT(*) FROM ticket_queue')[0][0]